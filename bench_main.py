@@ -0,0 +1,584 @@
+import argparse
+import collections
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+import pandas as pd
+import module.main as main
+import module.s3_upload as s3_upload
+import module.lookup as lookup
+
+
+'''
+    synthetic Solr index page shaped like xmltodict's output, receives the number of docs
+'''
+def make_index_page(num_docs: int) -> dict:
+    docs = []
+    for number in range(num_docs):
+        file_type = 'DLTINS' if number % 3 else 'FULINS'
+        docs.append({
+            'str': [
+                {'@name': 'checksum', '#text': '%032x' % number},
+                {'@name': 'download_link', '#text': 'http://firds.esma.europa.eu/firds/%s_%08d.zip' % (file_type, number)},
+                {'@name': 'id', '#text': str(number)},
+                {'@name': 'published_instrument_file_id', '#text': str(number * 7)},
+                {'@name': 'file_name', '#text': '%s_%08d.zip' % (file_type, number)},
+                {'@name': 'file_type', '#text': file_type},
+            ],
+            'date': [
+                {'@name': 'publication_date', '#text': '2021-01-%02dT00:00:00Z' % (number % 28 + 1)},
+                {'@name': 'timestamp', '#text': '2021-01-%02dT07:57:13Z' % (number % 28 + 1)},
+            ],
+        })
+    return {'response': {'result': {'@numFound': str(num_docs), 'doc': docs}}}
+
+
+'''
+    the original transform_first_xml, eight linear scans per doc and a list of dicts, receives the dictionary
+'''
+def legacy_transform_first_xml(xml_dict: dict) -> pd.DataFrame:
+    docs = xml_dict['response']['result']['doc']
+
+    data = []
+    for doc in docs:
+        checksum = next(item['#text'] for item in doc['str'] if item['@name'] == 'checksum')
+        download_link = next(item['#text'] for item in doc['str'] if item['@name'] == 'download_link')
+        publication_date = next(item['#text'] for item in doc['date'] if item['@name'] == 'publication_date')
+        id_value = next(item['#text'] for item in doc['str'] if item['@name'] == 'id')
+        published_instrument_file_id = next(item['#text'] for item in doc['str'] if item['@name'] == 'published_instrument_file_id')
+        file_name = next(item['#text'] for item in doc['str'] if item['@name'] == 'file_name')
+        file_type = next(item['#text'] for item in doc['str'] if item['@name'] == 'file_type')
+        timestamp = next(item['#text'] for item in doc['date'] if item['@name'] == 'timestamp')
+
+        data.append({
+            'checksum': checksum,
+            'download_link': download_link,
+            'publication_date': publication_date,
+            'id': id_value,
+            'published_instrument_file_id': published_instrument_file_id,
+            'file_name': file_name,
+            'file_type': file_type,
+            'timestamp': timestamp
+        })
+
+    return pd.DataFrame(data)
+
+
+'''
+    best wall time of a few runs, receives the function and its arguments
+'''
+def best_time(func, *args, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+'''
+    compare the legacy and columnar index extraction, receives the doc counts
+'''
+def bench_transform_first_xml(sizes=(10_000, 100_000)):
+    print("%-10s %12s %12s %8s" % ("docs", "legacy (s)", "columnar (s)", "speedup"))
+    for size in sizes:
+        page = make_index_page(size)
+        legacy = best_time(legacy_transform_first_xml, page)
+        columnar = best_time(main.transform_first_xml, page)
+        print("%-10d %12.4f %12.4f %7.1fx" % (size, legacy, columnar, legacy / columnar))
+
+
+'''
+    distinct FinInstrm records shaped like iter_fin_instrm's output, cycling through every record type,
+    receives the number of records
+'''
+def make_fin_instrm_records(num_records: int) -> list:
+    record_types = ['NewRcrd', 'ModfdRcrd', 'TermntdRcrd', 'CancRcrd']
+    currencies = ['EUR', 'USD', 'GBP', 'CHF']
+    records = []
+    for number in range(num_records):
+        records.append({record_types[number % 4]: {
+            'FinInstrmGnlAttrbts': {
+                'Id': 'DE%010d' % number,
+                'FullNm': 'Instrument %d' % number,
+                'ShrtNm': 'INSTR/%d' % number,
+                'ClssfctnTp': 'FFICSX',
+                'NtnlCcy': currencies[number % 4],
+                'CmmdtyDerivInd': 'false',
+            },
+            'Issr': '5493%016d' % (number % 1000),
+            'TradgVnRltdAttrbts': {'Id': 'XEUR', 'IssrReq': 'false'},
+        }})
+    return records
+
+
+'''
+    the original extraction loop, TermntdRcrd only with a KeyError per other record, receives the instruments
+'''
+def legacy_iter_instrument_rows(instruments):
+    for instrm in instruments:
+        try:
+            instrm_gnl_attrbts = instrm['TermntdRcrd']
+
+            id_ = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['Id']
+            full_nm = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['FullNm']
+            clssfctn_tp = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['ClssfctnTp']
+            cmmdty_deriv_ind = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['CmmdtyDerivInd']
+            ntnl_ccy = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['NtnlCcy']
+            issr = instrm_gnl_attrbts['Issr']
+
+            yield [id_, full_nm, clssfctn_tp, cmmdty_deriv_ind, ntnl_ccy, issr]
+
+        except KeyError:
+            pass
+
+
+'''
+    per-record cost of the legacy and dispatching extractors over a stream of records,
+    receives the number of records
+'''
+def bench_instrument_rows(num_records: int = 2_000_000):
+    sample = make_fin_instrm_records(1000)
+
+    def consume(extractor):
+        collections.deque(extractor(itertools.islice(itertools.cycle(sample), num_records)), maxlen=0)
+
+    legacy = best_time(consume, legacy_iter_instrument_rows)
+    dispatching = best_time(consume, main.iter_instrument_rows)
+    print("%-10s %14s %14s" % ("records", "legacy ns/rec", "all types ns/rec"))
+    print("%-10d %14.0f %14.0f" % (num_records, legacy / num_records * 1e9, dispatching / num_records * 1e9))
+
+
+# Report element and document namespace of each file type
+REPORT_TAGS = {
+    'DLTINS': ('FinInstrmRptgRefDataDltaRpt', 'urn:iso:std:iso:20022:tech:xsd:auth.036.001.02'),
+    'FULINS': ('FinInstrmRptgRefDataRpt', 'urn:iso:std:iso:20022:tech:xsd:auth.017.001.02'),
+}
+
+
+'''
+    write a synthetic DLTINS or FULINS file with the records of make_fin_instrm_records, DLTINS records are
+    FinInstrm elements wrapping a record of each type and FULINS records are bare RefData elements, as in the
+    auth.036 and auth.017 files FIRDS publishes, receives the path, number of records and file type
+'''
+def write_dltins_xml(path: str, num_records: int, sample_size: int = 1000, file_type: str = 'DLTINS'):
+    sample = make_fin_instrm_records(min(num_records, sample_size))
+    chunks = []
+    for instrm in sample:
+        (record_type, record), = instrm.items()
+        gnl_attrbts = ''.join('<%s>%s</%s>' % (key, value, key) for key, value in record['FinInstrmGnlAttrbts'].items())
+        venue = ''.join('<%s>%s</%s>' % (key, value, key) for key, value in record['TradgVnRltdAttrbts'].items())
+        fields = ('<FinInstrmGnlAttrbts>%s</FinInstrmGnlAttrbts><Issr>%s</Issr><TradgVnRltdAttrbts>%s</TradgVnRltdAttrbts>'
+                  % (gnl_attrbts, record['Issr'], venue))
+        if file_type == 'FULINS':
+            chunks.append('<RefData>%s</RefData>\n' % fields)
+        else:
+            chunks.append('<FinInstrm><%s>%s</%s></FinInstrm>\n' % (record_type, fields, record_type))
+
+    report_tag, namespace = REPORT_TAGS[file_type]
+    with open(path, 'w', encoding='utf-8') as xml_file:
+        xml_file.write('<BizData xmlns="urn:iso:std:iso:20022:tech:xsd:head.003.001.01"><Pyld>'
+                       '<Document xmlns="%s"><%s>\n' % (namespace, report_tag))
+        for number in range(num_records):
+            xml_file.write(chunks[number % len(chunks)])
+        xml_file.write('</%s></Document></Pyld></BizData>\n' % report_tag)
+
+
+'''
+    per-record cost of parsing a synthetic file and writing its csv rows with each extractor,
+    receives the number of records
+'''
+def bench_dltins_file(num_records: int = 2_000_000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_path = os.path.join(tmp_dir, 'DLTINS_bench.xml')
+        write_dltins_xml(xml_path, num_records)
+
+        def parse(extractor):
+            with open(os.devnull, 'w', newline='') as output:
+                csv.writer(output).writerows(extractor(main.iter_fin_instrm(xml_path)))
+
+        legacy = best_time(parse, legacy_iter_instrument_rows, repeat=1)
+        dispatching = best_time(parse, main.iter_instrument_rows, repeat=1)
+        print("%-10s %14s %14s" % ("records", "legacy us/rec", "all types us/rec"))
+        print("%-10d %14.2f %14.2f" % (num_records, legacy / num_records * 1e6, dispatching / num_records * 1e6))
+
+
+'''
+    cpu time and tracemalloc peak of a function, receives the function
+'''
+def cpu_and_peak(func) -> tuple:
+    start = time.process_time()
+    func()
+    seconds = time.process_time() - start
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+'''
+    per-record cpu time and peak heap of writing a synthetic file through record dicts and straight from
+    its elements, to csv and to Parquet, which buffers a row group of rows, receives the number of records
+'''
+def bench_record_layer(num_records: int = 200_000):
+    from module.sinks import open_sink
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_path = os.path.join(tmp_dir, 'DLTINS_bench.xml')
+        write_dltins_xml(xml_path, num_records)
+
+        def through_dicts(output_format):
+            with open_sink(output_format, os.path.join(tmp_dir, 'dicts.' + output_format), main.CSV_HEADER) as sink:
+                sink.write_many([*row] for row in main.iter_instrument_rows(main.iter_fin_instrm(xml_path)))
+
+        def from_elements(output_format):
+            main.write_xml_output(xml_path, os.path.join(tmp_dir, 'elements.' + output_format), output_format)
+
+        print("%-8s %-10s %16s %16s %16s %16s" % ("format", "records", "dicts us/rec", "elements us/rec",
+                                                  "dicts peak MiB", "elements peak MiB"))
+        for output_format in ('csv', 'parquet'):
+            dicts = cpu_and_peak(lambda: through_dicts(output_format))
+            elements = cpu_and_peak(lambda: from_elements(output_format))
+            print("%-8s %-10d %16.2f %16.2f %16.1f %16.1f" % (
+                output_format, num_records, dicts[0] / num_records * 1e6, elements[0] / num_records * 1e6,
+                dicts[1] / 1024 ** 2, elements[1] / 1024 ** 2))
+
+
+'''
+    wall time of parsing one synthetic file in one piece and split over shard workers, receives the number
+    of records and the worker counts
+'''
+def bench_sharded_file(num_records: int = 2_000_000, worker_counts=(2, 4, 8)):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_path = os.path.join(tmp_dir, 'FULINS_bench.xml')
+        write_dltins_xml(xml_path, num_records)
+
+        def single():
+            main.write_xml_output(open(xml_path, 'rb'), os.path.join(tmp_dir, 'single.csv'))
+
+        baseline = best_time(single, repeat=1)
+        print("%-10s %8s %10s %8s" % ("records", "workers", "wall (s)", "speedup"))
+        print("%-10d %8d %10.2f %7.1fx" % (num_records, 1, baseline, 1.0))
+        for workers in worker_counts:
+            sharded = best_time(main.process_xml_file_sharded, xml_path, os.path.join(tmp_dir, 'sharded.csv'), workers,
+                                repeat=1)
+            print("%-10d %8d %10.2f %7.1fx" % (num_records, workers, sharded, baseline / sharded))
+
+
+'''
+    zip a synthetic DLTINS or FULINS file the way FIRDS publishes them, returns the md5 of the zip,
+    receives the zip path, number of records and file type
+'''
+def write_firds_zip(zip_path: str, num_records: int, file_type: str = 'DLTINS') -> str:
+    xml_name = os.path.splitext(os.path.basename(zip_path))[0] + '.xml'
+    xml_path = os.path.join(os.path.dirname(zip_path), xml_name)
+    write_dltins_xml(xml_path, num_records, file_type=file_type)
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(xml_path, xml_name)
+    os.remove(xml_path)
+
+    with open(zip_path, 'rb') as zip_file:
+        return hashlib.md5(zip_file.read()).hexdigest()
+
+
+'''
+    Solr xml response holding a page of index docs, receives the docs as field dicts, the total and first row
+'''
+def index_response_xml(docs: list, num_found: int, start: int = 0) -> bytes:
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<response><result name="response" numFound="%d" start="%d">'
+             % (num_found, start)]
+    for doc in docs:
+        parts.append('<doc>')
+        for name, value in doc.items():
+            tag = 'date' if name in ('publication_date', 'timestamp') else 'str'
+            parts.append('<%s name="%s">%s</%s>' % (tag, name, escape(str(value)), tag))
+        parts.append('</doc>')
+    parts.append('</result></response>')
+    return ''.join(parts).encode('utf-8')
+
+
+'''
+    local stand-in for the FIRDS registry, answers Solr index queries by page and serves the zips of a folder
+'''
+class FirdsHandler(BaseHTTPRequestHandler):
+    docs = []
+    files_dir = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/solr/select':
+            query = parse_qs(url.query)
+            start, rows = int(query.get('start', ['0'])[0]), int(query.get('rows', ['10'])[0])
+            body = index_response_xml(self.docs[start:start + rows], len(self.docs), start)
+        else:
+            try:
+                with open(os.path.join(self.files_dir, os.path.basename(url.path)), 'rb') as served:
+                    body = served.read()
+            except FileNotFoundError:
+                self.send_error(404)
+                return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+'''
+    start the local registry on a free port, returns the server and its base url, receives the docs and zip folder
+'''
+def start_firds_server(docs: list, files_dir: str):
+    handler = type('BoundFirdsHandler', (FirdsHandler,), {'docs': docs, 'files_dir': files_dir})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+'''
+    index docs of synthetic FIRDS files, receives the base url, the file names with their checksums and file types
+'''
+def make_index_docs(base_url: str, files: list) -> list:
+    docs = []
+    for number, (file_name, checksum, file_type) in enumerate(files):
+        docs.append({
+            'checksum': checksum,
+            'download_link': '%s/files/%s' % (base_url, file_name),
+            'publication_date': '2021-01-18T00:00:00Z',
+            'id': str(number),
+            'published_instrument_file_id': str(number),
+            'file_name': file_name,
+            'file_type': file_type,
+            'timestamp': '2021-01-18T07:57:13Z',
+        })
+    return docs
+
+
+'''
+    wall time of transform_first_xml over index pages holding a number of docs, receives the number of docs
+'''
+def bench_index(num_records: int) -> float:
+    pages = [make_index_page(num_records)]
+    return best_time(main.transform_first_xml, pages)
+
+
+'''
+    wall time of streaming a synthetic file's records to S3 with transform_xml_to_csv, receives the number of records
+'''
+def bench_xml_to_csv(num_records: int) -> float:
+    from moto import mock_aws
+
+    with tempfile.TemporaryDirectory() as tmp_dir, mock_aws():
+        xml_path = os.path.join(tmp_dir, 'DLTINS_bench.xml')
+        write_dltins_xml(xml_path, num_records)
+        s3_upload._s3_client = None
+        s3_upload.get_s3_client().create_bucket(Bucket=main.s3_bucket_name)
+        try:
+            return best_time(lambda: main.transform_xml_to_csv(xml_path))
+        finally:
+            s3_upload._s3_client = None
+
+
+'''
+    wall time of the whole main flow, index and zips served by a local http server and S3 by moto,
+    the records are split over a DLTINS and a FULINS file, receives the number of records
+'''
+def bench_end_to_end(num_records: int) -> float:
+    from moto import mock_aws
+
+    with tempfile.TemporaryDirectory() as tmp_dir, mock_aws():
+        files_dir = os.path.join(tmp_dir, 'files')
+        os.makedirs(files_dir)
+        files = []
+        for file_type, share in (('DLTINS', num_records // 2), ('FULINS', num_records - num_records // 2)):
+            file_name = '%s_20210118_01of01.zip' % file_type
+            files.append((file_name, write_firds_zip(os.path.join(files_dir, file_name), share, file_type), file_type))
+
+        docs = []
+        server, base_url = start_firds_server(docs, files_dir)
+        docs.extend(make_index_docs(base_url, files))
+        s3_upload._s3_client = None
+        s3_upload.get_s3_client().create_bucket(Bucket=main.s3_bucket_name)
+
+        def run():
+            # A fresh cache each run, so every run downloads and parses
+            run_dir = tempfile.mkdtemp(dir=tmp_dir)
+            main.main(output_dir=os.path.join(run_dir, 'output'), cache_dir=os.path.join(run_dir, 'cache'))
+
+        try:
+            with patch.object(main, 'INDEX_URL', base_url + '/solr/select'):
+                return best_time(run, repeat=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+            s3_upload._s3_client = None
+
+
+'''
+    wall time of as many ISIN lookups as the index holds instruments, built from synthetic records,
+    receives the number of records
+'''
+def bench_lookup(num_records: int) -> float:
+    rows = list(main.iter_instrument_rows(make_fin_instrm_records(num_records)))
+    isins = [row[0] for row in rows[::7]] * 7
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'lookup.idx')
+        lookup.build_lookup_index(rows, main.CSV_HEADER, path)
+        with lookup.LookupIndex(path) as index:
+            return best_time(lambda: collections.deque(map(index.get, isins[:num_records]), maxlen=0))
+
+
+BENCHMARKS = {
+    'transform_first_xml': bench_index,
+    'transform_xml_to_csv': bench_xml_to_csv,
+    'main': bench_end_to_end,
+    'lookup': bench_lookup,
+}
+
+# Modules whose cold import is measured, and the dependencies importing them should leave unloaded
+IMPORT_BENCHMARKS = ('module.main', 'module.cli')
+HEAVY_MODULES = ('pandas', 'numpy', 'xmltodict', 'requests', 'urllib3', 'boto3', 'botocore', 'pyarrow')
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baselines.json')
+
+# A run slower than its baseline by more than this fraction fails
+REGRESSION_THRESHOLD = 0.25
+
+
+'''
+    run the benchmarks at each size, receives the benchmark names and sizes
+'''
+def run_benchmarks(names: list, sizes: list) -> dict:
+    results = {}
+    for name in names:
+        for size in sizes:
+            seconds = BENCHMARKS[name](size)
+            results['%s@%d' % (name, size)] = {'seconds': seconds, 'us_per_record': seconds / size * 1e6}
+            print("%-32s %12.3f s %10.2f us/record" % ('%s@%d' % (name, size), seconds, seconds / size * 1e6))
+    return results
+
+
+'''
+    cold import of a module in a fresh interpreter, returns the best seconds and the heavy modules it loaded,
+    receives the module name and number of runs
+'''
+def bench_import(module: str, repeat: int = 5) -> tuple:
+    script = ('import sys, time\n'
+              'start = time.perf_counter()\n'
+              'import %s\n'
+              'seconds = time.perf_counter() - start\n'
+              'print(seconds, *[name for name in %r if name in sys.modules])' % (module, HEAVY_MODULES))
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        timings.append(float(output[0]))
+    return min(timings), output[1:]
+
+
+'''
+    run the import benchmarks, receives the module names
+'''
+def run_import_benchmarks(modules: list) -> dict:
+    results = {}
+    for module in modules:
+        seconds, loaded = bench_import(module)
+        results['import:%s' % module] = {'seconds': seconds}
+        print("%-32s %12.3f s   loads %s" % ('import:%s' % module, seconds, ', '.join(loaded) or 'no heavy module'))
+    return results
+
+
+'''
+    benchmarks slower than their baseline by more than the threshold, receives the results, baselines and threshold
+'''
+def find_regressions(results: dict, baselines: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline and result['seconds'] > baseline['seconds'] * (1 + threshold):
+            regressions.append((key, baseline['seconds'], result['seconds']))
+    return regressions
+
+
+'''
+    the original comparisons of the legacy and current implementations
+'''
+def run_legacy_comparisons():
+    bench_transform_first_xml()
+    bench_instrument_rows()
+    bench_dltins_file()
+    bench_record_layer()
+    bench_sharded_file()
+
+
+'''
+    command line of the benchmark suite, exits with 1 when a benchmark regressed past its baseline
+'''
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the FIRDS pipeline against stored baselines.")
+    parser.add_argument('--records', type=int, nargs='+', default=[10_000, 100_000],
+                        help="record counts to run each benchmark at, 10k up to 10M")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                        help="benchmarks to run")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file to compare with or save to")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed slowdown over the baseline, as a fraction")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baselines")
+    parser.add_argument('--legacy', action='store_true', help="run the legacy-vs-current comparisons instead")
+    parser.add_argument('--import-time', action='store_true',
+                        help="measure the cold import of the package modules instead")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.legacy:
+        run_legacy_comparisons()
+        return 0
+
+    if args.import_time:
+        results = run_import_benchmarks(list(IMPORT_BENCHMARKS))
+    else:
+        results = run_benchmarks(args.only, args.records)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        print("Saved %d baselines to %s." % (len(results), args.baseline))
+        return 0
+
+    regressions = find_regressions(results, baselines, args.threshold)
+    for key, baseline, seconds in regressions:
+        print("REGRESSION %s: %.3f s against a baseline of %.3f s (+%.0f%%)."
+              % (key, seconds, baseline, (seconds / baseline - 1) * 100))
+    missing = [key for key in results if key not in baselines]
+    if missing:
+        print("No baseline for %s, run with --save-baseline to store one." % ', '.join(missing))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,91 @@
+import logging
+import os
+import shutil
+
+
+logger = logging.getLogger(__name__)
+
+
+# Where cached zips and per-file csv outputs live, and how large the folder may grow
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+
+'''
+    path of a cache entry, receives the cache folder, the FIRDS checksum and the entry suffix
+'''
+def cache_path(cache_dir: str, checksum: str, suffix: str) -> str:
+    return os.path.join(cache_dir, checksum.lower() + suffix)
+
+
+'''
+    look up a cache entry and mark it as recently used, receives the cache folder, checksum and suffix
+'''
+def cache_get(cache_dir: str, checksum: str, suffix: str) -> str:
+    if not checksum:
+        return None
+
+    path = cache_path(cache_dir, checksum, suffix)
+    try:
+        # The modification time is the LRU clock
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    logger.info("Cache hit for %s.", os.path.basename(path))
+    return path
+
+
+'''
+    bytes of a file, or of every file under a folder, receives the path
+'''
+def path_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+'''
+    move a finished file, or a folder of files, into the cache, receives the cache folder, checksum, suffix
+    and the path
+'''
+def cache_put(cache_dir: str, checksum: str, suffix: str, source_path: str) -> str:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, checksum, suffix)
+    if os.path.abspath(source_path) != path:
+        os.replace(source_path, path)
+    os.utime(path)
+    return path
+
+
+'''
+    delete the least recently used entries until the cache fits its size limit, receives the cache folder and limit
+'''
+def evict_cache(cache_dir: str, max_bytes: int = CACHE_MAX_BYTES) -> list:
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        elif entry.is_dir():
+            # A partitioned output is one entry, used and evicted as a whole
+            entries.append((entry.stat().st_mtime, path_size(entry.path), entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        total -= size
+        evicted.append(path)
+
+    if evicted:
+        logger.info("Evicted %d cache entries, %d bytes left.", len(evicted), total)
+    return evicted
@@ -0,0 +1,160 @@
+import argparse
+import logging
+import re
+import sys
+from module.downloader import DEFAULT_CONCURRENCY
+from module.cache import CACHE_DIR, CACHE_MAX_BYTES
+from module.sinks import SINKS
+from module.journal import JOURNAL_PATH
+from module.partitions import PARTITION_KEYS
+import module.main as main
+
+
+logger = logging.getLogger(__name__)
+
+
+# Multipliers of the size suffixes accepted for --memory-budget and --cache-max-size, powers of 1024
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*$', re.IGNORECASE)
+
+
+'''
+    bytes of a size such as 512M, 4G or 1.5GiB, receives the text
+'''
+def parse_size(text: str) -> int:
+    match = _SIZE.match(text)
+    if not match:
+        raise argparse.ArgumentTypeError("invalid size %r, expected a number with an optional K/M/G/T suffix" % text)
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+'''
+    a count of at least one, receives the text
+'''
+def positive_int(text: str) -> int:
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError("expected a positive integer, got %r" % text)
+    return value
+
+
+'''
+    human readable size, '?' when unknown, receives the bytes
+'''
+def format_size(size) -> str:
+    if size is None:
+        return '?'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit) if unit != 'B' else '%d B' % size
+        size /= 1024
+    return '%.1f TiB' % size
+
+
+'''
+    argument parser of the command line
+'''
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m module.cli',
+                                     description="Download FIRDS instrument files and convert them to csv or parquet.")
+    parser.add_argument('--from-date', default=main.DEFAULT_FROM_DATE,
+                        help="start of the publication date window (default %(default)s)")
+    parser.add_argument('--to-date', default=main.DEFAULT_TO_DATE,
+                        help="end of the publication date window (default %(default)s)")
+    parser.add_argument('--file-types', nargs='+', default=list(main.FILE_TYPES), metavar='TYPE',
+                        help="file types to process (default %(default)s)")
+    parser.add_argument('--download-concurrency', type=positive_int, default=DEFAULT_CONCURRENCY, metavar='N',
+                        help="concurrent index and file downloads (default %(default)s)")
+    parser.add_argument('--workers', type=positive_int, default=None, metavar='N',
+                        help="parse processes (default one per cpu)")
+    parser.add_argument('--shard-workers', type=positive_int, default=1, metavar='N',
+                        help="processes splitting each large xml file (default %(default)s)")
+    parser.add_argument('--output-format', choices=sorted(SINKS), default=main.OUTPUT_FORMAT,
+                        help="output format (default %(default)s)")
+    parser.add_argument('--sink', default=None,
+                        help="s3://bucket/prefix or local path of the merged output (default s3://%s/)"
+                             % main.s3_bucket_name)
+    parser.add_argument('--columns', nargs='+', default=None, metavar='PATH',
+                        help="output columns, dotted paths inside FinInstrm plus RecordType")
+    parser.add_argument('--output-dir', default=main.OUTPUT_DIR, help="folder of the per-file outputs")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="folder of the download and output cache")
+    parser.add_argument('--cache-max-size', type=parse_size, default=CACHE_MAX_BYTES, metavar='SIZE',
+                        help="size the cache is trimmed to after a run, least recently used entries first, "
+                             "such as 50G (default %s)" % format_size(CACHE_MAX_BYTES))
+    parser.add_argument('--memory-budget', type=parse_size, default=None, metavar='SIZE',
+                        help="memory the parse processes may use together, such as 4G, lowers --workers to fit")
+    parser.add_argument('--partition-by', nargs='+', choices=list(PARTITION_KEYS), default=None, metavar='KEY',
+                        help="write a Hive-style folder of part files per partition, keys %s" % ', '.join(PARTITION_KEYS))
+    parser.add_argument('--lookup-index', default=None, metavar='PATH',
+                        help="also build a memory-mapped ISIN and issuer lookup index of the run's instruments")
+    parser.add_argument('--master', default=None, metavar='PATH',
+                        help="keep this instrument master up to date instead of writing an output")
+    parser.add_argument('--metrics-json', default=None, metavar='PATH', help="write a run summary as JSON")
+    parser.add_argument('--prometheus', default=None, metavar='PATH', help="write stage totals for Prometheus")
+    parser.add_argument('--statsd', default=None, metavar='HOST[:PORT]', help="send stage totals to StatsD")
+    parser.add_argument('--journal', nargs='?', const=JOURNAL_PATH, default=None, metavar='PATH',
+                        help="record progress in a run journal and resume an interrupted run from it "
+                             "(default path %s)" % JOURNAL_PATH)
+    parser.add_argument('--dry-run', action='store_true',
+                        help="list the files the run would process with size estimates and exit")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="logging level (default %(default)s)")
+    return parser
+
+
+'''
+    print the files of a dry run and their totals, receives the plan and output
+'''
+def print_plan(plan: list, out=None):
+    out = out or sys.stdout
+    print("%-40s %-7s %-10s %6s %12s %12s %12s %12s" % ('file', 'type', 'published', 'cached', 'zip', 'xml (est)',
+                                                        'records (est)', 'csv (est)'), file=out)
+    for entry in plan:
+        records = entry['estimated_records']
+        print("%-40s %-7s %-10s %6s %12s %12s %12s %12s" % (
+            entry['file_name'], entry['file_type'], entry['publication_date'][:10], 'yes' if entry['cached'] else 'no',
+            format_size(entry['zip_bytes']), format_size(entry['estimated_xml_bytes']),
+            '?' if records is None else '{:,}'.format(records), format_size(entry['estimated_csv_bytes'])), file=out)
+
+    def total(key):
+        return sum(entry[key] for entry in plan if entry[key] is not None)
+    unknown = sum(entry['zip_bytes'] is None for entry in plan)
+    print("%d files, %s to download (%d cached), about %s of xml, %s records and %s of csv%s." % (
+        len(plan), format_size(total('zip_bytes') - sum(entry['zip_bytes'] or 0 for entry in plan if entry['cached'])),
+        sum(entry['cached'] for entry in plan), format_size(total('estimated_xml_bytes')),
+        '{:,}'.format(total('estimated_records')), format_size(total('estimated_csv_bytes')),
+        ", %d sizes unknown" % unknown if unknown else ''), file=out)
+
+
+'''
+    run the command line, returns the exit status, receives the arguments
+'''
+def run(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_types = tuple(args.file_types)
+
+    if args.dry_run:
+        plan = main.plan_run(args.from_date, args.to_date, file_types, args.cache_dir, args.download_concurrency)
+        print_plan(plan)
+        workers = main.workers_for_budget(args.memory_budget, args.workers, args.shard_workers)
+        print("Would run %d parse workers with %d shard workers each." % (workers, args.shard_workers))
+        return 0 if plan else 1
+
+    finished = main.main(from_date=args.from_date, to_date=args.to_date, output_format=args.output_format,
+                         master_path=args.master, columns=args.columns or main.CSV_HEADER,
+                         metrics_path=args.metrics_json, prometheus_path=args.prometheus, statsd_address=args.statsd,
+                         output_dir=args.output_dir, cache_dir=args.cache_dir, file_types=file_types,
+                         workers=args.workers, download_concurrency=args.download_concurrency,
+                         shard_workers=args.shard_workers, sink=args.sink, memory_budget=args.memory_budget,
+                         journal_path=args.journal, partition_by=tuple(args.partition_by) if args.partition_by else None,
+                         lookup_path=args.lookup_index, cache_max_bytes=args.cache_max_size)
+    # Schedulers see a run that left files out as failed
+    return 0 if finished else 1
+
+
+if __name__ == '__main__':
+    sys.exit(run())
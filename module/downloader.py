@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+# Size of each chunk streamed from the response to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Number of archives fetched at once, also the size of the connection pool
+DEFAULT_CONCURRENCY = 4
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+# Suffix of a partially downloaded file, kept so the next attempt can resume it
+PART_SUFFIX = '.part'
+
+
+'''
+    create a session with a pooled, retrying adapter, receives the pool size
+'''
+def create_session(pool_size: int = DEFAULT_CONCURRENCY) -> 'requests.Session':
+    # requests is imported on first use, it takes longer to import than a short run takes to do its work
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+'''
+    md5 of a file read in chunks, receives the path
+'''
+def file_md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+'''
+    stream a url to disk, resuming a previous .part file with an HTTP Range request and
+    checking the result against the FIRDS md5 checksum, receives the session, url, save path and checksum
+'''
+def download_file(session: 'requests.Session', url: str, save_path: str, checksum: str = None, timeout=DEFAULT_TIMEOUT) -> str:
+    import requests
+    file_name = os.path.basename(save_path)
+
+    if checksum and os.path.exists(save_path) and file_md5(save_path) == checksum.lower():
+        logger.info("%s already downloaded.", file_name)
+        return save_path
+
+    part_path = save_path + PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+
+    start = time.perf_counter()
+    md5 = hashlib.md5()
+    try:
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 206:
+                mode = 'ab'
+            elif response.status_code == 200:
+                # The server ignored the Range header, start over
+                mode = 'wb'
+                offset = 0
+            elif response.status_code == 416 and offset:
+                # The .part file already holds the whole body
+                mode = None
+            else:
+                logger.error("Failed to download the file. Status code: %d", response.status_code)
+                return None
+
+            if mode == 'ab' or mode is None:
+                with open(part_path, 'rb') as part:
+                    for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+                        md5.update(chunk)
+
+            if mode is not None:
+                with open(part_path, mode) as part:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        part.write(chunk)
+                        md5.update(chunk)
+    except requests.RequestException as e:
+        logger.error("Error while downloading %s: %s", url, e)
+        return None
+
+    if checksum and md5.hexdigest() != checksum.lower():
+        logger.error("Checksum mismatch for %s.", file_name)
+        os.remove(part_path)
+        return None
+
+    os.replace(part_path, save_path)
+    logger.info("%s downloaded successfully in %.2fs (resumed at byte %d).", file_name, time.perf_counter() - start, offset)
+    return save_path
+
+
+'''
+    download several files at once with a bounded number of concurrent requests,
+    receives dicts with download_link, file_name and optional checksum, returns the paths in the same order
+'''
+def download_files(items: list, save_dir: str, concurrency: int = DEFAULT_CONCURRENCY, session: 'requests.Session' = None) -> list:
+    os.makedirs(save_dir, exist_ok=True)
+    session = session or create_session(concurrency)
+
+    def fetch(item):
+        save_path = os.path.join(save_dir, item['file_name'])
+        return download_file(session, item['download_link'], save_path, item.get('checksum'))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(fetch, items))
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+
+logger = logging.getLogger(__name__)
+
+
+# Run-state journal of interrupted runs, kept out of the cache folder so eviction never removes it
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_journal.sqlite')
+
+# FinInstrm records parsed between two checkpoints of a file, each checkpoint flushes the output
+CHECKPOINT_RECORDS = 100_000
+
+# Stages a file goes through, in order
+STAGE_DOWNLOADED = 'downloaded'
+STAGE_PARSING = 'parsing'
+STAGE_PARSED = 'parsed'
+
+# Connection of each process and journal path, a forked worker never reuses its parent's connection
+_connections = {}
+
+
+'''
+    open the journal and create its tables if needed, receives the path
+'''
+def open_journal(path: str = JOURNAL_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Worker threads of the download stage share the connection of their process
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS runs ("
+        "run_key TEXT PRIMARY KEY, index_rows TEXT, finished INTEGER DEFAULT 0, "
+        "updated_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS files ("
+        "file_key TEXT, variant TEXT, file_name TEXT, stage TEXT, zip_path TEXT, output_path TEXT, "
+        "records INTEGER DEFAULT 0, output_bytes INTEGER DEFAULT 0, xml_offset INTEGER, updated_at TEXT DEFAULT CURRENT_TIMESTAMP, "
+        "PRIMARY KEY (file_key, variant)) WITHOUT ROWID"
+    )
+    return conn
+
+
+'''
+    the journal connection of this process, opened on first use, receives the path
+'''
+def get_journal(path: str = JOURNAL_PATH) -> sqlite3.Connection:
+    key = (os.getpid(), path)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = _connections[key] = open_journal(path)
+    return conn
+
+
+'''
+    key of a run, the same arguments resume the same run, receives the values that define the run
+'''
+def run_key(*values) -> str:
+    return hashlib.md5(json.dumps(values, default=str).encode()).hexdigest()
+
+
+'''
+    key of a file in the journal, its checksum or else its index id, receives the index row
+'''
+def file_key(file_row: dict) -> str:
+    return file_row.get('checksum') or file_row.get('id') or file_row['file_name']
+
+
+'''
+    index rows saved by an unfinished run, None when the run has to fetch the index, receives the connection and run key
+'''
+def load_index(conn: sqlite3.Connection, key: str) -> list:
+    row = conn.execute("SELECT index_rows FROM runs WHERE run_key = ? AND finished = 0", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+'''
+    save the index rows of a run so a restart does not fetch them again, receives the connection, run key and rows
+'''
+def save_index(conn: sqlite3.Connection, key: str, rows: list):
+    conn.execute("INSERT OR REPLACE INTO runs (run_key, index_rows, finished) VALUES (?, ?, 0)",
+                 (key, json.dumps(rows, default=str)))
+
+
+'''
+    mark a run as finished, the next run with the same key starts from a fresh index, receives the connection and run key
+'''
+def finish_run(conn: sqlite3.Connection, key: str):
+    conn.execute("UPDATE runs SET finished = 1, index_rows = NULL, updated_at = CURRENT_TIMESTAMP WHERE run_key = ?",
+                 (key,))
+
+
+'''
+    the journal entry of a file as a dict, None when it has none, receives the connection, file key and variant
+'''
+def file_state(conn: sqlite3.Connection, key: str, variant: str) -> dict:
+    cursor = conn.execute("SELECT * FROM files WHERE file_key = ? AND variant = ?", (key, variant))
+    row = cursor.fetchone()
+    return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+
+'''
+    record the stage a file reached, the fields not given keep their value except the xml offset, which is only
+    valid for the checkpoint it was recorded with, receives the connection, file key, variant, stage and the
+    fields to set
+'''
+def mark_stage(conn: sqlite3.Connection, key: str, variant: str, stage: str, file_name: str = None,
+               zip_path: str = None, output_path: str = None, records: int = None, output_bytes: int = None,
+               xml_offset: int = None):
+    conn.execute(
+        "INSERT INTO files (file_key, variant, file_name, stage, zip_path, output_path, records, output_bytes, "
+        "xml_offset) VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, 0), COALESCE(?, 0), ?) "
+        "ON CONFLICT (file_key, variant) DO UPDATE SET stage = excluded.stage, "
+        "file_name = COALESCE(?, file_name), zip_path = COALESCE(?, zip_path), "
+        "output_path = COALESCE(?, output_path), records = COALESCE(?, records), "
+        "output_bytes = COALESCE(?, output_bytes), xml_offset = ?, updated_at = CURRENT_TIMESTAMP",
+        (key, variant, file_name, stage, zip_path, output_path, records, output_bytes, xml_offset,
+         file_name, zip_path, output_path, records, output_bytes, xml_offset),
+    )
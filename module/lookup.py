@@ -0,0 +1,298 @@
+import bisect
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from module.partitions import read_manifest
+import module.sinks as sinks
+
+
+# Lookup index written next to the outputs of a run, one memory-mapped file
+LOOKUP_MAGIC = b'FIRDSIDX'
+LOOKUP_VERSION = 1
+
+# Column the instruments are keyed by, the ISIN, and the column of the secondary issuer index, the issuer LEI
+ID_COLUMN = 'FinInstrmGnlAttrbts.Id'
+ISSUER_COLUMN = 'Issr'
+
+# Magic, version and length of the JSON header, sections start on 8 byte boundaries so they cast in place
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGNMENT = 8
+
+
+'''
+    text of an output value, booleans read back from Parquet are written as in the xml, receives the value
+'''
+def _text(value) -> str:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+'''
+    the rows of a per-file output, a csv or Parquet file or a partitioned output folder, as tuples in the
+    order of the header it returns first, receives the path
+'''
+def iter_output_rows(path: str):
+    if os.path.isdir(path):
+        manifest = read_manifest(path)
+        parts = [part for stats in manifest['partitions'].values() for part in stats['files']]
+        for number, part in enumerate(parts):
+            rows = iter_output_rows(os.path.join(path, part))
+            header = next(rows)
+            if number == 0:
+                yield header
+            yield from rows
+        return
+
+    if path.endswith(sinks.ParquetSink.extension):
+        if not sinks.load_pyarrow():
+            raise ImportError("pyarrow is required to read Parquet outputs.")
+        parquet_file = sinks.pq.ParquetFile(path)
+        yield list(parquet_file.schema_arrow.names)
+        for batch in parquet_file.iter_batches():
+            yield from zip(*[map(_text, column.to_pylist()) for column in batch.columns])
+        return
+
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        yield from csv.reader(csv_file)
+
+
+'''
+    keys as fixed size records that sort and search as bytes, shorter keys padded with zero bytes, returns the
+    records and their width, receives the sorted keys
+'''
+def _fixed_keys(keys: list) -> tuple:
+    widths = set(map(len, keys))
+    text = ''.join(keys)
+    # ISINs and LEIs all have one length and are ascii, so the keys are encoded at once
+    if len(widths) == 1 and text.isascii():
+        return text.encode(), widths.pop()
+    encoded = [key.encode() for key in keys]
+    width = max(map(len, encoded), default=0)
+    return b''.join(key.ljust(width, b'\0') for key in encoded), width
+
+
+'''
+    offsets and utf-8 bytes of a column, value n takes the bytes between offsets n and n + 1, None and empty
+    values take none, returns the offsets typecode, offsets and values, receives the values
+'''
+def _column(values: list) -> tuple:
+    values = [value or '' for value in values]
+    text = ''.join(values)
+    if text.isascii():
+        # Ascii text has as many bytes as characters, so the column is encoded at once
+        data, lengths = text.encode(), map(len, values)
+    else:
+        encoded = [value.encode() for value in values]
+        data, lengths = b''.join(encoded), map(len, encoded)
+    typecode = 'I' if len(data) < 2 ** 32 else 'Q'
+    return typecode, array(typecode, accumulate(lengths, initial=0)).tobytes(), data
+
+
+'''
+    build a lookup index over instrument rows, a later row of an ISIN replaces an earlier one so the last file
+    of a run wins, rows without an ISIN are skipped, returns the number of instruments, receives the rows,
+    their header and the index path
+'''
+def build_lookup_index(rows, header: list, path: str) -> int:
+    id_index = header.index(ID_COLUMN)
+    columns = [column for column in header if column != ID_COLUMN]
+
+    latest = {}
+    for row in rows:
+        if row[id_index]:
+            latest[row[id_index]] = row
+    # Strings sort in code point order, which is the order of their utf-8 bytes
+    ids = sorted(latest)
+    rows = [latest[key] for key in ids]
+    id_data, id_width = _fixed_keys(ids)
+
+    sections = [('ids', id_data)]
+    offset_types = {}
+    for column in columns:
+        position = header.index(column)
+        offset_types[column], ends, data = _column([row[position] for row in rows])
+        sections.append(('offsets:' + column, ends))
+        sections.append(('values:' + column, data))
+
+    issuer_width, issuer_count = 0, 0
+    if ISSUER_COLUMN in columns:
+        position = header.index(ISSUER_COLUMN)
+        issuers = [row[position] for row in rows]
+        # A stable sort keeps the instruments of an issuer in ISIN order
+        numbers = sorted(filter(issuers.__getitem__, range(len(issuers))), key=issuers.__getitem__)
+        issuer_data, issuer_width = _fixed_keys([issuers[number] for number in numbers])
+        issuer_count = len(numbers)
+        sections.append(('issuers', issuer_data))
+        sections.append(('issuer_rows', array('I', numbers).tobytes()))
+
+    # Section offsets are relative to the end of the header, so the header can describe them before its size is known
+    layout, offset = {}, 0
+    for name, data in sections:
+        layout[name] = [offset, len(data)]
+        offset += -len(data) % _ALIGNMENT + len(data)
+    meta = json.dumps({'columns': columns, 'count': len(ids), 'id_width': id_width, 'issuer_width': issuer_width,
+                       'issuer_count': issuer_count, 'offset_types': offset_types, 'byteorder': sys.byteorder,
+                       'sections': layout}).encode()
+    meta += b' ' * (-(_PREAMBLE.size + len(meta)) % _ALIGNMENT)
+
+    temp_path = path + '.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(temp_path, 'wb') as index_file:
+        index_file.write(_PREAMBLE.pack(LOOKUP_MAGIC, LOOKUP_VERSION, len(meta)))
+        index_file.write(meta)
+        for _, data in sections:
+            index_file.write(data)
+            index_file.write(b'\0' * (-len(data) % _ALIGNMENT))
+    # Readers never see a half written index
+    os.replace(temp_path, path)
+    return len(ids)
+
+
+'''
+    build the lookup index of a run from its per-file outputs, in run order, returns the number of instruments,
+    receives the output paths and the index path
+'''
+def build_lookup_from_outputs(output_paths: list, path: str) -> int:
+    header = next(iter_output_rows(output_paths[0]), None) if output_paths else None
+    if not header or ID_COLUMN not in header:
+        raise ValueError("The outputs have no %s column to index." % ID_COLUMN)
+
+    def rows():
+        # Every output of a run is written with the same columns
+        for output_path in output_paths:
+            output_rows = iter_output_rows(output_path)
+            next(output_rows, None)
+            yield from output_rows
+
+    return build_lookup_index(rows(), header, path)
+
+
+'''
+    fixed width keys of an index section as a sequence bisect can search, each probe reads one key from the map
+'''
+class _FixedKeys:
+    __slots__ = ('_map', '_start', '_width', '_count')
+
+    def __init__(self, mapped: mmap.mmap, start: int, width: int, count: int):
+        self._map = mapped
+        self._start = start
+        self._width = width
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, number: int) -> bytes:
+        start = self._start + number * self._width
+        return self._map[start:start + self._width]
+
+
+'''
+    read-only lookup index over the instruments of a run, memory-mapped so opening it reads only its header,
+    get answers by ISIN and by_issuer by issuer LEI, values are returned as strings with empty values as None
+'''
+class LookupIndex:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._views = []
+
+        magic, version, meta_size = _PREAMBLE.unpack_from(self._map)
+        if magic != LOOKUP_MAGIC or version != LOOKUP_VERSION:
+            self.close()
+            raise ValueError("%s is not a version %d lookup index." % (path, LOOKUP_VERSION))
+        meta = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + meta_size])
+        if meta['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError("%s was built on a %s-endian machine." % (path, meta['byteorder']))
+
+        # Sections are read in place, keys and values are sliced from the map and offsets are cast views of it
+        base = _PREAMBLE.size + meta_size
+        sections = {name: (base + start, size) for name, (start, size) in meta['sections'].items()}
+
+        def offsets(name, typecode):
+            start, size = sections[name]
+            view = self._view[start:start + size].cast(typecode)
+            self._views.append(view)
+            return view
+
+        self.columns = [ID_COLUMN] + meta['columns']
+        self._count = meta['count']
+        self._id_width = meta['id_width']
+        self._ids = _FixedKeys(self._map, sections['ids'][0], self._id_width, self._count)
+        self._columns = [(offsets('offsets:' + column, meta['offset_types'][column]), sections['values:' + column][0])
+                         for column in meta['columns']]
+        self._issuer_width = meta['issuer_width']
+        self._issuers = None
+        if 'issuers' in sections:
+            self._issuers = _FixedKeys(self._map, sections['issuers'][0], self._issuer_width, meta['issuer_count'])
+            self._issuer_rows = offsets('issuer_rows', 'I')
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, isin: str) -> bool:
+        return self._find(isin) is not None
+
+    def _find(self, isin: str):
+        key = isin.encode()
+        if len(key) > self._id_width:
+            return None
+        key = key.ljust(self._id_width, b'\0')
+        number = bisect.bisect_left(self._ids, key)
+        return number if number < self._count and self._ids[number] == key else None
+
+    def _row(self, number: int) -> dict:
+        mapped = self._map
+        row = {ID_COLUMN: self._ids[number].rstrip(b'\0').decode()}
+        for column, (ends, values) in zip(self.columns[1:], self._columns):
+            start, end = ends[number], ends[number + 1]
+            row[column] = mapped[values + start:values + end].decode() if end > start else None
+        return row
+
+    def get(self, isin: str, default=None) -> dict:
+        number = self._find(isin)
+        return default if number is None else self._row(number)
+
+    def by_issuer(self, lei: str) -> list:
+        if self._issuers is None:
+            return []
+        key = lei.encode()
+        if len(key) > self._issuer_width:
+            return []
+        key = key.ljust(self._issuer_width, b'\0')
+        start = bisect.bisect_left(self._issuers, key)
+        end = bisect.bisect_right(self._issuers, key, start)
+        return [self._row(self._issuer_rows[number]) for number in range(start, end)]
+
+    def close(self):
+        # Views into the map have to be released before it can be closed
+        for view in self._views:
+            view.release()
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+'''
+    open a lookup index, receives the path
+'''
+def open_lookup_index(path: str) -> LookupIndex:
+    return LookupIndex(path)
@@ -1,16 +1,40 @@
-import requests
-import pandas as pd
-import xmltodict
 import os
+import sys
 import zipfile
 import csv
-from io import StringIO
+import xml.etree.ElementTree as ET
 import logging
-import boto3
-import pdb 
+import shutil
+import time
+import hashlib
+import itertools
+from functools import partial
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+from module.downloader import create_session, download_file, download_files, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+from module.cache import cache_get, cache_path, cache_put, evict_cache, path_size, CACHE_DIR, CACHE_MAX_BYTES
+from module.sinks import open_sink, sink_extension, merge_parquet_files, CsvSink
+from module.s3_upload import get_s3_client, open_text_upload, upload_folder, MultipartUploader
+from module.master import open_master, is_applied, apply_delta, MASTER_PATH
+from module.projection import compile_extractor, compile_element_extractor, local_names, REF_DATA_TAG
+from module.shards import shard_ranges, shard_document, find_record_start, RecordOffsets
+from module.mapped import MappedFile, map_zip_member, FEED_SIZE
+from module.pipeline import Stage, run_pipeline, QUEUE_SIZE
+from module.partitions import PartitionedSink, merge_partitioned_outputs, partition_columns
+from module.lookup import build_lookup_from_outputs
+from module.journal import (get_journal, run_key, file_key, load_index, save_index, finish_run, file_state, mark_stage,
+                            CHECKPOINT_RECORDS, STAGE_DOWNLOADED, STAGE_PARSING, STAGE_PARSED)
+from module import metrics
+
+# pandas and xmltodict are imported inside the functions that use them, so that importing this module,
+# and runs that never build a DataFrame, do not pay for them
+if TYPE_CHECKING:
+    import pandas as pd
 
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
@@ -22,27 +46,102 @@ csv_file_name = 'output.csv'
 XML_URL = "https://registers.esma.europa.eu/solr/esma_registers_firds_files/select?q=*&fq=publication_date:%5B2021-01-17T00:00:00Z+TO+2021-01-19T23:59:59Z%5D&wt=xml&indent=true&start=0&rows=100"
 XML_LOCAL_NAME = "downloaded_file.xml"
 
+# Solr index of FIRDS files, paged through for any publication date window
+INDEX_URL = "https://registers.esma.europa.eu/solr/esma_registers_firds_files/select"
+INDEX_PAGE_SIZE = 500
+# Solr only keeps pages apart under a total order, the unique id breaks ties between files of one timestamp
+INDEX_SORT = 'timestamp asc, id asc'
+DEFAULT_FROM_DATE = '2021-01-17T00:00:00Z'
+DEFAULT_TO_DATE = '2021-01-19T23:59:59Z'
+INDEX_COLUMNS = [
+    'checksum',
+    'download_link',
+    'publication_date',
+    'id',
+    'published_instrument_file_id',
+    'file_name',
+    'file_type',
+    'timestamp'
+]
+
+# File types processed from the index, and where each file's csv is written
+FILE_TYPES = ('DLTINS', 'FULINS')
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output')
+
+# Zips are saved to the directory of the Python script itself
+DOWNLOAD_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pooled HTTP session, created once per process
+_session = None
+
+# Tag of a single instrument record in DLTINS files, FULINS files hold RefData records instead
+FIN_INSTRM_TAG = 'FinInstrm'
+RECORD_TAGS = frozenset([FIN_INSTRM_TAG, REF_DATA_TAG])
+
+# Default output columns, dotted paths inside each FinInstrm or RefData record plus the RecordType pseudo column.
+# Other paths, such as 'TradgVnRltdAttrbts.Id', 'DerivInstrmAttrbts.XpryDt' or
+# 'DerivInstrmAttrbts.UndrlygInstrm.Sngl.ISIN', can be passed as columns
+CSV_HEADER = [
+    'FinInstrmGnlAttrbts.Id',
+    'FinInstrmGnlAttrbts.FullNm',
+    'FinInstrmGnlAttrbts.ClssfctnTp',
+    'FinInstrmGnlAttrbts.CmmdtyDerivInd',
+    'FinInstrmGnlAttrbts.NtnlCcy',
+    'Issr',
+    'RecordType'
+]
+
+# Record types a FinInstrm can hold: new, modified, terminated and cancelled instruments, and the RefData
+# records of FULINS files
+RECORD_TYPES = frozenset(['NewRcrd', 'ModfdRcrd', 'TermntdRcrd', 'CancRcrd', REF_DATA_TAG])
+
+# Output format of each file, 'csv' or 'parquet'
+OUTPUT_FORMAT = 'csv'
+
+# Smaller xml files are parsed in one piece even when shard workers are available
+SHARD_MIN_BYTES = 256 * 1024 ** 2
+
+# Bytes searched for the end of the document header when a parse resumes from an xml offset
+HEADER_SCAN_BYTES = 1024 * 1024
+
+# Resident size a parse worker is budgeted for, measured at 130-190 MiB with pandas loaded and a Parquet
+# batch buffered, the memory budget of a run is split in workers of this size
+PARSE_WORKER_BYTES = 256 * 1024 ** 2
 
+# Rough sizes for dry runs, the index only gives names and checksums: FIRDS xml compresses about 15 times
+# and a FinInstrm record takes about 1.5 KB of xml and 150 bytes of csv
+XML_COMPRESSION_RATIO = 15
+XML_BYTES_PER_RECORD = 1500
+CSV_BYTES_PER_RECORD = 150
+
+# Suffix of the per-file output folders of a partitioned run
+PARTITIONED_SUFFIX = '.d'
+
+# Compiled extractor of each column list, over record dicts and over FinInstrm elements
+_extractors = {}
+_element_extractors = {}
+
+
+'''
+    pooled HTTP session shared by every download of this process
 '''
-    download the xml file from url if the status code is 200, receives the URL
+def get_session():
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
+
+
+'''
+    stream the xml file from url to disk, receives the URL
 '''
 def download_xml_file(xml_url: str):
-    try:
-        response = requests.get(xml_url)
-        
-        if response.status_code == 200:
-            # Get content from response
-            xml_content = response.content
-            
-            # Save the content to a local file
-            with open(XML_LOCAL_NAME, "wb") as f:
-                f.write(xml_content)
-            logger.info("XML file downloaded successfully.")
-            return response.content
-        else:
-            logger.error("Failed to download XML file. Status code: %d", response.status_code)
-            return None
-    except Exception as e:
+    path = download_file(get_session(), xml_url, XML_LOCAL_NAME)
+
+    if path:
+        logger.info("XML file downloaded successfully.")
+        return path
+    else:
         logger.error("Error while downloading %s", xml_url)
         return None
 
@@ -51,56 +150,281 @@ def download_xml_file(xml_url: str):
     read xml file and tranform to a DataFrame, receives the path
 '''
 def read_xml_file(path: str) -> dict:
+    import xmltodict
     try:
-        with open(path, 'r', encoding='utf-8') as xml_file:
-            xml_data = xml_file.read()
-        xml_dict = xmltodict.parse(xml_data)
+        # The parser is fed slices of the mapping, the file is never copied into a bytes or str object
+        with MappedFile(path) as mapped, metrics.track('read_xml', len(mapped)):
+            xml_dict = xmltodict.parse(mapped.iter_chunks())
         logger.info("XML file read successfully.")
 
         return xml_dict
     except Exception as e:
         logger.error("Error while reading %s", path)
         return None
-    
+
+
+'''
+    convert an element into the same nested dict xmltodict would build, receives the element
+'''
+def _element_to_dict(elem: ET.Element):
+    node = {'@' + local_names[key]: value for key, value in elem.attrib.items()} if elem.attrib else {}
+
+    for child in elem:
+        key = local_names[child.tag]
+        value = _element_to_dict(child) if len(child) or child.attrib else _text_value(child)
+        if key in node:
+            if not isinstance(node[key], list):
+                node[key] = [node[key]]
+            node[key].append(value)
+        else:
+            node[key] = value
+
+    text = elem.text.strip() if elem.text else ''
+    if not node:
+        return text or None
+    if text:
+        node['#text'] = text
+    return node
+
+
+'''
+    value of a leaf element without attributes, receives the element
+'''
+def _text_value(elem: ET.Element):
+    text = elem.text
+    if text:
+        text = text.strip()
+    return text or None
+
+
+'''
+    feed chunks of bytes to a pull parser, yielding its events as they come, receives the chunks
+'''
+def _feed_events(chunks):
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+'''
+    start and end events of an xml source, receives a path, a file object, or an iterable of byte chunks
+    such as a MappedFile
+'''
+def _xml_events(source):
+    if isinstance(source, (str, os.PathLike)) or hasattr(source, 'read'):
+        return ET.iterparse(source, events=('start', 'end'))
+    return _feed_events(source)
+
+
+'''
+    stream the FinInstrm elements of a DLTINS file, or the RefData elements of a FULINS file, one at a time,
+    each element is cleared once the next one is asked for, the first skip records are parsed but not yielded,
+    receives a path, file object or chunks of bytes and the records to skip
+'''
+def iter_fin_instrm_elements(source, skip: int = 0):
+    parents = []
+    for event, elem in _xml_events(source):
+        if event == 'start':
+            parents.append(elem)
+            continue
+
+        parents.pop()
+        if local_names[elem.tag] in RECORD_TAGS:
+            if skip:
+                skip -= 1
+            else:
+                yield elem
+
+            # Drop the handled record so the tree never grows with the file
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+
+
+'''
+    stream the FinInstrm records of a DLTINS/FULINS file one at a time as the dicts xmltodict would build,
+    a RefData record is keyed by its tag as if it were the record of a FinInstrm, the first skip records are
+    parsed but not converted, receives a path, file object or chunks of bytes and the records to skip
+'''
+def iter_fin_instrm(source, skip: int = 0):
+    for elem in iter_fin_instrm_elements(source, skip):
+        if local_names[elem.tag] == REF_DATA_TAG:
+            yield {REF_DATA_TAG: _element_to_dict(elem)}
+        else:
+            yield _element_to_dict(elem)
+
+
+'''
+    solr timestamp of a date, a bare YYYY-MM-DD covers the whole day, receives the date and whether it ends the window
+'''
+def _solr_date(value: str, end: bool = False) -> str:
+    if len(value) == 10:
+        return value + ('T23:59:59Z' if end else 'T00:00:00Z')
+    return value
+
+
+'''
+    fetch one page of the index as a dictionary, receives the date window, first row and page size
+'''
+def fetch_index_page(from_date: str, to_date: str, start: int, rows: int = INDEX_PAGE_SIZE) -> dict:
+    import xmltodict
+    params = {
+        'q': '*',
+        'fq': 'publication_date:[%s TO %s]' % (_solr_date(from_date), _solr_date(to_date, end=True)),
+        'wt': 'xml',
+        'sort': INDEX_SORT,
+        'start': start,
+        'rows': rows,
+    }
+    try:
+        with metrics.track('index') as span:
+            response = get_session().get(INDEX_URL, params=params, timeout=DEFAULT_TIMEOUT)
+            response.raise_for_status()
+            span.add(bytes_in=len(response.content))
+            return xmltodict.parse(response.content)
+    except Exception:
+        logger.error("Error while fetching the index page at start %d.", start)
+        raise
+
+
+'''
+    page through the whole index for a date window, fetching the pages after the first one concurrently,
+    receives the date window, page size and number of concurrent requests
+'''
+def iter_index_pages(from_date: str = DEFAULT_FROM_DATE, to_date: str = DEFAULT_TO_DATE,
+                     page_size: int = INDEX_PAGE_SIZE, concurrency: int = DEFAULT_CONCURRENCY):
+    first_page = fetch_index_page(from_date, to_date, 0, page_size)
+    num_found = int(first_page['response']['result']['@numFound'])
+    logger.info("Index has %d files between %s and %s.", num_found, from_date, to_date)
+    yield first_page
+
+    starts = range(page_size, num_found, page_size)
+    if starts:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            yield from executor.map(lambda start: fetch_index_page(from_date, to_date, start, page_size), starts)
+
+
+'''
+    docs of every index page, a single matching doc is parsed as a dict rather than a list, receives the pages
+'''
+def _iter_index_docs(pages):
+    for page in pages:
+        docs = page['response']['result'].get('doc', [])
+        if isinstance(docs, dict):
+            docs = [docs]
+        yield from docs
+
+
+'''
+    a repeated xmltodict element as a list, receives the parsed value
+'''
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+'''
+    UTC datetime of an index date, receives the text
 '''
-    tranform first xml dictionary into a dataFramem receives the dictionary 
+def _index_date(value: str):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+'''
+    the index columns of every doc as tuples, receives the dictionary or a stream of index pages
+'''
+def _index_tuples(xml_dict) -> list:
+    pages = [xml_dict] if isinstance(xml_dict, dict) else xml_dict
+
+    # Each doc's fields are read in a single pass
+    template = dict.fromkeys(INDEX_COLUMNS)
+    get_row = itemgetter(*INDEX_COLUMNS)
+    rows = []
+    with metrics.track('index_transform') as span:
+        for doc in _iter_index_docs(pages):
+            fields = template.copy()
+            for item in _as_list(doc.get('str')):
+                fields[item['@name']] = item.get('#text')
+            for item in _as_list(doc.get('date')):
+                fields[item['@name']] = item.get('#text')
+            rows.append(get_row(fields))
+        span.add(records=len(rows))
+    return rows
+
+
+'''
+    the files of the index as dicts with the index columns and UTC dates, the same rows as transform_first_xml
+    without loading pandas, receives the dictionary or a stream of index pages
+'''
+def index_rows(xml_dict) -> list:
+    rows = []
+    for row in _index_tuples(xml_dict):
+        fields = dict(zip(INDEX_COLUMNS, row))
+        fields['publication_date'] = _index_date(fields['publication_date'])
+        fields['timestamp'] = _index_date(fields['timestamp'])
+        rows.append(fields)
+
+    if not rows:
+        logger.error("No file found in the index.")
+    return rows
+
+
+'''
+    tranform first xml dictionary into a dataFramem receives the dictionary or a stream of index pages
 '''   
-def transform_first_xml(xml_dict: dict) -> pd.DataFrame:
-    docs = xml_dict['response']['result']['doc']
-
-    data = []
-    for doc in docs:
-        checksum = next(item['#text'] for item in doc['str'] if item['@name'] == 'checksum')
-        download_link = next(item['#text'] for item in doc['str'] if item['@name'] == 'download_link')
-        publication_date = next(item['#text'] for item in doc['date'] if item['@name'] == 'publication_date')
-        id_value = next(item['#text'] for item in doc['str'] if item['@name'] == 'id')
-        published_instrument_file_id = next(item['#text'] for item in doc['str'] if item['@name'] == 'published_instrument_file_id')
-        file_name = next(item['#text'] for item in doc['str'] if item['@name'] == 'file_name')
-        file_type = next(item['#text'] for item in doc['str'] if item['@name'] == 'file_type')
-        timestamp = next(item['#text'] for item in doc['date'] if item['@name'] == 'timestamp')
-
-        data.append({
-            'checksum': checksum,
-            'download_link': download_link,
-            'publication_date': publication_date,
-            'id': id_value,
-            'published_instrument_file_id': published_instrument_file_id,
-            'file_name': file_name,
-            'file_type': file_type,
-            'timestamp': timestamp
-        })
+def transform_first_xml(xml_dict) -> 'pd.DataFrame':
+    import pandas as pd
 
-    if data:
+    # The rows are transposed into columns
+    rows = _index_tuples(xml_dict)
+    if rows:
+        columns = dict(zip(INDEX_COLUMNS, map(list, zip(*rows))))
         logger.info("First xml tranformed to a DataFrame.")
-        return pd.DataFrame(data)
+        return pd.DataFrame({
+            'checksum': columns['checksum'],
+            'download_link': columns['download_link'],
+            'publication_date': pd.to_datetime(columns['publication_date'], utc=True, format='ISO8601'),
+            'id': columns['id'],
+            'published_instrument_file_id': columns['published_instrument_file_id'],
+            'file_name': columns['file_name'],
+            'file_type': pd.Categorical(columns['file_type']),
+            'timestamp': pd.to_datetime(columns['timestamp'], utc=True, format='ISO8601'),
+        })
     else:
         logger.error("Error transforming dictionary into DataFrame.")
         return None
 
+'''
+    download a single .zip into the checksum cache, or next to the script when there is no checksum,
+    receives the link, the file name and the FIRDS checksum
+'''
+def download_zip_file(download_link: str, file_name: str, checksum: str = None, cache_dir: str = CACHE_DIR) -> str:
+    cached_path = cache_get(cache_dir, checksum, '.zip')
+    if cached_path:
+        return cached_path
+
+    if checksum:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_path = cache_path(cache_dir, checksum, '.zip')
+    else:
+        save_path = os.path.join(DOWNLOAD_DIR, file_name)
+    with metrics.track('download') as span:
+        zip_path = download_file(get_session(), download_link, save_path, checksum)
+        span.add(path_in=zip_path)
+    return zip_path
+
+
 '''
     get link from DataFrame and download the .zip, receives the DataFrame
 '''
-def download_zip(df: pd.DataFrame):
+def download_zip(df: 'pd.DataFrame'):
 
     if not df.empty:
         if 'file_type' in df.columns and 'download_link' in df.columns:
@@ -110,23 +434,7 @@ def download_zip(df: pd.DataFrame):
                 download_zip_link = first_item['download_link']
 
                 if download_zip_link:
-                    # Save .zip to the directory of the Python script itself
-                    save_dir = os.path.dirname(os.path.abspath(__file__))
-                    save_path = os.path.join(save_dir, first_item['file_name'])
-
-                    response = requests.get(download_zip_link)
-
-                    if response.status_code == 200:
-                        with open(save_path, "wb") as file:
-                            file.write(response.content)
-
-                        logger.info("%s downloaded successfully.", first_item['file_name'])
-
-                        extract_xml_from_zip(save_path)
-                        return response.content
-                    else:
-                        logger.error("Failed to download the file. Status code: %d", response.status_code)
-                        return None
+                    return download_zip_file(download_zip_link, first_item['file_name'], first_item.get('checksum'))
                 else:
                     logger.error("Failed to find download_link in DataFrame.")
                     return None
@@ -142,107 +450,851 @@ def download_zip(df: pd.DataFrame):
 
 
 '''
-    extract the xml file from a zip, receives the .zip path
+    name of the xml member of an open zip, receives the ZipFile
+'''
+def _xml_member(zip_ref: zipfile.ZipFile) -> str:
+    xml_members = [name for name in zip_ref.namelist() if name.endswith(".xml")]
+
+    if xml_members:
+        logger.info("XML member found: %s", xml_members[0])
+        return xml_members[0]
+    else:
+        logger.error("No XML file found in the zip.")
+        return None
+
+
+'''
+    open the xml member of a zip without extracting it, mapped in place when it is stored uncompressed and
+    as a decompressing stream otherwise, receives the .zip path
 '''
-def extract_xml_from_zip(path: str):
+def open_xml_from_zip(path: str):
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        member = _xml_member(zip_ref)
+        if member is None:
+            return None
+        # The member stream keeps the archive open after the ZipFile is closed
+        return map_zip_member(path, member) or zip_ref.open(member)
 
-    # Extract all files from the zip archive
+
+'''
+    extract the xml member of a zip when it is at least min_bytes large, so it can be read in byte ranges,
+    receives the .zip path, target folder and size threshold
+'''
+def extract_xml_from_zip(path: str, target_dir: str, min_bytes: int = 0) -> str:
     with zipfile.ZipFile(path, 'r') as zip_ref:
-        zip_ref.extractall(os.path.dirname(os.path.abspath(__file__)))
+        member = _xml_member(zip_ref)
+        if member is None or zip_ref.getinfo(member).file_size < min_bytes:
+            return None
+        xml_path = os.path.join(target_dir, os.path.basename(member))
+        with zip_ref.open(member) as source, open(xml_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    return xml_path
+
 
-    # Search for XML files in the output directory
-    xml_files = [file for file in os.listdir(os.path.dirname(os.path.abspath(__file__))) if file.endswith(".xml")]
+'''
+    extractor compiled once for a list of columns, receives the columns
+'''
+def get_extractor(columns: list = CSV_HEADER):
+    key = tuple(columns)
+    extractor = _extractors.get(key)
+    if extractor is None:
+        extractor = _extractors[key] = compile_extractor(columns, RECORD_TYPES)
+    return extractor
+
+
+'''
+    element extractor compiled once for a list of columns, receives the columns
+'''
+def get_element_extractor(columns: list = CSV_HEADER):
+    key = tuple(columns)
+    extractor = _element_extractors.get(key)
+    if extractor is None:
+        extractor = _element_extractors[key] = compile_element_extractor(columns, RECORD_TYPES)
+    return extractor
+
+
+'''
+    one output row per instrument of any record type, receives the instruments and the columns
+'''
+def iter_instrument_rows(instruments, columns: list = CSV_HEADER):
+    return get_extractor(columns)(instruments)
 
-    if xml_files:
-        xml_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), xml_files[0])
-        logger.info("XML file extracted: %s", xml_file_path)
+
+'''
+    one output row per instrument of an xml source, read straight from its elements, or of an iterable of
+    FinInstrm records, receives the source or records and the columns
+'''
+def _source_rows(instruments, columns: list = CSV_HEADER):
+    if isinstance(instruments, (str, os.PathLike, MappedFile)) or hasattr(instruments, 'read'):
+        return get_element_extractor(columns)(iter_fin_instrm_elements(instruments))
+    return iter_instrument_rows(instruments, columns)
+
+
+'''
+    write the csv header and one row per instrument, rows are written in batches by the csv writer,
+    receives the instruments or an xml source, a writable file and the columns
+'''
+def write_instruments_csv(instruments, output, columns: list = CSV_HEADER):
+    csv_writer = csv.writer(output)
+    csv_writer.writerow(columns)
+    csv_writer.writerows(_source_rows(instruments, columns))
+
+
+'''
+    tranform the xml dictionary into a csv streamed to S3 as a multipart upload, receives a dictionary,
+    an iterable of FinInstrm records or an xml path, stream or mapped file, and the columns
+'''
+def transform_xml_to_csv(xml_dix, columns: list = CSV_HEADER):
+    # Extracting the necessary information from the dictionary
+    if isinstance(xml_dix, dict):
+        instruments = xml_dix['BizData']['Pyld']['Document']['FinInstrmRptgRefDataDltaRpt']['FinInstrm']
     else:
-        logger.error("No XML files extracted from the zip.")
+        instruments = xml_dix
+
+    # Parts are uploaded while the rows are still being written
+    with open_text_upload(s3_bucket_name, csv_file_name) as csv_output:
+        write_instruments_csv(instruments, csv_output, columns)
+
+    logger.info("Transformed xml into csv.")
+
+
+'''
+    suffix of a cached output, tied to the columns and partition keys it was written with, a partitioned
+    output is a folder, receives the output format, columns and partition keys
+'''
+def output_cache_suffix(output_format: str = OUTPUT_FORMAT, columns: list = CSV_HEADER,
+                        partition_by: tuple = None) -> str:
+    if not partition_by:
+        fingerprint = hashlib.md5(','.join(columns).encode()).hexdigest()[:8]
+        return '.' + fingerprint + sink_extension(output_format)
+    fingerprint = hashlib.md5((','.join(columns) + '|' + ','.join(partition_by)).encode()).hexdigest()[:8]
+    return '.' + fingerprint + sink_extension(output_format) + PARTITIONED_SUFFIX
+
+
+'''
+    the output of a file named after its zip, a folder for a partitioned output, receives the output folder,
+    zip name, format and partition keys
+'''
+def file_output_path(output_dir: str, file_name: str, output_format: str = OUTPUT_FORMAT,
+                     partition_by: tuple = None) -> str:
+    path = os.path.join(output_dir, os.path.splitext(file_name)[0] + sink_extension(output_format))
+    return path + PARTITIONED_SUFFIX if partition_by else path
+
+
+'''
+    the sink of an output file, or of a partitioned output folder when partition keys are given, receives
+    the format, path, columns and partition keys
+'''
+def open_output_sink(output_format: str, output_path: str, columns: list, partition_by: tuple = None):
+    if partition_by:
+        return PartitionedSink(output_path, columns, partition_by, output_format)
+    return open_sink(output_format, output_path, columns)
+
+
+'''
+    parse the FinInstrm records of an xml source into an output file, or a partitioned output folder,
+    receives the source, output path, format, columns and partition keys
+'''
+def write_xml_output(xml_source, output_path: str, output_format: str = OUTPUT_FORMAT,
+                     columns: list = CSV_HEADER, partition_by: tuple = None) -> str:
+    with metrics.track('parse') as span:
+        # Rows are handed to the sink as they are parsed, Parquet flushes them in bounded row groups
+        with open_output_sink(output_format, output_path, columns, partition_by) as sink:
+            sink.write_many(get_element_extractor(columns)(iter_fin_instrm_elements(xml_source)))
+        span.add(records=sink.rows, path_out=output_path)
+    return output_path
 
 
 '''
-    get the xml filename that starts with "DLTINS_" in folder
+    chunks of an xml source, a MappedFile or a binary stream, returns the header chunks and the chunks of the
+    records from a record offset on, the header goes in front so the parser still sees one document, None when
+    the header cannot be found, receives the source and offset
 '''
-def get_dltins_filename() -> str:
-    # List all files in the directory
-    files_in_directory = os.listdir(os.path.dirname(os.path.abspath(__file__)))
-    filtered_files = [filename for filename in files_in_directory if filename.startswith("DLTINS_") and filename.endswith(".xml")]
+def _xml_chunks(xml_source, offset: int = 0):
+    if isinstance(xml_source, MappedFile):
+        header_end = find_record_start(xml_source.buffer, 0, offset) if offset else 0
+        if header_end is None:
+            return None
+        return xml_source.iter_chunks([(0, header_end)]), xml_source.iter_chunks([(offset, len(xml_source))])
+
+    header = b''
+    if offset:
+        # Seeking in a compressed zip member decompresses up to the offset, which is far cheaper than parsing
+        xml_source.seek(0)
+        head = xml_source.read(min(offset, HEADER_SCAN_BYTES))
+        header_end = find_record_start(head, 0, len(head))
+        if header_end is None:
+            return None
+        header = head[:header_end]
+        xml_source.seek(offset)
+    return [header], iter(partial(xml_source.read, FEED_SIZE), b'')
+
 
-    xml_file_name = None 
-    
-    if filtered_files:
-        xml_file_name = filtered_files[0]
-        logger.info("Filename found: %s.", xml_file_name)
-        return xml_file_name
+'''
+    parse the FinInstrm records of an xml source, a path, MappedFile or binary stream, into an output file,
+    flushing it and calling checkpoint with the records parsed, bytes written and xml offset of the next record
+    every checkpoint_records records, a csv output resumes after the records of an earlier checkpoint, from its
+    xml offset when it has one, receives the source, output path, format, columns, checkpoint callback, the
+    records, bytes and xml offset of the earlier checkpoint and the checkpoint interval
+'''
+def write_xml_output_checkpointed(xml_source, output_path: str, output_format: str = OUTPUT_FORMAT,
+                                  columns: list = CSV_HEADER, checkpoint=None, records: int = 0,
+                                  output_bytes: int = 0, xml_offset: int = None,
+                                  checkpoint_records: int = CHECKPOINT_RECORDS) -> str:
+    if isinstance(xml_source, str):
+        with MappedFile(xml_source) as mapped:
+            return write_xml_output_checkpointed(mapped, output_path, output_format, columns, checkpoint, records,
+                                                 output_bytes, xml_offset, checkpoint_records)
+
+    # Parquet files cannot be reopened for appending, and a csv shorter than its checkpoint was lost
+    resumed = (records > 0 and output_format == 'csv' and os.path.exists(output_path)
+               and os.path.getsize(output_path) >= output_bytes)
+    chunks = _xml_chunks(xml_source, xml_offset) if resumed and xml_offset else None
+    if chunks is None:
+        chunks, xml_offset = _xml_chunks(xml_source), 0
+    if resumed:
+        # Rows written after the last checkpoint are dropped, their records are parsed again
+        with open(output_path, 'r+b') as output_file:
+            output_file.truncate(output_bytes)
+        logger.info("Resuming %s after %d records.", os.path.basename(output_path), records)
     else:
-        logger.error("Could not find file.")
+        records = 0
+
+    header, body = chunks
+    # Without an xml offset the records already written are parsed again but skipped
+    offsets = RecordOffsets(body, xml_offset, records if xml_offset else 0)
+    extract = get_element_extractor(columns)
+    with metrics.track('parse') as span:
+        instruments = iter_fin_instrm_elements(itertools.chain(header, offsets), skip=0 if xml_offset else records)
+        sink = CsvSink(output_path, columns, append=True) if resumed else open_sink(output_format, output_path, columns)
+        with sink:
+            while True:
+                # Records are counted as taken, empty ones are skipped by the extractor so the sink rows fall short
+                taken = 0
+
+                def batch():
+                    nonlocal taken
+                    for instrument in itertools.islice(instruments, checkpoint_records):
+                        taken += 1
+                        yield instrument
+
+                sink.write_many(extract(batch()))
+                if taken < checkpoint_records:
+                    break
+                records += taken
+                if checkpoint is not None:
+                    checkpoint(records, sink.flush(), offsets.record_offset(records))
+        span.add(records=sink.rows, path_out=output_path)
+    return output_path
+
+
+'''
+    parse an xml source into an output file, checkpointing its progress in the run journal and resuming from
+    the last checkpoint of an interrupted parse, receives the source, output path, format, columns, index row
+    and journal path
+'''
+def write_xml_output_journaled(xml_source, output_path: str, output_format: str, columns: list, file_row: dict,
+                               journal_path: str) -> str:
+    journal = get_journal(journal_path)
+    key, variant = file_key(file_row), output_cache_suffix(output_format, columns)
+    state = file_state(journal, key, variant) or {}
+    if state.get('stage') != STAGE_PARSING or state.get('output_path') != output_path:
+        state = {}
+
+    def checkpoint(records, output_bytes, xml_offset):
+        mark_stage(journal, key, variant, STAGE_PARSING, output_path=output_path, records=records,
+                   output_bytes=output_bytes, xml_offset=xml_offset)
+
+    return write_xml_output_checkpointed(xml_source, output_path, output_format, columns, checkpoint,
+                                         state.get('records', 0), state.get('output_bytes', 0),
+                                         state.get('xml_offset'))
+
+
+'''
+    parse one shard of an xml file into its own output file, runs in a worker process, returns the output path
+    and the metrics of the worker, receives the xml path, layout, shard number, output path, format, columns
+    and partition keys
+'''
+def process_xml_shard(xml_path: str, layout: dict, number: int, output_path: str,
+                      output_format: str = OUTPUT_FORMAT, columns: list = CSV_HEADER, partition_by: tuple = None) -> tuple:
+    with MappedFile(xml_path) as mapped:
+        write_xml_output(mapped.iter_chunks(shard_document(layout, number)), output_path, output_format, columns,
+                         partition_by)
+    return output_path, metrics.drain()
+
+
+'''
+    parse one large xml file on several processes, each taking a byte range of whole FinInstrm records,
+    and concatenate their outputs in file order, partitioned outputs are merged partition by partition,
+    receives the xml path, output path, number of workers, format, columns and partition keys
+'''
+def process_xml_file_sharded(xml_path: str, output_path: str, shard_workers: int = None,
+                             output_format: str = OUTPUT_FORMAT, columns: list = CSV_HEADER,
+                             partition_by: tuple = None) -> str:
+    shard_workers = shard_workers or os.cpu_count() or 1
+    with MappedFile(xml_path) as mapped:
+        layout = shard_ranges(mapped, shard_workers)
+    if layout is None:
         return None
 
+    count = len(layout['shards'])
+    base, extension = os.path.splitext(output_path)
+    part_paths = ['%s.shard%04d%s' % (base, number, extension) for number in range(count)]
+    with ProcessPoolExecutor(max_workers=min(count, shard_workers), initializer=metrics.init_worker) as executor:
+        parts = list(executor.map(process_xml_shard, [xml_path] * count, [layout] * count, range(count),
+                                  part_paths, [output_format] * count, [columns] * count, [partition_by] * count))
+    for _, shard_metrics in parts:
+        metrics.merge(shard_metrics)
+
+    merge_outputs(part_paths, output_path, output_format, partition_by)
+    for part_path in part_paths:
+        if partition_by:
+            shutil.rmtree(part_path)
+        else:
+            os.remove(part_path)
+    return output_path
+
 
 '''
-    tranform the xml dictionary into a csv file, receives a dictionary
+    parse one index row into its own output file, downloading it if needed, runs in a worker process,
+    xml files of at least SHARD_MIN_BYTES are split over shard_workers processes, receives the row,
+    output folder, cache folder, output format, columns, number of shard workers, the run journal, if any,
+    and the partition keys, if any
 '''
-def transform_xml_to_csv(xml_dix: dict):
-    # Extracting the necessary information from the dictionary
-    instruments = xml_dix['BizData']['Pyld']['Document']['FinInstrmRptgRefDataDltaRpt']['FinInstrm']
-    
-    csv_output = StringIO()
-    csv_writer = csv.writer(csv_output)
-
-    # Write the CSV header
-    header = [
-        'FinInstrmGnlAttrbts.Id',
-        'FinInstrmGnlAttrbts.FullNm',
-        'FinInstrmGnlAttrbts.ClssfctnTp',
-        'FinInstrmGnlAttrbts.CmmdtyDerivInd',
-        'FinInstrmGnlAttrbts.NtnlCcy',
-        'Issr'
-    ]
-    csv_writer.writerow(header)
-
-    for instrm in instruments:
+def process_zip_file(file_row: dict, output_dir: str = OUTPUT_DIR, cache_dir: str = CACHE_DIR,
+                     output_format: str = OUTPUT_FORMAT, columns: list = CSV_HEADER, shard_workers: int = 1,
+                     journal_path: str = None, partition_by: tuple = None) -> dict:
+    start = time.perf_counter()
+    file_name = file_row['file_name']
+    checksum = file_row.get('checksum')
+
+    zip_path = file_row.get('zip_path') or download_zip_file(file_row['download_link'], file_name, checksum, cache_dir)
+    if zip_path is None:
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = file_output_path(output_dir, file_name, output_format, partition_by)
+    output_suffix = output_cache_suffix(output_format, columns, partition_by)
+
+    # Byte ranges need a seekable file, so only large members are extracted before parsing
+    xml_path = extract_xml_from_zip(zip_path, output_dir, SHARD_MIN_BYTES) if shard_workers > 1 else None
+    if xml_path:
         try:
-            instrm_gnl_attrbts = instrm['TermntdRcrd']
+            output_path = process_xml_file_sharded(xml_path, output_path, shard_workers, output_format, columns,
+                                                   partition_by)
+        finally:
+            os.remove(xml_path)
+        if output_path is None:
+            return None
+    else:
+        xml_stream = open_xml_from_zip(zip_path)
+        if xml_stream is None:
+            return None
+        with xml_stream:
+            # Partitioned outputs are written from the start again, their part files cannot be truncated back
+            if journal_path and not partition_by:
+                write_xml_output_journaled(xml_stream, output_path, output_format, columns, file_row, journal_path)
+            else:
+                write_xml_output(xml_stream, output_path, output_format, columns, partition_by)
 
-            id_ = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['Id']
-            full_nm = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['FullNm']
-            clssfctn_tp = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['ClssfctnTp']
-            cmmdty_deriv_ind = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['CmmdtyDerivInd']
-            ntnl_ccy = instrm_gnl_attrbts['FinInstrmGnlAttrbts']['NtnlCcy']
-            issr = instrm_gnl_attrbts['Issr']
+    if checksum:
+        output_path = cache_put(cache_dir, checksum, output_suffix, output_path)
+    if journal_path:
+        mark_stage(get_journal(journal_path), file_key(file_row), output_suffix, STAGE_PARSED, file_name,
+                   output_path=output_path)
 
-            csv_writer.writerow([id_, full_nm, clssfctn_tp, cmmdty_deriv_ind, ntnl_ccy, issr])
+    return {'file_name': file_name, 'output_path': output_path, 'seconds': time.perf_counter() - start}
 
-        except KeyError:
-            pass
 
-    # Get the CSV content
-    csv_content = csv_output.getvalue()
-    logger.info("Transformed xml into csv.")
+'''
+    the files of an index as dicts, receives the DataFrame from transform_first_xml or the rows from index_rows
+'''
+def _index_records(index) -> list:
+    if index is None:
+        return []
+    if hasattr(index, 'to_dict'):
+        return index.to_dict('records')
+    return list(index)
 
-    """ 
-    with open('output.csv', mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerows(csv_content)
-    logger.info("Wrote new csv file.") """
 
-    # Upload the CSV content to S3
-    s3_client = boto3.client('s3')
-    s3_client.put_object(Bucket=s3_bucket_name, Key=csv_file_name, Body=csv_content)
+'''
+    the rows of the index with one of the file types, receives the DataFrame or index rows and the file types
+'''
+def _file_rows(index, file_types: tuple = FILE_TYPES) -> list:
+    records = _index_records(index)
+    if not records or 'file_type' not in records[0]:
+        logger.error("Empty DataFrame.")
+        return []
+
+    rows = [row for row in records if row['file_type'] in file_types]
+    if not rows:
+        logger.error("Failed to find %s file_type in DataFrame.", "/".join(file_types))
+    return rows
+
+
+'''
+    download stage, the cached output of a row when it was already parsed, otherwise the row with the path
+    of its zip, None when the download failed, receives the row, cache folder, output cache suffix and
+    the run journal, if any
+'''
+def _fetch_row(file_row: dict, cache_dir: str, output_suffix: str, journal_path: str = None) -> dict:
+    checksum = file_row.get('checksum')
+    state = file_state(get_journal(journal_path), file_key(file_row), output_suffix) if journal_path else None
+    # A restarted run finds the files it finished in the journal, whether or not they have a checksum
+    if state and state['stage'] == STAGE_PARSED and os.path.exists(state['output_path']):
+        return {'file_name': file_row['file_name'], 'output_path': state['output_path'], 'seconds': 0.0}
+
+    # Files already parsed for this checksum skip both the network and the decompression
+    output_path = cache_get(cache_dir, checksum, output_suffix)
+    if output_path:
+        return {'file_name': file_row['file_name'], 'output_path': output_path, 'seconds': 0.0}
+
+    if state and state['zip_path'] and os.path.exists(state['zip_path']):
+        zip_path = state['zip_path']
+    else:
+        zip_path = download_zip_file(file_row['download_link'], file_row['file_name'], checksum, cache_dir)
+        if zip_path and journal_path:
+            # A partial parse keeps its stage so its checkpoint is still found
+            stage = state['stage'] if state else STAGE_DOWNLOADED
+            mark_stage(get_journal(journal_path), file_key(file_row), output_suffix, stage, file_row['file_name'],
+                       zip_path=zip_path)
+    return dict(file_row, zip_path=zip_path) if zip_path else None
+
+
+'''
+    parse stage, cached outputs pass through, receives the row and the process_zip_file arguments
+'''
+def _parse_row(file_row: dict, output_dir: str, cache_dir: str, output_format: str, columns: list,
+               shard_workers: int, journal_path: str = None, partition_by: tuple = None) -> dict:
+    if 'output_path' in file_row:
+        return file_row
+    result = process_zip_file(file_row, output_dir, cache_dir, output_format, columns, shard_workers, journal_path,
+                              partition_by)
+    if result is not None and metrics.metrics_enabled():
+        # The parent process adds the worker's totals to its own
+        result['metrics'] = metrics.drain()
+    return result
+
+
+'''
+    upload stage, append each csv output to a stream in order under a single header, receives the result,
+    stream and a counter of the outputs appended so far
+'''
+def _append_output(result: dict, output, positions) -> dict:
+    with metrics.track('upload') as span:
+        append_csv_part(result['output_path'], output, next(positions) == 0)
+        span.add(path_out=result['output_path'])
+    return result
+
+
+'''
+    bytes of a stage result for the throughput report
+'''
+def _result_size(result: dict) -> int:
+    path = result.get('output_path') or result.get('zip_path')
+    return path_size(path) if path and os.path.exists(path) else 0
+
+
+'''
+    process every DLTINS/FULINS file of the index as a pipeline of concurrent stages joined by bounded queues,
+    downloading the next files while earlier ones are parsed on a process pool and, when a csv upload stream
+    is given, appending finished outputs to it, each large file may use up to shard_workers more processes,
+    with a journal the files a restarted run already finished are skipped and partial parses resumed,
+    with partition keys each file is written to a partitioned output folder, receives the DataFrame or index rows
+'''
+def process_all_files(df, workers: int = None, output_dir: str = OUTPUT_DIR,
+                      download_concurrency: int = DEFAULT_CONCURRENCY, cache_dir: str = CACHE_DIR,
+                      output_format: str = OUTPUT_FORMAT, columns: list = CSV_HEADER, shard_workers: int = 1,
+                      csv_upload=None, queue_size: int = QUEUE_SIZE, file_types: tuple = FILE_TYPES,
+                      journal_path: str = None, partition_by: tuple = None) -> list:
+    rows = _file_rows(df, file_types)
+    if not rows:
+        return []
+
+    # One worker per file, bounded by the number of cores
+    max_workers = min(len(rows), workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=metrics.init_worker) as executor:
+        # The first submit forks every worker, it is made before the stage threads start so that no lock one of
+        # them holds, in the HTTP session, the journal or the metrics, is copied into a worker
+        executor.submit(int).result()
+        stages = [
+            Stage('download', partial(_fetch_row, cache_dir=cache_dir,
+                                      output_suffix=output_cache_suffix(output_format, columns, partition_by),
+                                      journal_path=journal_path),
+                  download_concurrency, size=_result_size),
+            Stage('parse', partial(_parse_row, output_dir=output_dir, cache_dir=cache_dir, output_format=output_format,
+                                   columns=columns, shard_workers=shard_workers, journal_path=journal_path,
+                                   partition_by=partition_by),
+                  max_workers, executor, size=_result_size),
+        ]
+        if csv_upload is not None:
+            stages.append(Stage('upload', partial(_append_output, output=csv_upload, positions=itertools.count()),
+                                size=_result_size))
+        processed = list(run_pipeline(rows, stages, queue_size))
+
+    if not processed:
+        logger.error("Failed to process any file.")
+        return []
+
+    for result in processed:
+        metrics.merge(result.pop('metrics', None))
+        logger.info("%s processed in %.2fs.", result['file_name'], result['seconds'])
+    logger.info("Processed %d of %d files with %d workers.", len(processed), len(rows), max_workers)
+    if len(processed) < len(rows):
+        logger.error("Failed to process %d of %d files.", len(rows) - len(processed), len(rows))
+
+    return processed
 
 
 '''
-    main
+    set each row's zip_path from the cache, downloading the missing archives concurrently, receives the rows,
+    cache folder and number of concurrent downloads
 '''
-def main():
-    download_xml_file(XML_URL)
-    xml_dic_1 = read_xml_file(XML_LOCAL_NAME)
-    xml_df = transform_first_xml(xml_dic_1)
-    download_zip(xml_df)
+def _download_missing(rows: list, cache_dir: str, download_concurrency: int):
+    for row in rows:
+        row['zip_path'] = cache_get(cache_dir, row.get('checksum'), '.zip')
+
+    missing = [row for row in rows if not row['zip_path']]
+    if missing:
+        items = [dict(row, file_name=_zip_cache_name(row)) for row in missing]
+        for row, zip_path in zip(missing, download_files(items, cache_dir, download_concurrency, get_session())):
+            row['zip_path'] = zip_path
+
+
+'''
+    name of a row's zip inside the checksum cache
+'''
+def _zip_cache_name(file_row: dict) -> str:
+    if file_row.get('checksum'):
+        return os.path.basename(cache_path('', file_row['checksum'], '.zip'))
+    return file_row['file_name']
+
+
+'''
+    apply every DLTINS delta of the index to the instrument master in publication order, skipping files
+    already applied, returns the files applied, None when a delta could not be applied and the later ones were
+    left out, receives the DataFrame or index rows and master path
+'''
+def update_master(df, master_path: str = MASTER_PATH, download_concurrency: int = DEFAULT_CONCURRENCY,
+                  cache_dir: str = CACHE_DIR) -> list:
+    records = _index_records(df)
+    if not records or 'file_type' not in records[0]:
+        logger.error("Empty DataFrame.")
+        return []
 
-    dltins_filename = get_dltins_filename()
-    xml_dic_2 = read_xml_file(dltins_filename)
-    transform_xml_to_csv(xml_dic_2)
+    rows = sorted((row for row in records if row['file_type'] == 'DLTINS'),
+                  key=itemgetter('publication_date', 'file_name'))
+    conn = open_master(master_path)
+    try:
+        # Only the files not applied yet are fetched, so a daily run costs the size of its delta
+        pending = [row for row in rows if not is_applied(conn, row['checksum'])]
+        _download_missing(pending, cache_dir, download_concurrency)
+
+        applied = []
+        for row in pending:
+            xml_stream = open_xml_from_zip(row['zip_path']) if row['zip_path'] else None
+            if xml_stream is None:
+                # Deltas only make sense in order, stop at the first gap
+                logger.error("Failed to apply %s, later deltas are not applied.", row['file_name'])
+                applied = None
+                break
+            with xml_stream, metrics.track('apply_delta') as span:
+                counts = apply_delta(conn, iter_fin_instrm(xml_stream), row['checksum'], row['file_name'])
+                span.add(records=counts['upserts'] + counts['deletes'])
+            applied.append(row['file_name'])
+    finally:
+        conn.close()
+
+    if applied is not None:
+        logger.info("Applied %d of %d delta files to %s.", len(applied), len(rows), master_path)
+    return applied
+
+
+'''
+    copy a csv output to a binary stream, with or without its header line, receives the csv path, stream
+    and whether to keep the header
+'''
+def append_csv_part(csv_path: str, output, header: bool = False):
+    with open(csv_path, 'rb') as part:
+        first_line = part.readline()
+        if header:
+            output.write(first_line)
+        shutil.copyfileobj(part, output)
+
+
+'''
+    write the per-file csv outputs under a single header to a binary stream, receives the csv paths and stream
+'''
+def write_merged_csv(csv_paths: list, output):
+    for position, csv_path in enumerate(csv_paths):
+        # Keep the header of the first part only
+        append_csv_part(csv_path, output, position == 0)
+
+
+'''
+    concatenate the per-file csv outputs under a single header, receives the csv paths and merged path
+'''
+def merge_csv_outputs(csv_paths: list, merged_path: str) -> str:
+    with open(merged_path, 'wb') as merged:
+        write_merged_csv(csv_paths, merged)
+
+    logger.info("Merged %d csv files into %s.", len(csv_paths), merged_path)
+    return merged_path
+
+
+'''
+    combine the per-file outputs into one file of the same format, or partitioned outputs into one folder,
+    receives the paths, merged path, format and partition keys
+'''
+def merge_outputs(output_paths: list, merged_path: str, output_format: str = OUTPUT_FORMAT,
+                  partition_by: tuple = None) -> str:
+    with metrics.track('merge') as span:
+        if partition_by:
+            merge_partitioned_outputs(output_paths, merged_path)
+        elif output_format == 'parquet':
+            merge_parquet_files(output_paths, merged_path)
+        else:
+            merge_csv_outputs(output_paths, merged_path)
+        span.add(path_out=merged_path)
+    return merged_path
+
+
+'''
+    upload an output file from disk to S3, receives the path, object key and bucket
+'''
+def upload_csv_file(path: str, key: str = csv_file_name, bucket: str = s3_bucket_name):
+    with metrics.track('upload') as span:
+        get_s3_client().upload_file(path, bucket, key)
+        span.add(path_out=path)
+    logger.info("Uploaded %s to s3://%s/%s.", path, bucket, key)
+
+
+'''
+    where the merged output goes, an s3://bucket/prefix or a local path, a prefix or folder gets the default
+    output name, a partitioned output is a folder or prefix of that name, returns a dict with the bucket and key
+    or the path, receives the sink, output format and partition keys
+'''
+def resolve_sink(sink: str = None, output_format: str = OUTPUT_FORMAT, partition_by: tuple = None) -> dict:
+    output_name = os.path.splitext(csv_file_name)[0]
+    if not partition_by:
+        output_name += sink_extension(output_format)
+    if not sink:
+        return {'bucket': s3_bucket_name, 'key': output_name}
+
+    if sink.startswith('s3://'):
+        bucket, _, key = sink[len('s3://'):].partition('/')
+        if not key or key.endswith('/'):
+            key += output_name
+        return {'bucket': bucket, 'key': key}
+
+    if partition_by:
+        return {'path': os.path.join(sink, output_name) if os.path.isdir(sink) or sink.endswith(os.sep) else sink}
+    if os.path.isdir(sink) or sink.endswith(os.sep) or not os.path.splitext(sink)[1]:
+        return {'path': os.path.join(sink, output_name)}
+    return {'path': sink}
+
+
+'''
+    writable binary stream to a sink, a multipart upload for S3 and a file otherwise, receives the resolved sink
+'''
+@contextmanager
+def open_output_stream(target: dict):
+    if 'path' in target:
+        os.makedirs(os.path.dirname(os.path.abspath(target['path'])), exist_ok=True)
+        with open(target['path'], 'wb') as output:
+            yield output
+    else:
+        with MultipartUploader(target['bucket'], target['key']) as output:
+            yield output
+
+
+'''
+    drop a sink output that got nothing, the upload is aborted or the file removed, receives the stream and sink
+'''
+def discard_output(output, target: dict):
+    if 'path' in target:
+        output.close()
+        os.remove(target['path'])
+    else:
+        output.abort()
+
+
+'''
+    parse workers that fit a memory budget, each large file's shard workers count against it too,
+    receives the budget in bytes, the workers asked for and the shard workers
+'''
+def workers_for_budget(memory_budget: int = None, workers: int = None, shard_workers: int = 1) -> int:
+    workers = workers or os.cpu_count() or 1
+    if not memory_budget:
+        return workers
+    fitting = max(1, memory_budget // (PARSE_WORKER_BYTES * max(1, shard_workers)))
+    if fitting < workers:
+        logger.info("Memory budget of %d MiB fits %d parse workers.", memory_budget // 1024 ** 2, fitting)
+    return min(workers, fitting)
+
+
+'''
+    size of a file from a HEAD request, None when the server does not say, receives the url
+'''
+def _remote_size(url: str):
+    try:
+        response = get_session().head(url, timeout=DEFAULT_TIMEOUT, allow_redirects=True)
+        response.raise_for_status()
+        return int(response.headers['Content-Length'])
+    except Exception:
+        return None
+
+
+'''
+    the files a run would process with their zip sizes, from the cache or HEAD requests, and rough estimates of
+    their xml size, records and csv output, receives the date window, file types, cache folder and concurrency
+'''
+def plan_run(from_date: str = DEFAULT_FROM_DATE, to_date: str = DEFAULT_TO_DATE, file_types: tuple = FILE_TYPES,
+             cache_dir: str = CACHE_DIR, download_concurrency: int = DEFAULT_CONCURRENCY) -> list:
+    rows = _file_rows(index_rows(iter_index_pages(from_date, to_date)), file_types)
+
+    cached = [cache_path(cache_dir, row['checksum'], '.zip') if row.get('checksum') else None for row in rows]
+    cached = [path if path and os.path.exists(path) else None for path in cached]
+    with ThreadPoolExecutor(max_workers=download_concurrency) as executor:
+        sizes = list(executor.map(lambda row, path: os.path.getsize(path) if path else _remote_size(row['download_link']),
+                                  rows, cached))
+
+    plan = []
+    for row, path, zip_bytes in zip(rows, cached, sizes):
+        xml_bytes = zip_bytes * XML_COMPRESSION_RATIO if zip_bytes is not None else None
+        records = xml_bytes // XML_BYTES_PER_RECORD if xml_bytes is not None else None
+        plan.append({
+            'file_name': row['file_name'],
+            'file_type': row['file_type'],
+            'publication_date': str(row['publication_date']),
+            'cached': path is not None,
+            'zip_bytes': zip_bytes,
+            'estimated_xml_bytes': xml_bytes,
+            'estimated_records': records,
+            'estimated_csv_bytes': records * CSV_BYTES_PER_RECORD if records is not None else None,
+        })
+    return plan
+
+
+'''
+    write the collected metrics as a JSON summary, a Prometheus text file and StatsD datagrams, each when
+    its target is given, receives the targets
+'''
+def export_metrics(metrics_path: str = None, prometheus_path: str = None, statsd_address: str = None):
+    if metrics_path:
+        metrics.write_summary(metrics_path)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
+    if statsd_address:
+        metrics.send_statsd(statsd_address)
+
+
+'''
+    the index rows of a run, taken from the journal when an interrupted run with the same key saved them,
+    receives the date window, number of concurrent requests, journal path and run key
+'''
+def load_run_index(from_date: str, to_date: str, download_concurrency: int = DEFAULT_CONCURRENCY,
+                   journal_path: str = None, key: str = None) -> list:
+    journal = get_journal(journal_path) if journal_path else None
+    rows = load_index(journal, key) if journal else None
+    if rows is not None:
+        logger.info("Resuming an interrupted run with the %d files of its saved index.", len(rows))
+        for row in rows:
+            row['publication_date'] = _index_date(row['publication_date'])
+            row['timestamp'] = _index_date(row['timestamp'])
+        return rows
+
+    rows = index_rows(iter_index_pages(from_date, to_date, concurrency=download_concurrency))
+    if journal and rows:
+        save_index(journal, key, rows)
+    return rows
+
+
+'''
+    build the lookup index of a run from its per-file outputs, receives the output paths and index path
+'''
+def build_run_lookup(output_paths: list, lookup_path: str):
+    with metrics.track('lookup') as span:
+        count = build_lookup_from_outputs(output_paths, lookup_path)
+        span.add(records=count, path_out=lookup_path)
+    logger.info("Indexed %d instruments in %s.", count, lookup_path)
+
+
+'''
+    main, returns whether every file of the run made it into the output or the master, the journal, merged
+    output and lookup index are only finished when it did
+'''
+def main(from_date: str = DEFAULT_FROM_DATE, to_date: str = DEFAULT_TO_DATE, output_format: str = OUTPUT_FORMAT,
+         master_path: str = None, columns: list = CSV_HEADER, metrics_path: str = None, prometheus_path: str = None,
+         statsd_address: str = None, output_dir: str = OUTPUT_DIR, cache_dir: str = CACHE_DIR,
+         file_types: tuple = FILE_TYPES, workers: int = None, download_concurrency: int = DEFAULT_CONCURRENCY,
+         shard_workers: int = 1, sink: str = None, memory_budget: int = None, journal_path: str = None,
+         partition_by: tuple = None, lookup_path: str = None, cache_max_bytes: int = CACHE_MAX_BYTES):
+    # Metrics cost nothing unless one of their exports is asked for
+    if metrics_path or prometheus_path or statsd_address:
+        metrics.enable_metrics()
+
+    # Partitions are read from their own columns, which the output keeps
+    if partition_by:
+        columns = partition_columns(columns, partition_by)
+
+    # A restart with the same arguments resumes the run recorded in the journal
+    key = run_key(from_date, to_date, file_types, output_format, columns, sink, master_path, partition_by)
+    index = load_run_index(from_date, to_date, download_concurrency, journal_path, key)
+
+    # Incremental mode keeps the instrument master up to date instead of writing a standalone output
+    if master_path:
+        finished = update_master(index, master_path, download_concurrency, cache_dir) is not None
+        if finished and journal_path:
+            finish_run(get_journal(journal_path), key)
+        evict_cache(cache_dir, cache_max_bytes)
+        export_metrics(metrics_path, prometheus_path, statsd_address)
+        return finished
+
+    target = resolve_sink(sink, output_format, partition_by)
+    options = {
+        'workers': workers_for_budget(memory_budget, workers, shard_workers),
+        'output_dir': output_dir,
+        'download_concurrency': download_concurrency,
+        'cache_dir': cache_dir,
+        'output_format': output_format,
+        'columns': columns,
+        'shard_workers': shard_workers,
+        'file_types': file_types,
+        'journal_path': journal_path,
+        'partition_by': partition_by,
+    }
+    # A run that dropped files is not published, a restart with the journal retries them
+    expected = sum(row['file_type'] in file_types for row in _index_records(index))
+    if output_format == 'csv' and not partition_by:
+        # Each csv output goes straight to the sink as soon as it is parsed, while the next files are still in flight
+        with open_output_stream(target) as output:
+            results = process_all_files(index, csv_upload=output, **options)
+            finished = bool(results) and len(results) == expected
+            if not finished:
+                discard_output(output, target)
+    else:
+        results = process_all_files(index, **options)
+        finished = False
+        if results and len(results) == expected:
+            output_paths = [result['output_path'] for result in results]
+            merged_path = target.get('path') or os.path.join(output_dir, os.path.basename(target['key']))
+            # The Parquet writer and partitioned merges expect the folder of a local sink to exist
+            os.makedirs(os.path.dirname(os.path.abspath(merged_path)), exist_ok=True)
+            merged_path = merge_outputs(output_paths, merged_path, output_format, partition_by)
+            if merged_path and 'key' in target and partition_by:
+                upload_folder(merged_path, target['bucket'], target['key'])
+            elif merged_path and 'key' in target:
+                upload_csv_file(merged_path, target['key'], target['bucket'])
+            finished = merged_path is not None
+    if finished and lookup_path:
+        build_run_lookup([result['output_path'] for result in results], lookup_path)
+    if finished and journal_path:
+        finish_run(get_journal(journal_path), key)
+    evict_cache(cache_dir, cache_max_bytes)
+    export_metrics(metrics_path, prometheus_path, statsd_address)
+    return finished
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    from module.cli import run
+    sys.exit(run())
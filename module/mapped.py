@@ -0,0 +1,87 @@
+import logging
+import mmap
+import os
+import struct
+import zipfile
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bytes handed to the xml parser at a time, slices of the mapping so nothing is copied. Larger chunks
+# build more elements before any record is released, which is slower than iterparse's own read size
+FEED_SIZE = 16 * 1024
+
+# Fixed part of a zip local file header, followed by the file name and extra field
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+'''
+    read-only memory map of a file, or of a byte range of it, exposing the mapped bytes as a buffer for
+    scanning and as zero-copy chunks for the xml parser
+'''
+class MappedFile:
+
+    def __init__(self, path: str, offset: int = 0, length: int = None):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        length = size - offset if length is None else length
+
+        # Empty files cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if self._map is not None and hasattr(self._map, 'madvise'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        self.buffer = memoryview(self._map)[offset:offset + length] if self._map is not None else memoryview(b'')
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def iter_chunks(self, ranges: list = None, chunk_size: int = FEED_SIZE):
+        buffer = self.buffer
+        for start, end in ranges or [(0, len(buffer))]:
+            for position in range(start, end, chunk_size):
+                yield buffer[position:min(position + chunk_size, end)]
+
+    def close(self):
+        if self._file is None:
+            return
+        self.buffer.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A chunk of an unfinished parse is still referenced, the mapping is unmapped along with it
+                logger.debug("Mapping of %s still in use, left to the garbage collector.", self.path)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+'''
+    memory map a zip member stored without compression, None for compressed members which have to be
+    decompressed as a stream, receives the .zip path and the member name
+'''
+def map_zip_member(zip_path: str, member: str):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        info = zip_ref.getinfo(member)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        # The data follows the local header, whose name and extra field may differ from the central directory
+        zip_ref.fp.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(zip_ref.fp.read(_LOCAL_HEADER.size))
+        if header[0] != _LOCAL_HEADER_SIGNATURE:
+            logger.error("Bad local header for %s in %s.", member, zip_path)
+            return None
+        offset = info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+
+    return MappedFile(zip_path, offset, info.file_size)
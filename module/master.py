@@ -0,0 +1,124 @@
+import logging
+import os
+import sqlite3
+
+
+logger = logging.getLogger(__name__)
+
+
+# Local instrument master, one row per FinInstrmGnlAttrbts.Id
+MASTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instrument_master.sqlite')
+
+# Changes held in memory before they are written in one executemany
+MASTER_BATCH_SIZE = 10_000
+
+UPSERT_RECORD_TYPES = ('NewRcrd', 'ModfdRcrd')
+DELETE_RECORD_TYPES = ('TermntdRcrd', 'CancRcrd')
+
+MASTER_COLUMNS = ['id', 'full_nm', 'clssfctn_tp', 'cmmdty_deriv_ind', 'ntnl_ccy', 'issr', 'record_type', 'source']
+
+UPSERT_SQL = (
+    "INSERT INTO instruments (%s) VALUES (%s) ON CONFLICT(id) DO UPDATE SET %s" % (
+        ', '.join(MASTER_COLUMNS),
+        ', '.join('?' * len(MASTER_COLUMNS)),
+        ', '.join('%s = excluded.%s' % (column, column) for column in MASTER_COLUMNS[1:]),
+    )
+)
+DELETE_SQL = "DELETE FROM instruments WHERE id = ?"
+
+
+'''
+    open the master and create its tables if needed, receives the path
+'''
+def open_master(path: str = MASTER_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS instruments ("
+        "id TEXT PRIMARY KEY, full_nm TEXT, clssfctn_tp TEXT, cmmdty_deriv_ind TEXT, "
+        "ntnl_ccy TEXT, issr TEXT, record_type TEXT, source TEXT) WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS applied_files ("
+        "checksum TEXT PRIMARY KEY, file_name TEXT, upserts INTEGER, deletes INTEGER, "
+        "applied_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+    )
+    conn.commit()
+    return conn
+
+
+'''
+    whether a delta file was already applied, receives the connection and checksum
+'''
+def is_applied(conn: sqlite3.Connection, checksum: str) -> bool:
+    return conn.execute("SELECT 1 FROM applied_files WHERE checksum = ?", (checksum,)).fetchone() is not None
+
+
+'''
+    the change a FinInstrm record makes to the master, None to delete, receives the record and source file
+'''
+def _master_change(instrm: dict, source: str):
+    # An empty FinInstrm is parsed as None
+    if not instrm:
+        return None, None
+    for record_type, record in instrm.items():
+        if record_type in DELETE_RECORD_TYPES:
+            return record['FinInstrmGnlAttrbts']['Id'], None
+        if record_type in UPSERT_RECORD_TYPES:
+            attributes = record['FinInstrmGnlAttrbts']
+            return attributes['Id'], (
+                attributes['Id'],
+                attributes.get('FullNm'),
+                attributes.get('ClssfctnTp'),
+                attributes.get('CmmdtyDerivInd'),
+                attributes.get('NtnlCcy'),
+                record.get('Issr'),
+                record_type,
+                source,
+            )
+    return None, None
+
+
+'''
+    write a batch of changes, the last change of an id within the batch wins, receives the connection and batch
+'''
+def _flush_changes(conn: sqlite3.Connection, changes: dict) -> tuple:
+    deletes = [(id_,) for id_, row in changes.items() if row is None]
+    upserts = [row for row in changes.values() if row is not None]
+    conn.executemany(DELETE_SQL, deletes)
+    conn.executemany(UPSERT_SQL, upserts)
+    changes.clear()
+    return len(upserts), len(deletes)
+
+
+'''
+    apply the records of one delta file to the master in batches inside a single transaction, so a file is
+    either fully applied or not at all, receives the connection, records, checksum, file name and batch size
+'''
+def apply_delta(conn: sqlite3.Connection, instruments, checksum: str = None, file_name: str = None,
+                batch_size: int = MASTER_BATCH_SIZE) -> dict:
+    counts = {'upserts': 0, 'deletes': 0}
+    changes = {}
+
+    with conn:
+        for instrm in instruments:
+            id_, row = _master_change(instrm, file_name)
+            if id_ is None:
+                continue
+            changes[id_] = row
+            if len(changes) >= batch_size:
+                upserts, deletes = _flush_changes(conn, changes)
+                counts['upserts'] += upserts
+                counts['deletes'] += deletes
+
+        upserts, deletes = _flush_changes(conn, changes)
+        counts['upserts'] += upserts
+        counts['deletes'] += deletes
+
+        if checksum:
+            conn.execute("INSERT OR REPLACE INTO applied_files (checksum, file_name, upserts, deletes) VALUES (?, ?, ?, ?)",
+                         (checksum, file_name, counts['upserts'], counts['deletes']))
+
+    logger.info("Applied %s to the instrument master: %d upserts, %d deletes.", file_name, counts['upserts'], counts['deletes'])
+    return counts
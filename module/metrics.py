@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Metrics are off unless enabled, worker processes inherit the switch through the environment
+METRICS_ENV = 'FIRDS_METRICS'
+_enabled = os.environ.get(METRICS_ENV) == '1'
+
+# Prefix of exported metric names
+METRIC_PREFIX = 'firds'
+
+STATSD_PORT = 8125
+
+# Totals of each stage of this process, stage -> counters
+_stages = {}
+_stages_lock = threading.Lock()
+_started = time.time()
+# Process the totals belong to, a forked worker starts with a copy of its parent's
+_pid = os.getpid()
+
+
+'''
+    turn metrics collection on for this process and the worker processes it starts
+'''
+def enable_metrics():
+    global _enabled
+    _enabled = True
+    os.environ[METRICS_ENV] = '1'
+
+
+'''
+    turn metrics collection off
+'''
+def disable_metrics():
+    global _enabled
+    _enabled = False
+    os.environ.pop(METRICS_ENV, None)
+
+
+'''
+    whether metrics are being collected
+'''
+def metrics_enabled() -> bool:
+    return _enabled
+
+
+'''
+    peak resident set size of this process in bytes, 0 where the resource module is missing
+'''
+def peak_rss() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+'''
+    size of a file, 0 when there is none, receives the path
+'''
+def _file_size(path: str) -> int:
+    if not path:
+        return 0
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+'''
+    measurement of one call of a stage, added to the stage totals when it ends
+'''
+class Span:
+
+    def __init__(self, stage: str, bytes_in: int = 0):
+        self.stage = stage
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.records = 0
+
+    def add(self, bytes_in: int = 0, bytes_out: int = 0, records: int = 0, path_in: str = None, path_out: str = None):
+        # Files are only looked at while metrics are on
+        self.bytes_in += bytes_in + _file_size(path_in)
+        self.bytes_out += bytes_out + _file_size(path_out)
+        self.records += records
+
+    def __enter__(self):
+        self._rss = peak_rss()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.stage, time.perf_counter() - self._start, self.bytes_in, self.bytes_out, self.records,
+               peak_rss() - self._rss, failed=exc_type is not None)
+
+
+'''
+    stand-in span while metrics are off, so measured code costs one call and nothing else
+'''
+class _NullSpan:
+
+    def add(self, bytes_in: int = 0, bytes_out: int = 0, records: int = 0, path_in: str = None, path_out: str = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+'''
+    measure a block as one call of a stage: wall time, peak RSS growth and the bytes and records given to the
+    span, receives the stage name and the bytes read
+'''
+def track(stage: str, bytes_in: int = 0):
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(stage, bytes_in)
+
+
+'''
+    the totals of a stage, created empty on first use, receives the stage
+'''
+def _stage_totals(stage: str) -> dict:
+    totals = _stages.get(stage)
+    if totals is None:
+        totals = _stages[stage] = {'calls': 0, 'failures': 0, 'seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0,
+                                   'records': 0, 'peak_rss_delta': 0}
+    return totals
+
+
+'''
+    add one call to the totals of a stage, receives the stage, seconds, bytes, records and RSS growth
+'''
+def record(stage: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0, records: int = 0, rss_delta: int = 0,
+           failed: bool = False):
+    with _stages_lock:
+        totals = _stage_totals(stage)
+        totals['calls'] += 1
+        totals['failures'] += failed
+        totals['seconds'] += seconds
+        totals['bytes_in'] += bytes_in
+        totals['bytes_out'] += bytes_out
+        totals['records'] += records
+        totals['peak_rss_delta'] = max(totals['peak_rss_delta'], rss_delta)
+
+
+'''
+    the stage totals collected so far and reset them, used by worker processes to hand their totals back
+'''
+def drain() -> dict:
+    with _stages_lock:
+        stages = {stage: dict(totals) for stage, totals in _stages.items()}
+        _stages.clear()
+    return stages
+
+
+'''
+    add stage totals from another process, receives the totals from drain
+'''
+def merge(stages: dict):
+    with _stages_lock:
+        for stage, totals in (stages or {}).items():
+            current = _stage_totals(stage)
+            for key in ('calls', 'failures', 'seconds', 'bytes_in', 'bytes_out', 'records'):
+                current[key] += totals[key]
+            current['peak_rss_delta'] = max(current['peak_rss_delta'], totals['peak_rss_delta'])
+
+
+'''
+    forget the totals collected so far
+'''
+def reset_metrics():
+    global _started
+    _stages.clear()
+    _started = time.time()
+
+
+'''
+    start a worker process with empty totals, pools pass it as their initializer, a forked worker holds a copy
+    of the parent's totals that its first drain would hand back to be counted twice, threads of the parent
+    keep sharing its totals
+'''
+def init_worker():
+    global _pid, _stages_lock
+    if os.getpid() == _pid:
+        return
+    _pid = os.getpid()
+    # The copied lock may have been held by a thread of the parent at the fork
+    _stages_lock = threading.Lock()
+    reset_metrics()
+
+
+'''
+    run summary with the totals and rates of every stage
+'''
+def summary() -> dict:
+    stages = {}
+    for stage, totals in _stages.items():
+        seconds = totals['seconds']
+        stages[stage] = dict(totals, records_per_second=totals['records'] / seconds if seconds else 0.0,
+                             mib_per_second=totals['bytes_in'] / seconds / 1024 ** 2 if seconds else 0.0)
+    return {'started_at': _started, 'seconds': time.time() - _started, 'peak_rss': peak_rss(), 'stages': stages}
+
+
+'''
+    write the run summary as JSON, receives the path
+'''
+def write_summary(path: str) -> dict:
+    run_summary = summary()
+    with open(path, 'w', encoding='utf-8') as summary_file:
+        json.dump(run_summary, summary_file, indent=2, sort_keys=True)
+    logger.info("Wrote the run summary to %s.", path)
+    return run_summary
+
+
+'''
+    the stage totals in the Prometheus text exposition format, for the node exporter textfile collector
+'''
+def prometheus_text() -> str:
+    metrics = [
+        ('calls_total', 'counter', 'Calls of the stage.'),
+        ('failures_total', 'counter', 'Calls of the stage that raised.'),
+        ('seconds_total', 'counter', 'Wall time spent in the stage.'),
+        ('bytes_in_total', 'counter', 'Bytes read by the stage.'),
+        ('bytes_out_total', 'counter', 'Bytes written by the stage.'),
+        ('records_total', 'counter', 'Records handled by the stage.'),
+        ('peak_rss_delta_bytes', 'gauge', 'Largest peak RSS growth of one call of the stage.'),
+    ]
+    lines = []
+    for name, metric_type, help_text in metrics:
+        metric = '%s_stage_%s' % (METRIC_PREFIX, name)
+        key = name.replace('_total', '').replace('_bytes', '')
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, metric_type))
+        for stage, totals in sorted(_stages.items()):
+            lines.append('%s{stage="%s"} %s' % (metric, stage, totals[key]))
+    return '\n'.join(lines) + '\n'
+
+
+'''
+    write the stage totals in the Prometheus text format, receives the path
+'''
+def write_prometheus(path: str):
+    # Written next to the target and renamed so the collector never reads a partial file
+    with open(path + '.tmp', 'w', encoding='utf-8') as prometheus_file:
+        prometheus_file.write(prometheus_text())
+    os.replace(path + '.tmp', path)
+
+
+'''
+    the stage totals as StatsD lines, timings in milliseconds
+'''
+def statsd_lines() -> list:
+    lines = []
+    for stage, totals in sorted(_stages.items()):
+        prefix = '%s.%s' % (METRIC_PREFIX, stage)
+        lines.append('%s.seconds:%d|ms' % (prefix, totals['seconds'] * 1000))
+        lines.append('%s.calls:%d|c' % (prefix, totals['calls']))
+        lines.append('%s.bytes_in:%d|c' % (prefix, totals['bytes_in']))
+        lines.append('%s.bytes_out:%d|c' % (prefix, totals['bytes_out']))
+        lines.append('%s.records:%d|c' % (prefix, totals['records']))
+        lines.append('%s.peak_rss_delta:%d|g' % (prefix, totals['peak_rss_delta']))
+    return lines
+
+
+'''
+    send the stage totals to a StatsD daemon over UDP, receives the host or host:port
+'''
+def send_statsd(address: str):
+    host, _, port = address.partition(':')
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as statsd_socket:
+        for line in statsd_lines():
+            statsd_socket.sendto(line.encode('ascii'), (host, int(port or STATSD_PORT)))
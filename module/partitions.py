@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import shutil
+from collections import Counter, OrderedDict, defaultdict
+from operator import itemgetter
+from urllib.parse import quote
+from module.sinks import open_sink, sink_extension
+
+
+logger = logging.getLogger(__name__)
+
+
+# Partition keys of a partitioned output, directory name -> (column the value comes from, leading characters
+# kept, None for the whole value), cfi is the CFI category, the first letter of the classification
+PARTITION_KEYS = {
+    'ntnl_ccy': ('FinInstrmGnlAttrbts.NtnlCcy', None),
+    'cfi': ('FinInstrmGnlAttrbts.ClssfctnTp', 1),
+}
+DEFAULT_PARTITION_BY = ('ntnl_ccy', 'cfi')
+
+# Directory value of rows without one, as Hive names it
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Part files open at once, the least recently written one is closed when another partition needs a writer
+MAX_OPEN_PARTITIONS = 64
+
+# Rows buffered over all partitions, the largest buffer is written out when they are exceeded, as many as one
+# Parquet row group so a worker stays within its memory budget
+PARTITION_BUFFER_ROWS = 50_000
+
+# Manifest at the root of a partitioned output with the statistics of every partition
+MANIFEST_NAME = '_partitions.json'
+
+# Columns summarised in the statistics: the id range and the count of each record type
+ID_COLUMN = 'FinInstrmGnlAttrbts.Id'
+RECORD_TYPE_COLUMN = 'RecordType'
+
+
+'''
+    output columns with the columns the partition keys are read from, receives the columns and partition keys
+'''
+def partition_columns(columns: list, partition_by: tuple) -> list:
+    missing = [PARTITION_KEYS[name][0] for name in partition_by if PARTITION_KEYS[name][0] not in columns]
+    return list(columns) + [column for column in dict.fromkeys(missing)]
+
+
+'''
+    directory of a partition, such as ntnl_ccy=EUR/cfi=F, receives the partition keys and values
+'''
+def partition_path(partition_by: tuple, values: tuple) -> str:
+    return '/'.join('%s=%s' % (name, quote(value, safe='') if value else DEFAULT_PARTITION)
+                    for name, value in zip(partition_by, values))
+
+
+'''
+    function that takes the partition values of a row, a tuple of the key columns each cut to its leading
+    characters, receives the column index and width of each key
+'''
+def partition_key(keys: list):
+    indexes = [index for index, _ in keys]
+    if all(width is None for _, width in keys):
+        # Keys taken whole are read by one itemgetter call, which returns a bare value for a single key
+        if len(indexes) == 1:
+            index, = indexes
+            return lambda row: (row[index],)
+        return itemgetter(*indexes)
+    return lambda row: tuple(row[index] and row[index][:width] if width else row[index] for index, width in keys)
+
+
+'''
+    writes rows to a Hive-style tree of part files, one folder per partition, rows are buffered per partition
+    and written in batches, at most max_open part files are open at once and a manifest of the partitions and
+    their statistics is written on close
+'''
+class PartitionedSink:
+
+    def __init__(self, path: str, header: list, partition_by: tuple = DEFAULT_PARTITION_BY,
+                 output_format: str = 'parquet', max_open: int = MAX_OPEN_PARTITIONS,
+                 buffer_rows: int = PARTITION_BUFFER_ROWS):
+        self.path = path
+        self.header = header
+        self.partition_by = tuple(partition_by)
+        self.output_format = output_format
+        self.max_open = max(1, max_open)
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        self.partitions = {}
+
+        self._partition_of = partition_key(
+            [(header.index(PARTITION_KEYS[name][0]), PARTITION_KEYS[name][1]) for name in self.partition_by])
+        self._id = header.index(ID_COLUMN) if ID_COLUMN in header else None
+        self._record_type = header.index(RECORD_TYPE_COLUMN) if RECORD_TYPE_COLUMN in header else None
+        self._buffers = defaultdict(list)
+        self._buffered = 0
+        self._writers = OrderedDict()
+        # Parts left by an interrupted write would be counted twice
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def write(self, row):
+        self.write_many([row])
+
+    def write_many(self, rows):
+        buffers = self._buffers
+        partition_of = self._partition_of
+        buffered = self._buffered
+        for row in rows:
+            buffers[partition_of(row)].append(row)
+            buffered += 1
+            if buffered >= self.buffer_rows:
+                self._buffered = buffered
+                self._write_largest()
+                buffered = self._buffered
+        self._buffered = buffered
+
+    def _write_largest(self):
+        # The largest buffer frees the most memory for one write and keeps part files large
+        key = max(self._buffers, key=lambda key: len(self._buffers[key]))
+        self._write_partition(key, self._buffers.pop(key))
+
+    def _write_partition(self, key: tuple, rows: list):
+        self._writer(key).write_batch(rows)
+        self._buffered -= len(rows)
+        self.rows += len(rows)
+
+        stats = self.partitions[partition_path(self.partition_by, key)]
+        stats['rows'] += len(rows)
+        if self._id is not None:
+            ids = [value for value in map(itemgetter(self._id), rows) if value is not None]
+            if ids:
+                stats['min_id'] = min(ids + [stats['min_id']] if stats['min_id'] else ids)
+                stats['max_id'] = max(ids + [stats['max_id']] if stats['max_id'] else ids)
+        if self._record_type is not None:
+            stats['record_types'].update(map(itemgetter(self._record_type), rows))
+
+    def _writer(self, key: tuple):
+        writer = self._writers.get(key)
+        if writer is not None:
+            self._writers.move_to_end(key)
+            return writer
+
+        if len(self._writers) >= self.max_open:
+            # A partition written again later gets a new part file
+            _, oldest = self._writers.popitem(last=False)
+            oldest.close()
+
+        relative = partition_path(self.partition_by, key)
+        stats = self.partitions.get(relative)
+        if stats is None:
+            stats = self.partitions[relative] = {'values': dict(zip(self.partition_by, key)), 'rows': 0,
+                                                 'files': [], 'min_id': None, 'max_id': None,
+                                                 'record_types': Counter()}
+            os.makedirs(os.path.join(self.path, relative), exist_ok=True)
+        part = '%s/part-%05d%s' % (relative, len(stats['files']), sink_extension(self.output_format))
+        stats['files'].append(part)
+        writer = self._writers[key] = open_sink(self.output_format, os.path.join(self.path, part), self.header)
+        return writer
+
+    def close(self):
+        for key in list(self._buffers):
+            self._write_partition(key, self._buffers.pop(key))
+        while self._writers:
+            self._writers.popitem(last=False)[1].close()
+
+        for stats in self.partitions.values():
+            stats['bytes'] = sum(os.path.getsize(os.path.join(self.path, part)) for part in stats['files'])
+        write_manifest(self.path, self.partition_by, self.output_format, self.partitions)
+        logger.info("Wrote %d rows to %d partitions in %s.", self.rows, len(self.partitions), self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+'''
+    write the manifest of a partitioned output, receives the root folder, partition keys, format and statistics
+'''
+def write_manifest(path: str, partition_by: tuple, output_format: str, partitions: dict) -> dict:
+    manifest = {
+        'partition_by': list(partition_by),
+        'format': output_format,
+        'rows': sum(stats['rows'] for stats in partitions.values()),
+        'partitions': {relative: dict(stats, record_types=dict(stats['record_types']))
+                       for relative, stats in sorted(partitions.items())},
+    }
+    with open(os.path.join(path, MANIFEST_NAME), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+
+'''
+    the manifest of a partitioned output, receives the root folder
+'''
+def read_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST_NAME), encoding='utf-8') as manifest_file:
+        return json.load(manifest_file)
+
+
+'''
+    hard link a file, or copy it across file systems, receives the source and target paths
+'''
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+'''
+    combine partitioned outputs into one tree, each part file is linked under a new number in its partition and
+    the statistics are added up, the sources are left untouched, receives the source folders and merged folder
+'''
+def merge_partitioned_outputs(paths: list, merged_path: str) -> str:
+    if os.path.isdir(merged_path):
+        shutil.rmtree(merged_path)
+    os.makedirs(merged_path)
+
+    partitions = {}
+    partition_by, output_format = (), None
+    for path in paths:
+        manifest = read_manifest(path)
+        partition_by, output_format = manifest['partition_by'], manifest['format']
+        for relative, source in manifest['partitions'].items():
+            stats = partitions.get(relative)
+            if stats is None:
+                stats = partitions[relative] = {'values': source['values'], 'rows': 0, 'files': [], 'bytes': 0,
+                                                'min_id': None, 'max_id': None, 'record_types': Counter()}
+                os.makedirs(os.path.join(merged_path, relative), exist_ok=True)
+            for part in source['files']:
+                target = '%s/part-%05d%s' % (relative, len(stats['files']), os.path.splitext(part)[1])
+                _link_or_copy(os.path.join(path, part), os.path.join(merged_path, target))
+                stats['files'].append(target)
+            stats['rows'] += source['rows']
+            stats['bytes'] += source['bytes']
+            stats['record_types'].update(source['record_types'])
+            for key, pick in (('min_id', min), ('max_id', max)):
+                values = [value for value in (stats[key], source[key]) if value is not None]
+                stats[key] = pick(values) if values else None
+
+    write_manifest(merged_path, partition_by, output_format, partitions)
+    logger.info("Merged %d partitioned outputs into %d partitions in %s.", len(paths), len(partitions), merged_path)
+    return merged_path
+
+
+'''
+    the partitions of a partitioned output a reader needs, skipping the others from their statistics alone,
+    receives the root folder, the partition values wanted and an id to look for
+'''
+def select_partitions(path: str, values: dict = None, instrument_id: str = None) -> list:
+    selected = []
+    for relative, stats in read_manifest(path)['partitions'].items():
+        if any(stats['values'].get(name) != value for name, value in (values or {}).items()):
+            continue
+        if instrument_id is not None and not (stats['min_id'] and stats['min_id'] <= instrument_id <= stats['max_id']):
+            continue
+        selected.append(relative)
+    return selected
@@ -0,0 +1,156 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+# Items waiting between two stages, with the items in flight this bounds what a fast stage can run ahead
+QUEUE_SIZE = 2
+
+# How often a blocked stage checks whether the pipeline was stopped
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+'''
+    exception raised by a stage, carried downstream to the consumer
+'''
+class _Failure:
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+'''
+    one step of a pipeline, run on its own thread with up to concurrency items in flight on an executor,
+    results leave in the order the items came in and None results are dropped
+'''
+class Stage:
+
+    def __init__(self, name: str, func, concurrency: int = 1, executor=None, size=None):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.executor = executor
+        # Bytes of a result, for the throughput report
+        self.size = size
+        self.items = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def run(self, inbox: queue.Queue, outbox: queue.Queue, stop: threading.Event):
+        start = time.perf_counter()
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.concurrency,
+                                                       thread_name_prefix='stage-' + self.name)
+        in_flight = deque()
+        try:
+            while True:
+                item = _get(inbox, stop)
+                if item is _DONE or isinstance(item, _Failure):
+                    break
+                in_flight.append(executor.submit(self.func, item))
+                if len(in_flight) >= self.concurrency and not self._emit(in_flight.popleft().result(), outbox, stop):
+                    return
+            while in_flight:
+                if not self._emit(in_flight.popleft().result(), outbox, stop):
+                    return
+            _put(outbox, item, stop)
+        except BaseException as e:
+            for future in in_flight:
+                future.cancel()
+            _put(outbox, _Failure(e), stop)
+        finally:
+            if self.executor is None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            self.seconds = time.perf_counter() - start
+
+    def _emit(self, result, outbox: queue.Queue, stop: threading.Event) -> bool:
+        if result is None:
+            return True
+        self.items += 1
+        if self.size:
+            self.bytes += self.size(result) or 0
+        return _put(outbox, result, stop)
+
+    def report(self) -> dict:
+        seconds = self.seconds or float('inf')
+        logger.info("Stage %s: %d items in %.2fs, %.2f items/s, %.2f MiB/s.", self.name, self.items, self.seconds,
+                    self.items / seconds, self.bytes / seconds / 1024 ** 2)
+        return {'stage': self.name, 'items': self.items, 'bytes': self.bytes, 'seconds': self.seconds}
+
+
+'''
+    take the next item of a queue, _DONE once the pipeline is stopped, receives the queue and stop event
+'''
+def _get(inbox: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return inbox.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+'''
+    put an item on a queue, waiting while it is full, False once the pipeline is stopped,
+    receives the queue, item and stop event
+'''
+def _put(outbox: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+'''
+    feed the items to the first queue, receives the items, queue and stop event
+'''
+def _feed(items, outbox: queue.Queue, stop: threading.Event):
+    try:
+        for item in items:
+            if not _put(outbox, item, stop):
+                return
+        _put(outbox, _DONE, stop)
+    except BaseException as e:
+        _put(outbox, _Failure(e), stop)
+
+
+'''
+    run the stages concurrently, each joined to the next by a bounded queue, and yield the results of
+    the last stage in order, a full queue blocks the stage before it so memory stays bounded,
+    receives the items, stages and queue size
+'''
+def run_pipeline(items, stages: list, queue_size: int = QUEUE_SIZE):
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=_feed, args=(items, queues[0], stop), name='stage-feed', daemon=True)]
+    for position, stage in enumerate(stages):
+        threads.append(threading.Thread(target=stage.run, args=(queues[position], queues[position + 1], stop),
+                                        name='stage-' + stage.name, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            result = queues[-1].get()
+            if result is _DONE:
+                break
+            if isinstance(result, _Failure):
+                raise result.error
+            yield result
+    finally:
+        # Stops the other stages when the consumer fails or leaves early
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for stage in stages:
+            stage.report()
@@ -0,0 +1,214 @@
+import logging
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+
+# Pseudo column holding the tag of the record (NewRcrd, ModfdRcrd, ...)
+RECORD_TYPE_COLUMN = 'RecordType'
+
+# Record element of FULINS files, which holds the record fields itself where a DLTINS FinInstrm wraps them in a
+# NewRcrd, ModfdRcrd, TermntdRcrd or CancRcrd child, its tag doubles as its record type
+REF_DATA_TAG = 'RefData'
+
+# Separator of repeated values, such as the ISINs of a basket underlying
+VALUE_SEPARATOR = ';'
+
+# Columns with a few distinct values repeated over millions of rows, each value is kept once in memory
+INTERNED_COLUMNS = frozenset(['FinInstrmGnlAttrbts.NtnlCcy', 'FinInstrmGnlAttrbts.ClssfctnTp',
+                              'FinInstrmGnlAttrbts.CmmdtyDerivInd'])
+
+_EMPTY = {}
+
+
+'''
+    namespaced tag -> local name, filled on first sight of a tag, a few dozen distinct tags are seen millions of times
+'''
+class _LocalNames(dict):
+
+    def __missing__(self, tag: str) -> str:
+        name = self[tag] = tag.rpartition('}')[2]
+        return name
+
+
+# Local names of every tag parsed by this process, shared by the parsers and the extractors
+local_names = _LocalNames()
+
+
+'''
+    a node of the record as a dict, repeated elements are merged so their leaves become lists, receives the value
+'''
+def _node(value) -> dict:
+    if value.__class__ is dict:
+        return value
+    if value.__class__ is list:
+        merged = {}
+        for item in value:
+            for key, child in _node(item).items():
+                merged.setdefault(key, []).append(child)
+        return merged
+    return _EMPTY
+
+
+'''
+    the output value of a leaf, element text for elements with attributes and joined values for
+    repeated elements, receives the value
+'''
+def _leaf(value):
+    if value is None or value.__class__ is str:
+        return value
+    if value.__class__ is dict:
+        return value.get('#text')
+    values = [_leaf(item) for item in value]
+    return VALUE_SEPARATOR.join(item for item in values if item is not None) or None
+
+
+'''
+    compile dotted column paths into one generated function that turns FinInstrm records into rows,
+    shared path prefixes are looked up once per record, receives the columns and the accepted record types
+'''
+def compile_extractor(columns: list, record_types):
+    lines = [
+        "def extract(instruments):",
+        "    for instrm in instruments:",
+        # Empty FinInstrm elements are parsed as None and hold no record
+        "        if not instrm:",
+        "            continue",
+        "        for record_type in instrm:",
+        "            break",
+        "        if record_type not in record_types:",
+        "            continue",
+        "        n0 = instrm[record_type]",
+        "        if n0.__class__ is not dict:",
+        "            n0 = _node(n0)",
+    ]
+    nodes = {(): 'n0'}
+    values = []
+    for position, column in enumerate(columns):
+        if column == RECORD_TYPE_COLUMN:
+            values.append('record_type')
+            continue
+
+        keys = tuple(column.split('.'))
+        for depth in range(1, len(keys)):
+            prefix = keys[:depth]
+            if prefix not in nodes:
+                nodes[prefix] = 'n%d' % len(nodes)
+                lines.append("        %s = %s.get(%r)" % (nodes[prefix], nodes[prefix[:-1]], keys[depth - 1]))
+                lines.append("        if %s.__class__ is not dict:" % nodes[prefix])
+                lines.append("            %s = _node(%s)" % (nodes[prefix], nodes[prefix]))
+
+        leaf = 'v%d' % position
+        values.append("(%s if (%s := %s.get(%r)).__class__ is str else _leaf(%s))"
+                      % (leaf, leaf, nodes[keys[:-1]], keys[-1], leaf))
+
+    lines.append("        yield (%s,)" % ", ".join(values))
+
+    namespace = {'record_types': frozenset(record_types), '_node': _node, '_leaf': _leaf}
+    exec(compile("\n".join(lines), '<extractor %s>' % ','.join(columns), 'exec'), namespace)
+    logger.debug("Compiled extractor for %d columns.", len(columns))
+    return namespace['extract']
+
+
+'''
+    value of repeated leaves, the non empty ones joined, receives the value so far and the next one
+'''
+def _join(value, more):
+    if more is None:
+        return value
+    return more if value is None else value + VALUE_SEPARATOR + more
+
+
+'''
+    nested dict of the element children each column needs, each node holding the positions of the columns
+    it ends under the '' key, receives the columns
+'''
+def _column_tree(columns: list) -> dict:
+    tree = {}
+    for position, column in enumerate(columns):
+        if column == RECORD_TYPE_COLUMN:
+            continue
+        node = tree
+        for key in column.split('.'):
+            node = node.setdefault(key, {})
+        node.setdefault('', []).append(position)
+    return tree
+
+
+'''
+    lines of the generated code that walk the children of an element down the column tree, each child is
+    visited once and the leaves of the columns are read from its text, receives the tree node, element
+    variable, depth, indent and lines
+'''
+def _walk_lines(node: dict, elem: str, depth: int, indent: str, lines: list):
+    children = []
+    for key, child in node.items():
+        if key.startswith('@'):
+            for position in child['']:
+                lines.append("%sv%d = _join(v%d, %s.get(%r))" % (indent, position, position, elem, key[1:]))
+        elif key == '#text':
+            lines.append("%sif (t := %s.text) is not None:" % (indent, elem))
+            lines.append("%s    t = t.strip() or None" % indent)
+            for position in child['']:
+                lines.append("%sv%d = _join(v%d, t)" % (indent, position, position))
+        elif key:
+            children.append((key, child))
+    if not children:
+        return
+
+    lines.append("%sfor c%d in %s:" % (indent, depth, elem))
+    lines.append("%s    k%d = _names[c%d.tag]" % (indent, depth, depth))
+    body = indent + '        '
+    for number, (key, child) in enumerate(children):
+        lines.append("%s    %s k%d == %r:" % (indent, 'elif' if number else 'if', depth, key))
+        if '' in child:
+            lines.append("%sif (t := c%d.text) is not None:" % (body, depth))
+            lines.append("%s    t = t.strip() or None" % body)
+            for position in child['']:
+                lines.append("%sv%d = t if v%d is None else _join(v%d, t)" % (body, position, position, position))
+        _walk_lines(child, 'c%d' % depth, depth + 1, body, lines)
+
+
+'''
+    compile dotted column paths into one generated function that turns FinInstrm and RefData elements straight
+    into row tuples, without building a dict per record, each record is walked once and values of the interned columns
+    are shared between rows, gives the same rows as compile_extractor over the dicts of the same records,
+    receives the columns and the accepted record types
+'''
+def compile_element_extractor(columns: list, record_types):
+    lines = [
+        "def extract(instruments):",
+        "    for instrm in instruments:",
+        "        record_type = _names[instrm.tag]",
+        "        if record_type == %r:" % REF_DATA_TAG,
+        "            record = instrm",
+        "        else:",
+        "            for record in instrm:",
+        "                break",
+        "            else:",
+        "                continue",
+        "            record_type = _names[record.tag]",
+        "        if record_type not in record_types:",
+        "            continue",
+    ]
+    positions = [position for position, column in enumerate(columns) if column != RECORD_TYPE_COLUMN]
+    if positions:
+        lines.append("        %s = None" % " = ".join('v%d' % position for position in positions))
+    _walk_lines(_column_tree(columns), 'record', 1, '        ', lines)
+
+    values = []
+    for position, column in enumerate(columns):
+        if column == RECORD_TYPE_COLUMN:
+            values.append('record_type')
+        elif column in INTERNED_COLUMNS:
+            values.append("(v%d and _intern(v%d))" % (position, position))
+        else:
+            values.append('v%d' % position)
+    lines.append("        yield (%s,)" % ", ".join(values))
+
+    namespace = {'record_types': frozenset(record_types), '_names': local_names, '_join': _join,
+                 '_intern': sys.intern}
+    exec(compile("\n".join(lines), '<element extractor %s>' % ','.join(columns), 'exec'), namespace)
+    logger.debug("Compiled element extractor for %d columns.", len(columns))
+    return namespace['extract']
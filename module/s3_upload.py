@@ -0,0 +1,153 @@
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+# S3 needs every part but the last to be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+UPLOAD_CONCURRENCY = 4
+PART_RETRIES = 3
+
+# S3 client, created once per process
+_s3_client = None
+
+
+'''
+    S3 client shared by every upload of this process
+'''
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        # boto3 is imported on first use, runs writing to a local sink never load it
+        import boto3
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+
+'''
+    writable binary stream that uploads to S3 as a multipart upload while it is being written,
+    sending several parts at once and retrying each part on its own
+'''
+class MultipartUploader(io.RawIOBase):
+
+    def __init__(self, bucket: str, key: str, client=None, part_size: int = PART_SIZE,
+                 concurrency: int = UPLOAD_CONCURRENCY, retries: int = PART_RETRIES):
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+        self.client = client or get_s3_client()
+        self.part_size = part_size
+        self.retries = retries
+        self.bytes_written = 0
+
+        self._buffer = bytearray()
+        self._parts = []
+        # At most twice the concurrency of parts are held in memory at once
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._upload_id = self.client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _submit(self, body: bytes):
+        self._slots.acquire()
+        part_number = len(self._parts) + 1
+        self._parts.append(self._executor.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number: int, body: bytes) -> dict:
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                       PartNumber=part_number, Body=body)
+                    return {'PartNumber': part_number, 'ETag': response['ETag']}
+                except (BotoCoreError, ClientError) as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning("Retrying part %d of s3://%s/%s after: %s", part_number, self.bucket, self.key, e)
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # The last part may be smaller than the part size, or empty when nothing was written
+            if self._buffer or not self._parts:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [future.result() for future in self._parts]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                  MultipartUpload={'Parts': parts})
+            logger.info("Uploaded %d bytes in %d parts to s3://%s/%s.", self.bytes_written, len(parts), self.bucket, self.key)
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        if self.closed:
+            return
+        logger.error("Aborting multipart upload to s3://%s/%s.", self.bucket, self.key)
+        for future in self._parts:
+            future.cancel()
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        self._executor.shutdown(wait=True)
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+'''
+    text stream over a multipart upload for csv writers, completed on success and aborted on error,
+    receives the bucket and key
+'''
+@contextmanager
+def open_text_upload(bucket: str, key: str, **kwargs):
+    uploader = MultipartUploader(bucket, key, **kwargs)
+    text_stream = io.TextIOWrapper(uploader, encoding='utf-8', newline='')
+    try:
+        yield text_stream
+        text_stream.detach()
+    except BaseException:
+        uploader.abort()
+        raise
+    uploader.close()
+
+
+'''
+    upload every file under a folder to a prefix, keeping their relative paths, several files at once,
+    returns the keys, receives the folder, bucket and prefix
+'''
+def upload_folder(path: str, bucket: str, prefix: str, client=None, concurrency: int = UPLOAD_CONCURRENCY) -> list:
+    client = client or get_s3_client()
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    keys = [prefix.rstrip('/') + '/' + os.path.relpath(file, path).replace(os.sep, '/') for file in files]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda file, key: client.upload_file(file, bucket, key), files, keys))
+    logger.info("Uploaded %d files from %s to s3://%s/%s.", len(files), path, bucket, prefix)
+    return keys
@@ -0,0 +1,118 @@
+import logging
+import os
+import re
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+# Window searched at a time while looking backwards for the last record
+SCAN_SIZE = 1024 * 1024
+
+# Bytes kept between two windows so a tag split across them is still found
+SCAN_OVERLAP = 64
+
+# Opening and closing tags of a record, a FinInstrm in DLTINS files and a RefData in FULINS files, with or
+# without a namespace prefix, an empty record such as <FinInstrm/> both opens and closes
+RECORD_START = re.compile(rb'<(?:[\w.-]+:)?(?:FinInstrm|RefData)[\s/>]')
+RECORD_END = re.compile(rb'</(?:[\w.-]+:)?(?:FinInstrm|RefData)\s*>|<(?:[\w.-]+:)?(?:FinInstrm|RefData)(?:\s[^<>]*)?/>')
+
+
+'''
+    offset of the first record start tag at or after an offset, None when there is none before the limit,
+    receives the buffer, offset and limit
+'''
+def find_record_start(buffer, offset: int, limit: int):
+    match = RECORD_START.search(buffer, offset, limit)
+    return match.start() if match else None
+
+
+'''
+    offset just past the last record end tag, None when the buffer has no record, receives the buffer
+'''
+def find_records_end(buffer):
+    end = len(buffer)
+    while end > 0:
+        start = max(0, end - SCAN_SIZE)
+        last = None
+        for last in RECORD_END.finditer(buffer, start, end):
+            pass
+        if last:
+            return last.end()
+        if start == 0:
+            return None
+        end = start + SCAN_OVERLAP
+    return None
+
+
+'''
+    split a mapped xml file into byte ranges that each hold whole records, found by probing evenly
+    spaced offsets for the next record start, receives the MappedFile and number of shards
+'''
+def shard_ranges(mapped, num_shards: int) -> dict:
+    buffer = mapped.buffer
+    first = find_record_start(buffer, 0, len(buffer))
+    last = find_records_end(buffer) if first is not None else None
+    if first is None or last is None or last <= first:
+        logger.error("No FinInstrm record found in %s.", mapped.path)
+        return None
+
+    boundaries = [first]
+    step = (last - first) / max(num_shards, 1)
+    for number in range(1, num_shards):
+        boundary = find_record_start(buffer, int(first + step * number), last)
+        # Records longer than a shard make neighbouring probes land on the same boundary
+        if boundary is not None and boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries.append(last)
+
+    shards = list(zip(boundaries, boundaries[1:]))
+    logger.info("Split %s into %d shards.", os.path.basename(mapped.path), len(shards))
+    # Every shard is parsed between the header and the footer of the file so it is a document on its own
+    return {'header': (0, first), 'shards': shards, 'footer': (last, len(buffer))}
+
+
+'''
+    byte ranges that make one shard a standalone document, receives the layout from shard_ranges and
+    the shard number
+'''
+def shard_document(layout: dict, number: int) -> list:
+    return [layout['header'], layout['shards'][number], layout['footer']]
+
+
+'''
+    chunks of xml passed through unchanged while the offsets of their record start tags are noted, so the
+    offset of a record can be looked up by its number once its start tag has been fed to the parser,
+    receives the chunks, the offset of the first chunk and the number of the first record in them
+'''
+class RecordOffsets:
+
+    def __init__(self, chunks, offset: int = 0, first_record: int = 0):
+        self.chunks = chunks
+        self.offset = offset
+        # Offset of every start tag seen and not yet looked past, the first one is record first_record
+        self.first_record = first_record
+        self.starts = deque()
+
+    def __iter__(self):
+        tail = b''
+        for chunk in self.chunks:
+            # A tag split between two chunks is only found with the end of the previous chunk in front
+            if tail:
+                window = tail + bytes(chunk[:SCAN_OVERLAP])
+                for match in RECORD_START.finditer(window):
+                    if match.start() < len(tail) < match.end():
+                        self.starts.append(self.offset - len(tail) + match.start())
+            for match in RECORD_START.finditer(chunk):
+                self.starts.append(self.offset + match.start())
+            tail = (tail + bytes(chunk[-SCAN_OVERLAP:]))[-SCAN_OVERLAP:]
+            self.offset += len(chunk)
+            yield chunk
+
+    def record_offset(self, number: int):
+        # Offsets of earlier records are never asked for again
+        while self.starts and self.first_record < number:
+            self.starts.popleft()
+            self.first_record += 1
+        return self.starts[0] if self.starts and self.first_record == number else None
@@ -0,0 +1,208 @@
+import csv
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+# pyarrow is optional and slow to import, it is loaded by load_pyarrow the first time Parquet is written
+pa = None
+pq = None
+
+
+# Rows buffered before a Parquet row group is written
+BATCH_SIZE = 50_000
+PARQUET_COMPRESSION = 'zstd'
+
+# Low-cardinality columns stored dictionary-encoded, and flag columns stored as booleans
+DICTIONARY_COLUMNS = {'FinInstrmGnlAttrbts.NtnlCcy', 'FinInstrmGnlAttrbts.ClssfctnTp'}
+BOOLEAN_COLUMNS = {'FinInstrmGnlAttrbts.CmmdtyDerivInd'}
+
+
+'''
+    import pyarrow into this module, whether it is installed
+'''
+def load_pyarrow() -> bool:
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+'''
+    writes rows to a csv file under a header, or appends them to a file that already has it
+'''
+class CsvSink:
+    extension = '.csv'
+
+    def __init__(self, path: str, header: list, append: bool = False):
+        self.path = path
+        self._file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if not append:
+            self._writer.writerow(header)
+        self.rows = 0
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self.rows += 1
+
+    def write_many(self, rows):
+        # Rows may be a lazy stream over a whole file, so they are counted as written rather than listed first
+        writerow = self._writer.writerow
+        count = 0
+        for row in rows:
+            writerow(row)
+            count += 1
+        self.rows += count
+
+    def write_batch(self, rows: list):
+        self._writer.writerows(rows)
+        self.rows += len(rows)
+
+    def flush(self) -> int:
+        # Bytes on disk once flushed, the offset a resumed parse truncates back to
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+'''
+    writes rows to a compressed Parquet file, one row group per batch of rows
+'''
+class ParquetSink:
+    extension = '.parquet'
+
+    def __init__(self, path: str, header: list, batch_size: int = BATCH_SIZE, compression: str = PARQUET_COMPRESSION):
+        if not load_pyarrow():
+            raise ImportError("pyarrow is required for Parquet output.")
+
+        self.path = path
+        self.schema = parquet_schema(header)
+        self.batch_size = batch_size
+        self.rows = 0
+        self._rows = []
+        self._writer = pq.ParquetWriter(
+            path,
+            self.schema,
+            compression=compression,
+            use_dictionary=[name for name in header if name in DICTIONARY_COLUMNS],
+        )
+
+    def write(self, row):
+        self._rows.append(row)
+        self.rows += 1
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def write_batch(self, rows: list):
+        # Rows buffered by the caller are written as a row group of their own
+        self.flush()
+        self._rows = rows
+        self.rows += len(rows)
+        self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        columns = zip(*self._rows)
+        arrays = [_to_array(values, field) for values, field in zip(columns, self.schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+SINKS = {
+    'csv': CsvSink,
+    'parquet': ParquetSink,
+}
+
+
+'''
+    typed Parquet schema for the output columns, receives the header
+'''
+def parquet_schema(header: list):
+    load_pyarrow()
+    fields = []
+    for name in header:
+        if name in DICTIONARY_COLUMNS:
+            fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        elif name in BOOLEAN_COLUMNS:
+            fields.append(pa.field(name, pa.bool_()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+'''
+    arrow array of one column of a batch, receives the values and the schema field
+'''
+def _to_array(values, field):
+    if pa.types.is_boolean(field.type):
+        return pa.array([None if value is None else value == 'true' for value in values], pa.bool_())
+    if pa.types.is_dictionary(field.type):
+        return pa.array(values, pa.string()).dictionary_encode().cast(field.type)
+    return pa.array(values, pa.string())
+
+
+'''
+    open the sink for an output format, receives the format, path and header
+'''
+def open_sink(output_format: str, path: str, header: list):
+    return SINKS[output_format](path, header)
+
+
+'''
+    file extension of an output format, receives the format
+'''
+def sink_extension(output_format: str) -> str:
+    return SINKS[output_format].extension
+
+
+'''
+    concatenate Parquet files row group by row group into one file, receives the paths and merged path
+'''
+def merge_parquet_files(paths: list, merged_path: str, compression: str = PARQUET_COMPRESSION) -> str:
+    load_pyarrow()
+    writer = None
+    for path in paths:
+        parquet_file = pq.ParquetFile(path)
+        if writer is None:
+            schema = parquet_file.schema_arrow
+            use_dictionary = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+            writer = pq.ParquetWriter(merged_path, schema, compression=compression, use_dictionary=use_dictionary)
+        for index in range(parquet_file.num_row_groups):
+            writer.write_table(parquet_file.read_row_group(index))
+
+    if writer is not None:
+        writer.close()
+    logger.info("Merged %d parquet files into %s.", len(paths), merged_path)
+    return merged_path
@@ -0,0 +1,47 @@
+import unittest
+import json
+import os
+import tempfile
+import bench_main
+
+
+class TestBenchMain(unittest.TestCase):
+
+    def test_find_regressions(self):
+        baselines = {'main@10': {'seconds': 1.0}, 'transform_first_xml@10': {'seconds': 1.0}}
+        results = {'main@10': {'seconds': 1.3}, 'transform_first_xml@10': {'seconds': 1.2}, 'new@10': {'seconds': 9.0}}
+
+        self.assertEqual(bench_main.find_regressions(results, baselines, 0.25), [('main@10', 1.0, 1.3)])
+
+
+    def test_end_to_end_stand_ins(self):
+        self.assertGreater(bench_main.bench_end_to_end(200), 0)
+
+
+    def test_import_loads_no_heavy_module(self):
+        seconds, loaded = bench_main.bench_import('module.main', repeat=1)
+
+        self.assertGreater(seconds, 0)
+        self.assertEqual(loaded, [])
+
+
+    def test_cli_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            baseline_path = os.path.join(tmp_dir, 'baselines.json')
+            args = ['--only', 'transform_first_xml', '--records', '100', '--baseline', baseline_path]
+
+            self.assertEqual(bench_main.cli(args + ['--save-baseline']), 0)
+            # Timings this small are noisy, only a huge slowdown counts here
+            self.assertEqual(bench_main.cli(args + ['--threshold', '100']), 0)
+
+            with open(baseline_path) as baseline_file:
+                baselines = json.load(baseline_file)
+            baselines['transform_first_xml@100']['seconds'] = 1e-9
+            with open(baseline_path, 'w') as baseline_file:
+                json.dump(baselines, baseline_file)
+
+            self.assertEqual(bench_main.cli(args), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import module.cache as cache
+import os
+import tempfile
+from unittest.mock import patch
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def _put(self, checksum, size, mtime):
+        source_path = os.path.join(self.tmp_dir.name, checksum)
+        with open(source_path, 'wb') as source:
+            source.write(b'x' * size)
+        path = cache.cache_put(self.cache_dir, checksum, '.zip', source_path)
+        os.utime(path, (mtime, mtime))
+        return path
+
+
+    def test_cache_put_and_get(self):
+        path = self._put('ABC', 10, 1000)
+
+        self.assertEqual(path, os.path.join(self.cache_dir, 'abc.zip'))
+        self.assertEqual(cache.cache_get(self.cache_dir, 'ABC', '.zip'), path)
+        # A hit refreshes the LRU clock
+        self.assertGreater(os.path.getmtime(path), 1000)
+
+
+    def test_cache_get_miss(self):
+        self.assertIsNone(cache.cache_get(self.cache_dir, 'abc', '.zip'))
+        self.assertIsNone(cache.cache_get(self.cache_dir, None, '.zip'))
+
+
+    @patch('module.cache.logger', autospec=True)
+    def test_evict_cache(self, mock_logger):
+        oldest = self._put('a', 10, 1000)
+        middle = self._put('b', 10, 2000)
+        newest = self._put('c', 10, 3000)
+
+        # Using the oldest entry makes the middle one the least recently used
+        cache.cache_get(self.cache_dir, 'a', '.zip')
+        evicted = cache.evict_cache(self.cache_dir, max_bytes=20)
+
+        self.assertEqual(evicted, [middle])
+        self.assertTrue(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(newest))
+        mock_logger.info.assert_called_with("Evicted %d cache entries, %d bytes left.", 1, 20)
+
+
+    def test_evict_cache_under_limit(self):
+        self._put('a', 10, 1000)
+
+        self.assertEqual(cache.evict_cache(self.cache_dir, max_bytes=10), [])
+        self.assertEqual(cache.evict_cache(os.path.join(self.tmp_dir.name, 'missing')), [])
+
+
+    def test_evict_cache_folder_entries(self):
+        source_path = os.path.join(self.tmp_dir.name, 'parts')
+        os.makedirs(os.path.join(source_path, 'ntnl_ccy=EUR'))
+        with open(os.path.join(source_path, 'ntnl_ccy=EUR', 'part-00000.csv'), 'wb') as part:
+            part.write(b'x' * 30)
+        folder = cache.cache_put(self.cache_dir, 'a', '.d', source_path)
+        os.utime(folder, (1000, 1000))
+        newest = self._put('b', 10, 2000)
+
+        self.assertEqual(cache.path_size(folder), 30)
+        self.assertEqual(cache.evict_cache(self.cache_dir, max_bytes=20), [folder])
+        self.assertFalse(os.path.exists(folder))
+        self.assertTrue(os.path.exists(newest))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import argparse
+import io
+import module.cli as cli
+import module.main as main
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+
+class TestCli(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(cli.parse_size('512'), 512)
+        self.assertEqual(cli.parse_size('512M'), 512 * 1024 ** 2)
+        self.assertEqual(cli.parse_size('4g'), 4 * 1024 ** 3)
+        self.assertEqual(cli.parse_size('1.5GiB'), int(1.5 * 1024 ** 3))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.parse_size('lots')
+
+
+    @patch('module.cli.main.main')
+    def test_run_passes_arguments(self, mock_main):
+        status = cli.run(['--from-date', '2021-01-01T00:00:00Z', '--file-types', 'DLTINS', '--workers', '2',
+                          '--download-concurrency', '8', '--shard-workers', '3', '--output-format', 'parquet',
+                          '--sink', 's3://bucket/firds/', '--cache-dir', 'cache', '--cache-max-size', '512M', '--memory-budget', '2G',
+                          '--partition-by', 'ntnl_ccy', 'cfi', '--lookup-index', 'run.idx', '--log-level', 'WARNING'])
+
+        self.assertEqual(status, 0)
+        kwargs = mock_main.call_args.kwargs
+        self.assertEqual(kwargs['from_date'], '2021-01-01T00:00:00Z')
+        self.assertEqual(kwargs['to_date'], main.DEFAULT_TO_DATE)
+        self.assertEqual(kwargs['file_types'], ('DLTINS',))
+        self.assertEqual((kwargs['workers'], kwargs['download_concurrency'], kwargs['shard_workers']), (2, 8, 3))
+        self.assertEqual(kwargs['output_format'], 'parquet')
+        self.assertEqual(kwargs['sink'], 's3://bucket/firds/')
+        self.assertEqual(kwargs['cache_dir'], 'cache')
+        self.assertEqual(kwargs['memory_budget'], 2 * 1024 ** 3)
+        self.assertEqual(kwargs['cache_max_bytes'], 512 * 1024 ** 2)
+        self.assertEqual(kwargs['columns'], main.CSV_HEADER)
+        self.assertEqual(kwargs['partition_by'], ('ntnl_ccy', 'cfi'))
+        self.assertEqual(kwargs['lookup_path'], 'run.idx')
+
+
+    @patch('module.cli.main.main', return_value=False)
+    def test_run_fails_when_files_are_left_out(self, mock_main):
+        self.assertEqual(cli.run(['--log-level', 'WARNING']), 1)
+        mock_main.return_value = True
+        self.assertEqual(cli.run(['--log-level', 'WARNING']), 0)
+
+
+    def test_run_rejects_bad_arguments(self):
+        with redirect_stdout(io.StringIO()), patch('sys.stderr', io.StringIO()):
+            with self.assertRaises(SystemExit):
+                cli.run(['--workers', '0'])
+            with self.assertRaises(SystemExit):
+                cli.run(['--output-format', 'xlsx'])
+
+
+    @patch('module.cli.main.main')
+    @patch('module.cli.main.plan_run')
+    def test_dry_run(self, mock_plan_run, mock_main):
+        mock_plan_run.return_value = [
+            {'file_name': 'DLTINS_1.zip', 'file_type': 'DLTINS', 'publication_date': '2021-01-17 00:00:00+00:00',
+             'cached': True, 'zip_bytes': 1024 ** 2, 'estimated_xml_bytes': 15 * 1024 ** 2,
+             'estimated_records': 10485, 'estimated_csv_bytes': 1572750},
+            {'file_name': 'DLTINS_2.zip', 'file_type': 'DLTINS', 'publication_date': '2021-01-18 00:00:00+00:00',
+             'cached': False, 'zip_bytes': None, 'estimated_xml_bytes': None, 'estimated_records': None,
+             'estimated_csv_bytes': None},
+        ]
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = cli.run(['--dry-run', '--workers', '4', '--memory-budget', '512M', '--log-level', 'WARNING'])
+
+        self.assertEqual(status, 0)
+        mock_main.assert_not_called()
+        text = output.getvalue()
+        self.assertIn('DLTINS_1.zip', text)
+        self.assertIn('2 files, 0 B to download (1 cached), about 15.0 MiB of xml, 10,485 records', text)
+        self.assertIn('1 sizes unknown', text)
+        self.assertIn('Would run 2 parse workers', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
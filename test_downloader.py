@@ -0,0 +1,159 @@
+import unittest
+import module.downloader as downloader
+import hashlib
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+
+FILES = {
+    '/a.zip': b'a' * 3000 + b'b' * 3000,
+    '/b.zip': b'0123456789' * 500,
+    '/c.zip': b'c' * 10,
+}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Every request's Range header, shared with the tests
+    ranges = []
+
+    def do_GET(self):
+        body = FILES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        range_header = self.headers.get('Range')
+        RangeHandler.ranges.append((self.path, range_header))
+        if range_header:
+            start = int(range_header[len('bytes='):].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDownloader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+    def setUp(self):
+        RangeHandler.ranges = []
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.session = downloader.create_session()
+
+
+    def tearDown(self):
+        self.session.close()
+        self.tmp_dir.cleanup()
+
+
+    def test_download_file(self):
+        save_path = os.path.join(self.tmp_dir.name, 'a.zip')
+        checksum = hashlib.md5(FILES['/a.zip']).hexdigest()
+
+        result = downloader.download_file(self.session, self.base_url + '/a.zip', save_path, checksum)
+
+        self.assertEqual(result, save_path)
+        with open(save_path, 'rb') as file:
+            self.assertEqual(file.read(), FILES['/a.zip'])
+        self.assertFalse(os.path.exists(save_path + downloader.PART_SUFFIX))
+
+
+    def test_download_file_resumes_part(self):
+        save_path = os.path.join(self.tmp_dir.name, 'a.zip')
+        with open(save_path + downloader.PART_SUFFIX, 'wb') as part:
+            part.write(FILES['/a.zip'][:2500])
+
+        result = downloader.download_file(self.session, self.base_url + '/a.zip', save_path, hashlib.md5(FILES['/a.zip']).hexdigest())
+
+        self.assertEqual(result, save_path)
+        self.assertEqual(RangeHandler.ranges, [('/a.zip', 'bytes=2500-')])
+        with open(save_path, 'rb') as file:
+            self.assertEqual(file.read(), FILES['/a.zip'])
+
+
+    def test_download_file_complete_part(self):
+        save_path = os.path.join(self.tmp_dir.name, 'c.zip')
+        with open(save_path + downloader.PART_SUFFIX, 'wb') as part:
+            part.write(FILES['/c.zip'])
+
+        result = downloader.download_file(self.session, self.base_url + '/c.zip', save_path, hashlib.md5(FILES['/c.zip']).hexdigest())
+
+        self.assertEqual(result, save_path)
+
+
+    def test_download_file_skips_verified_file(self):
+        save_path = os.path.join(self.tmp_dir.name, 'b.zip')
+        with open(save_path, 'wb') as file:
+            file.write(FILES['/b.zip'])
+
+        result = downloader.download_file(self.session, self.base_url + '/b.zip', save_path, hashlib.md5(FILES['/b.zip']).hexdigest())
+
+        self.assertEqual(result, save_path)
+        self.assertEqual(RangeHandler.ranges, [])
+
+
+    @patch('module.downloader.logger', autospec=True)
+    def test_failed_checksum_download_file(self, mock_logger):
+        save_path = os.path.join(self.tmp_dir.name, 'b.zip')
+
+        result = downloader.download_file(self.session, self.base_url + '/b.zip', save_path, 'not-the-checksum')
+
+        self.assertIsNone(result)
+        self.assertFalse(os.path.exists(save_path))
+        self.assertFalse(os.path.exists(save_path + downloader.PART_SUFFIX))
+        mock_logger.error.assert_called_once_with("Checksum mismatch for %s.", 'b.zip')
+
+
+    @patch('module.downloader.logger', autospec=True)
+    def test_failed_download_file(self, mock_logger):
+        save_path = os.path.join(self.tmp_dir.name, 'missing.zip')
+
+        result = downloader.download_file(self.session, self.base_url + '/missing.zip', save_path)
+
+        self.assertIsNone(result)
+        mock_logger.error.assert_called_once_with("Failed to download the file. Status code: %d", 404)
+
+
+    def test_download_files(self):
+        items = [
+            {'download_link': self.base_url + '/a.zip', 'file_name': 'a.zip', 'checksum': hashlib.md5(FILES['/a.zip']).hexdigest()},
+            {'download_link': self.base_url + '/missing.zip', 'file_name': 'missing.zip'},
+            {'download_link': self.base_url + '/b.zip', 'file_name': 'b.zip'},
+        ]
+
+        results = downloader.download_files(items, self.tmp_dir.name, concurrency=2, session=self.session)
+
+        self.assertEqual(results, [os.path.join(self.tmp_dir.name, 'a.zip'), None, os.path.join(self.tmp_dir.name, 'b.zip')])
+        with open(results[2], 'rb') as file:
+            self.assertEqual(file.read(), FILES['/b.zip'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import tempfile
+import module.journal as journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.conn = journal.open_journal(os.path.join(self.tmp_dir.name, 'journal.sqlite'))
+
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+
+    def test_mark_stage_keeps_earlier_fields(self):
+        self.assertIsNone(journal.file_state(self.conn, 'c1', '.csv'))
+
+        journal.mark_stage(self.conn, 'c1', '.csv', journal.STAGE_DOWNLOADED, 'a.zip', zip_path='a.zip')
+        journal.mark_stage(self.conn, 'c1', '.csv', journal.STAGE_PARSING, output_path='a.csv', records=10,
+                           output_bytes=100)
+
+        state = journal.file_state(self.conn, 'c1', '.csv')
+        self.assertEqual((state['stage'], state['file_name'], state['zip_path'], state['output_path']),
+                         (journal.STAGE_PARSING, 'a.zip', 'a.zip', 'a.csv'))
+        self.assertEqual((state['records'], state['output_bytes']), (10, 100))
+        # Each output variant of a file has its own entry
+        self.assertIsNone(journal.file_state(self.conn, 'c1', '.parquet'))
+
+
+    def test_index_kept_until_run_finishes(self):
+        key = journal.run_key('2021-01-17', '2021-01-19', ('DLTINS',))
+        self.assertNotEqual(key, journal.run_key('2021-01-17', '2021-01-20', ('DLTINS',)))
+        self.assertIsNone(journal.load_index(self.conn, key))
+
+        journal.save_index(self.conn, key, [{'file_name': 'a.zip'}])
+        self.assertEqual(journal.load_index(self.conn, key), [{'file_name': 'a.zip'}])
+
+        journal.finish_run(self.conn, key)
+        self.assertIsNone(journal.load_index(self.conn, key))
+
+
+    def test_file_key(self):
+        self.assertEqual(journal.file_key({'checksum': 'c1', 'id': 'i1', 'file_name': 'a.zip'}), 'c1')
+        self.assertEqual(journal.file_key({'checksum': None, 'id': 'i1', 'file_name': 'a.zip'}), 'i1')
+        self.assertEqual(journal.file_key({'file_name': 'a.zip'}), 'a.zip')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import module.lookup as lookup
+import module.sinks as sinks
+from module.partitions import PartitionedSink
+import os
+import tempfile
+
+
+HEADER = [
+    'FinInstrmGnlAttrbts.Id',
+    'FinInstrmGnlAttrbts.FullNm',
+    'FinInstrmGnlAttrbts.CmmdtyDerivInd',
+    'FinInstrmGnlAttrbts.NtnlCcy',
+    'Issr'
+]
+
+ROWS = [
+    ('DE000A0D6554', 'Instrument A', 'false', 'EUR', '529900T8BM49AURSDO55'),
+    ('US0378331005', 'Instrument B', 'true', 'USD', '549300XQVU6T0QC5JH50'),
+    ('FR0000120271', 'Instrument C', None, 'EUR', '529900T8BM49AURSDO55'),
+    ('CH0012005267', 'Instrument Ü', 'false', 'CHF', None),
+]
+
+
+class TestLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'lookup.idx')
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_lookup_by_isin_and_issuer(self):
+        # A later row of an ISIN replaces the earlier one
+        rows = ROWS + [('US0378331005', 'Instrument B2', 'false', 'USD', '549300XQVU6T0QC5JH50'), (None, 'No id')]
+        self.assertEqual(lookup.build_lookup_index(rows, HEADER, self.path), 4)
+
+        with lookup.LookupIndex(self.path) as index:
+            self.assertEqual(len(index), 4)
+            self.assertEqual(index.columns, HEADER)
+            self.assertEqual(index.get('FR0000120271'), dict(zip(HEADER, ROWS[2])))
+            self.assertEqual(index.get('CH0012005267')['FinInstrmGnlAttrbts.FullNm'], 'Instrument Ü')
+            self.assertEqual(index.get('US0378331005')['FinInstrmGnlAttrbts.FullNm'], 'Instrument B2')
+            self.assertIsNone(index.get('XS0000000000'))
+            self.assertIsNone(index.get('DE000A0D6554TOOLONG'))
+            self.assertIn('DE000A0D6554', index)
+            self.assertNotIn('DE000A0D655', index)
+
+            issued = index.by_issuer('529900T8BM49AURSDO55')
+            self.assertEqual([row['FinInstrmGnlAttrbts.Id'] for row in issued], ['DE000A0D6554', 'FR0000120271'])
+            self.assertEqual(index.by_issuer('549300XQVU6T0QC5JH50')[0]['FinInstrmGnlAttrbts.NtnlCcy'], 'USD')
+            self.assertEqual(index.by_issuer('UNKNOWN'), [])
+
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as other:
+            other.write(b'ID,Name\n' * 10)
+
+        with self.assertRaises(ValueError):
+            lookup.LookupIndex(self.path)
+
+
+    def test_build_from_csv_and_partitioned_outputs(self):
+        csv_path = os.path.join(self.tmp_dir.name, 'DLTINS_1.csv')
+        with sinks.open_sink('csv', csv_path, HEADER) as sink:
+            sink.write_many(ROWS[:2])
+        partitioned_path = os.path.join(self.tmp_dir.name, 'DLTINS_2.csv.d')
+        with PartitionedSink(partitioned_path, HEADER, ('ntnl_ccy',), 'csv') as sink:
+            sink.write_many(ROWS[1:])
+
+        self.assertEqual(lookup.build_lookup_from_outputs([csv_path, partitioned_path], self.path), 4)
+        with lookup.open_lookup_index(self.path) as index:
+            self.assertEqual(index.get('CH0012005267')['FinInstrmGnlAttrbts.NtnlCcy'], 'CHF')
+            # Csv outputs do not tell empty values from missing ones
+            self.assertIsNone(index.get('FR0000120271')['FinInstrmGnlAttrbts.CmmdtyDerivInd'])
+
+
+    @unittest.skipIf(not sinks.load_pyarrow(), "pyarrow is not installed")
+    def test_build_from_parquet_output(self):
+        parquet_path = os.path.join(self.tmp_dir.name, 'DLTINS_1.parquet')
+        with sinks.open_sink('parquet', parquet_path, HEADER) as sink:
+            sink.write_many(ROWS)
+
+        lookup.build_lookup_from_outputs([parquet_path], self.path)
+        with lookup.LookupIndex(self.path) as index:
+            # Booleans read back from Parquet are written as in the xml
+            self.assertEqual(index.get('US0378331005')['FinInstrmGnlAttrbts.CmmdtyDerivInd'], 'true')
+            self.assertEqual(index.get('DE000A0D6554'), dict(zip(HEADER, ROWS[0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
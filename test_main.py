@@ -1,48 +1,49 @@
 import unittest
+import io
+import json
+import multiprocessing
 import module.main as main
+import module.metrics as metrics
+import module.sinks as sinks
+from module.partitions import partition_columns, read_manifest
+from module.lookup import LookupIndex
 import os
 import zipfile
 import tempfile
+import shutil
 import pandas as pd
+import xmltodict
+import boto3
+from moto import mock_aws
 from unittest.mock import patch, MagicMock, mock_open
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 class TestMain(unittest.TestCase):
 
     @patch('module.main.logger', autospec=True)
-    @patch("module.main.requests.get")
-    def test_failed_download_xml_file(self, mock_get, mock_logger):
-        mock_response = MagicMock()
-        mock_response.status_code = 404
-        mock_get.return_value = mock_response
+    @patch('module.main.get_session')
+    @patch('module.main.download_file')
+    def test_failed_download_xml_file(self, mock_download, mock_get_session, mock_logger):
+        mock_download.return_value = None
         result = main.download_xml_file(main.XML_URL)
 
-        self.assertEqual(mock_response.status_code, 404)
         self.assertEqual(result, None)
-        mock_get.assert_called_once_with(main.XML_URL)
+        mock_download.assert_called_once_with(mock_get_session.return_value, main.XML_URL, main.XML_LOCAL_NAME)
+        mock_logger.error.assert_called_once_with("Error while downloading %s", main.XML_URL)
 
 
-    @patch('module.main.requests.get', side_effect=Exception("Mocked exception"))
-    def test_exception_download_xml_file(self, mock_get):
-        result = main.download_xml_file(main.XML_URL)
-
-        self.assertIsNone(result)
-        mock_get.assert_called_once_with(main.XML_URL)
-
-
-    @patch("module.main.requests.get")
-    def test_successful_download_xml_file(self, mock_get):
-        xml_content = b"<xml>content</xml>"
-
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.content = xml_content
-        mock_get.return_value = mock_response
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.get_session')
+    @patch('module.main.download_file')
+    def test_successful_download_xml_file(self, mock_download, mock_get_session, mock_logger):
+        mock_download.return_value = main.XML_LOCAL_NAME
 
-        response = main.download_xml_file(main.XML_URL)
+        result = main.download_xml_file(main.XML_URL)
 
-        self.assertEqual(response, xml_content)
-        self.assertEqual(mock_response.status_code, 200)
-        mock_get.assert_called_once_with(main.XML_URL)
+        self.assertEqual(result, main.XML_LOCAL_NAME)
+        mock_download.assert_called_once_with(mock_get_session.return_value, main.XML_URL, main.XML_LOCAL_NAME)
+        mock_logger.info.assert_called_once_with("XML file downloaded successfully.")
 
 
     @patch('builtins.open', side_effect=Exception("Mocked exception"))
@@ -51,21 +52,20 @@ class TestMain(unittest.TestCase):
         result = main.read_xml_file(xml_path)
         
         self.assertIsNone(result)
-        mock_open.assert_called_once_with(xml_path, 'r', encoding='utf-8')
+        mock_open.assert_called_once_with(xml_path, 'rb')
 
 
-    @patch('builtins.open', new_callable=mock_open, read_data='<root><item>value</item></root>')
-    @patch('xmltodict.parse')
-    def test_successful_read_xml_file(self, mock_xmltodict_parse, mock_open):
+    def test_successful_read_xml_file(self):
         expected_result = {'root': {'item': 'value'}}
-        
-        mock_xmltodict_parse.return_value = expected_result
-        
-        result = main.read_xml_file(main.XML_LOCAL_NAME)
-        
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_path = os.path.join(tmp_dir, main.XML_LOCAL_NAME)
+            with open(xml_path, 'wb') as xml_file:
+                xml_file.write(b'<root><item>value</item></root>')
+
+            result = main.read_xml_file(xml_path)
+
         self.assertEqual(result, expected_result)
-        mock_open.assert_called_once_with(main.XML_LOCAL_NAME, 'r', encoding='utf-8')
-        mock_xmltodict_parse.assert_called_once()
 
 
     def test_sucessful_transform_xml_to_csv(self):
@@ -92,18 +92,16 @@ class TestMain(unittest.TestCase):
                 }
             }
             
-            expected_df = pd.DataFrame([
-                {
-                    'checksum': 'checksum_value',
-                    'download_link': 'download_link_value',
-                    'publication_date': '2023-08-16',
-                    'id': 'id_value',
-                    'published_instrument_file_id': 'file_id_value',
-                    'file_name': 'file_name_value',
-                    'file_type': 'file_type_value',
-                    'timestamp': '2023-08-16T12:00:00'
-                }
-            ])
+            expected_df = pd.DataFrame({
+                'checksum': ['checksum_value'],
+                'download_link': ['download_link_value'],
+                'publication_date': pd.to_datetime(['2023-08-16'], utc=True),
+                'id': ['id_value'],
+                'published_instrument_file_id': ['file_id_value'],
+                'file_name': ['file_name_value'],
+                'file_type': pd.Categorical(['file_type_value']),
+                'timestamp': pd.to_datetime(['2023-08-16T12:00:00'], utc=True)
+            })
 
             with patch('module.main.logger') as mock_logger:
                 result_df = main.transform_first_xml(input_xml_dict)
@@ -112,6 +110,64 @@ class TestMain(unittest.TestCase):
                 mock_logger.info.assert_called_once_with("First xml tranformed to a DataFrame.")
 
 
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.get_session')
+    def test_iter_index_pages(self, mock_get_session, mock_logger):
+        def index_page(params, **kwargs):
+            start = params['start']
+            docs = ''.join(
+                '<doc><str name="file_name">file_%d.zip</str></doc>' % number
+                for number in range(start, min(start + params['rows'], 5))
+            )
+            response = MagicMock()
+            response.content = ('<response><result name="response" numFound="5" start="%d">%s</result></response>' % (start, docs)).encode()
+            return response
+
+        mock_get_session.return_value.get.side_effect = lambda url, params, timeout: index_page(params)
+
+        pages = list(main.iter_index_pages('2021-01-17', '2021-03-31', page_size=2, concurrency=2))
+
+        self.assertEqual([page['response']['result']['@start'] for page in pages], ['0', '2', '4'])
+        file_names = [doc['str']['#text'] for doc in main._iter_index_docs(pages)]
+        self.assertEqual(file_names, ['file_%d.zip' % number for number in range(5)])
+
+        params = mock_get_session.return_value.get.call_args_list[0][1]['params']
+        self.assertEqual(params['fq'], 'publication_date:[2021-01-17T00:00:00Z TO 2021-03-31T23:59:59Z]')
+        # Every page is cut from the same total order, so concurrent pages neither overlap nor miss files
+        self.assertEqual({call[1]['params']['sort'] for call in mock_get_session.return_value.get.call_args_list},
+                         {'timestamp asc, id asc'})
+        mock_logger.info.assert_called_once_with("Index has %d files between %s and %s.", 5, '2021-01-17', '2021-03-31')
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_transform_first_xml_from_pages(self, mock_logger):
+        def page(number):
+            return {'response': {'result': {'doc': {
+                'str': [
+                    {'@name': 'checksum', '#text': 'checksum_%d' % number},
+                    {'@name': 'download_link', '#text': 'link_%d' % number},
+                    {'@name': 'id', '#text': 'id_%d' % number},
+                    {'@name': 'published_instrument_file_id', '#text': 'file_id_%d' % number},
+                    {'@name': 'file_name', '#text': 'file_%d.zip' % number},
+                    {'@name': 'file_type', '#text': 'DLTINS'}
+                ],
+                'date': [
+                    {'@name': 'publication_date', '#text': '2023-08-16'},
+                    {'@name': 'timestamp', '#text': '2023-08-16T12:00:00'}
+                ]
+            }}}}
+
+        result_df = main.transform_first_xml(page(number) for number in range(3))
+
+        self.assertEqual(list(result_df['file_name']), ['file_0.zip', 'file_1.zip', 'file_2.zip'])
+
+        # The pandas-free rows hold the same values as the DataFrame
+        rows = main.index_rows(page(number) for number in range(3))
+        self.assertEqual(rows, result_df.to_dict('records'))
+        self.assertEqual(rows[0]['publication_date'], datetime(2023, 8, 16, tzinfo=timezone.utc))
+        self.assertEqual([row['file_name'] for row in main._file_rows(rows)], ['file_0.zip', 'file_1.zip', 'file_2.zip'])
+
+
     def test_failed_transform_xml_to_csv(self):
         input_xml_dict = {
             'response': {
@@ -128,29 +184,10 @@ class TestMain(unittest.TestCase):
             mock_logger.error.assert_called_once_with("Error transforming dictionary into DataFrame.")
 
 
+    @mock_aws
+    @patch('module.s3_upload._s3_client', None)
     @patch('module.main.logger', autospec=True)
-    @patch('os.listdir')
-    def test_get_dltins_filename(self, mock_listdir, mock_logger):
-        mock_listdir.return_value = ["DLTINS_2023-08-15.xml", "other_file.txt", "DLTINS_2023-08-16.xml"]
-        filename = main.get_dltins_filename()
-        
-        self.assertEqual(filename, "DLTINS_2023-08-15.xml")
-        mock_logger.info.assert_called_once_with("Filename found: %s.", "DLTINS_2023-08-15.xml")
-
-
-    @patch('module.main.logger', autospec=True)
-    @patch('os.listdir')
-    def test_failed_get_dltins_filename(self, mock_listdir, mock_logger):
-        mock_listdir.return_value = ["other_file.txt", "example.csv"]
-        filename = main.get_dltins_filename()
-        
-        self.assertEqual(filename, None)
-        mock_logger.error.assert_called_once_with("Could not find file.")
-
-
-    @patch('module.main.boto3.client')
-    @patch('module.main.logger', autospec=True)
-    def test_transform_xml_to_csv(self, mock_logger, mock_boto3_client):
+    def test_transform_xml_to_csv(self, mock_logger):
         sample_xml_dict = {
             'BizData': {
                 'Pyld': {
@@ -176,64 +213,108 @@ class TestMain(unittest.TestCase):
             }
         }
 
-        mock_s3_client = MagicMock()
-        mock_boto3_client.return_value = mock_s3_client
-        
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket="joao-silva-csv-bucket")
+
         main.transform_xml_to_csv(sample_xml_dict)
-        
+
         mock_logger.info.assert_called_once_with("Transformed xml into csv.")
-        
-        # Assert that the S3 client and its put_object method were called
-        mock_s3_client.put_object.assert_called_once()
-        expected_bucket_name = "joao-silva-csv-bucket"
-        expected_csv_file_name = "output.csv"
-        mock_s3_client.put_object.assert_called_with(
-            Bucket=expected_bucket_name,
-            Key=expected_csv_file_name,
-            Body=mock_s3_client.put_object.call_args[1]['Body']
-        )
+
+        # The csv was sent as a multipart upload to the configured bucket and key
+        body = s3_client.get_object(Bucket="joao-silva-csv-bucket", Key="output.csv")['Body'].read()
+        # Issr sits at the wrong level in this record, so it is left blank rather than dropping the row
+        self.assertEqual(body.decode('utf-8'), ','.join(main.CSV_HEADER) + '\r\nID123,Instrument A,Type A,No,USD,,TermntdRcrd\r\n')
+        self.assertIs(main.get_s3_client(), main.get_s3_client())
 
 
-    @patch('module.main.extract_xml_from_zip')
+    @mock_aws
+    @patch('module.s3_upload._s3_client', None)
     @patch('module.main.logger', autospec=True)
-    @patch('module.main.requests.get')
-    def test_successful_download_zip(self, mock_get, mock_logger, mock_extract_xml):
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.content = b'zip_content'
-        mock_get.return_value = mock_response
-        
+    def test_iter_fin_instrm_matches_xmltodict(self, mock_logger):
+        xml_content = (
+            '<BizData xmlns="urn:iso:std:iso:20022:tech:xsd:head.003.001.01"><Pyld>'
+            '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:auth.036.001.02"><FinInstrmRptgRefDataDltaRpt>'
+            '<FinInstrm><TermntdRcrd><FinInstrmGnlAttrbts><Id>ID1</Id><FullNm>Instrument, "A"</FullNm>'
+            '<ClssfctnTp>Type A</ClssfctnTp><CmmdtyDerivInd>false</CmmdtyDerivInd><NtnlCcy>EUR</NtnlCcy>'
+            '</FinInstrmGnlAttrbts><Issr>ISSUER1</Issr></TermntdRcrd></FinInstrm>'
+            '<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID2</Id></FinInstrmGnlAttrbts></NewRcrd></FinInstrm>'
+            '<FinInstrm><TermntdRcrd><FinInstrmGnlAttrbts><Id>ID3</Id><FullNm>Instrument B</FullNm>'
+            '<ClssfctnTp>Type B</ClssfctnTp><CmmdtyDerivInd>true</CmmdtyDerivInd><NtnlCcy>USD</NtnlCcy>'
+            '</FinInstrmGnlAttrbts><Issr>ISSUER2</Issr></TermntdRcrd></FinInstrm>'
+            '</FinInstrmRptgRefDataDltaRpt></Document></Pyld></BizData>'
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_path = os.path.join(tmp_dir, 'DLTINS_test.xml')
+            with open(xml_path, 'w', encoding='utf-8') as xml_file:
+                xml_file.write(xml_content)
+
+            records = list(main.iter_fin_instrm(xml_path))
+            expected = xmltodict.parse(xml_content)['BizData']['Pyld']['Document']['FinInstrmRptgRefDataDltaRpt']['FinInstrm']
+            self.assertEqual(records, expected)
+
+            s3_client = boto3.client('s3', region_name='us-east-1')
+            s3_client.create_bucket(Bucket=main.s3_bucket_name)
+
+            main.transform_xml_to_csv(xmltodict.parse(xml_content))
+            dict_body = s3_client.get_object(Bucket=main.s3_bucket_name, Key=main.csv_file_name)['Body'].read()
+            main.transform_xml_to_csv(main.iter_fin_instrm(xml_path))
+            stream_body = s3_client.get_object(Bucket=main.s3_bucket_name, Key=main.csv_file_name)['Body'].read()
+
+            self.assertEqual(stream_body, dict_body)
+            self.assertEqual(stream_body.count(b'\r\n'), 4)
+            self.assertIn(b'\r\nID2,,,,,,NewRcrd\r\n', stream_body)
+
+
+    def test_iter_instrument_rows(self):
+        def instrm(record_type, id_):
+            return {record_type: {'FinInstrmGnlAttrbts': {'Id': id_, 'NtnlCcy': 'EUR'}, 'Issr': 'LEI' + id_}}
+
+        instruments = [
+            instrm('NewRcrd', 'ID1'),
+            instrm('ModfdRcrd', 'ID2'),
+            instrm('TermntdRcrd', 'ID3'),
+            instrm('CancRcrd', 'ID4'),
+            instrm('UnknownRcrd', 'ID5'),
+        ]
+
+        rows = list(main.iter_instrument_rows(instruments))
+
+        self.assertEqual([(row[0], row[-1]) for row in rows], [
+            ('ID1', 'NewRcrd'), ('ID2', 'ModfdRcrd'), ('ID3', 'TermntdRcrd'), ('ID4', 'CancRcrd'),
+        ])
+        self.assertEqual(rows[0], ('ID1', None, None, None, 'EUR', 'LEIID1', 'NewRcrd'))
+
+
+    @patch('module.main.os.makedirs')
+    @patch('module.main.get_session')
+    @patch('module.main.download_file')
+    def test_successful_download_zip(self, mock_download, mock_get_session, mock_makedirs):
+        expected_path = os.path.join(main.CACHE_DIR, 'abc.zip')
+        mock_download.return_value = expected_path
+
         # Create a sample DataFrame
         sample_df = pd.DataFrame([
-            {'file_type': 'DLTINS', 'download_link': 'https://example.com/file.zip', 'file_name': 'test.zip'}
+            {'file_type': 'DLTINS', 'download_link': 'https://example.com/file.zip', 'file_name': 'test.zip', 'checksum': 'abc'}
         ])
-        
+
         result = main.download_zip(sample_df)
-        
-        mock_logger.info.assert_called_once_with("%s downloaded successfully.", "test.zip")
-        mock_logger.error.assert_not_called()
-        
-        mock_extract_xml.assert_called_once_with(os.path.join(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'module'), 'test.zip'))
-        
-        self.assertEqual(result, b'zip_content')
-        
 
-    @patch('module.main.logger', autospec=True)
-    @patch('module.main.requests.get')
-    def test_failed_download_zip(self, mock_get, mock_logger):
-        mock_response = MagicMock()
-        mock_response.status_code = 404
-        mock_get.return_value = mock_response
-        
+        mock_download.assert_called_once_with(mock_get_session.return_value, 'https://example.com/file.zip', expected_path, 'abc')
+        self.assertEqual(result, expected_path)
+
+
+    @patch('module.main.get_session')
+    @patch('module.main.download_file')
+    def test_failed_download_zip(self, mock_download, mock_get_session):
+        mock_download.return_value = None
+
         # Create a sample DataFrame
         sample_df = pd.DataFrame([
             {'file_type': 'DLTINS', 'download_link': 'https://example.com/file.zip', 'file_name': 'test.zip'}
         ])
-        
+
         result = main.download_zip(sample_df)
-        
-        mock_logger.error.assert_called_once_with("Failed to download the file. Status code: %d", 404)
-        mock_logger.info.assert_not_called()
 
         self.assertIsNone(result)
 
@@ -301,35 +382,632 @@ class TestMain(unittest.TestCase):
     
     
     @patch('module.main.logger', autospec=True)
-    def test_extract_xml_from_zip_no_xml(self, mock_logger):
-        # Create a temporary directory for testing
+    def test_open_xml_from_zip_no_xml(self, mock_logger):
         with tempfile.TemporaryDirectory() as tmp_dir:
             # Create a mock zip file without an XML file
             test_zip_path = os.path.join(tmp_dir, 'test.zip')
             with zipfile.ZipFile(test_zip_path, 'w') as test_zip:
                 test_zip.writestr('text_file.txt', 'some text content')
 
-            main.extract_xml_from_zip(test_zip_path)
+            result = main.open_xml_from_zip(test_zip_path)
 
+            self.assertIsNone(result)
             mock_logger.info.assert_not_called()
-            mock_logger.error.assert_called_once()
+            mock_logger.error.assert_called_once_with("No XML file found in the zip.")
 
 
     @patch('module.main.logger', autospec=True)
-    def test_extract_xml_from_zip_success(self, mock_logger):
-        # Create a temporary directory for testing
+    def test_open_xml_from_zip_success(self, mock_logger):
         with tempfile.TemporaryDirectory() as tmp_dir:
             # Create a mock zip file with an XML file
             test_zip_path = os.path.join(tmp_dir, 'test.zip')
-            with zipfile.ZipFile(test_zip_path, 'w') as test_zip:
-                test_zip.writestr('test.xml', '<xml>test content</xml>')
+            with zipfile.ZipFile(test_zip_path, 'w', zipfile.ZIP_DEFLATED) as test_zip:
+                test_zip.writestr('DLTINS_test.xml', '<xml>test content</xml>')
 
-            main.extract_xml_from_zip(test_zip_path)
+            with main.open_xml_from_zip(test_zip_path) as xml_stream:
+                self.assertEqual(xml_stream.read(), b'<xml>test content</xml>')
 
-            mock_logger.info.assert_called_once()
+            # Nothing is extracted next to the archive or the module
+            self.assertEqual(os.listdir(tmp_dir), ['test.zip'])
+            self.assertFalse(os.path.exists(os.path.join(os.path.dirname(main.__file__), 'DLTINS_test.xml')))
+            mock_logger.info.assert_called_once_with("XML member found: %s", 'DLTINS_test.xml')
             mock_logger.error.assert_not_called()
 
 
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.download_zip_file')
+    def test_process_zip_file(self, mock_download, mock_logger):
+        xml_content = (
+            '<BizData><Pyld><Document><FinInstrmRptgRefDataDltaRpt>'
+            '<FinInstrm><TermntdRcrd><FinInstrmGnlAttrbts><Id>ID1</Id><FullNm>A</FullNm><ClssfctnTp>T</ClssfctnTp>'
+            '<CmmdtyDerivInd>false</CmmdtyDerivInd><NtnlCcy>EUR</NtnlCcy></FinInstrmGnlAttrbts><Issr>I1</Issr>'
+            '</TermntdRcrd></FinInstrm>'
+            '</FinInstrmRptgRefDataDltaRpt></Document></Pyld></BizData>'
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_zip_path = os.path.join(tmp_dir, 'DLTINS_test.zip')
+            with zipfile.ZipFile(test_zip_path, 'w') as test_zip:
+                test_zip.writestr('DLTINS_test.xml', xml_content)
+            mock_download.return_value = test_zip_path
+
+            row = {'file_name': 'DLTINS_test.zip', 'download_link': 'https://example.com/DLTINS_test.zip'}
+            result = main.process_zip_file(row, tmp_dir, tmp_dir)
+
+            mock_download.assert_called_once_with('https://example.com/DLTINS_test.zip', 'DLTINS_test.zip', None, tmp_dir)
+            self.assertEqual(result['file_name'], 'DLTINS_test.zip')
+            self.assertEqual(result['output_path'], os.path.join(tmp_dir, 'DLTINS_test.csv'))
+            with open(result['output_path'], newline='', encoding='utf-8') as csv_file:
+                self.assertEqual(csv_file.read().splitlines()[1], 'ID1,A,T,false,EUR,I1,TermntdRcrd')
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_process_zip_file_fulins(self, mock_logger):
+        # FULINS records are RefData elements holding the record fields, without a FinInstrm around them
+        xml_content = (
+            '<BizData><Pyld><Document xmlns="urn:iso:std:iso:20022:tech:xsd:auth.017.001.02"><FinInstrmRptgRefDataRpt>'
+            '<RptHdr><RptgNtty><NCA>DE</NCA></RptgNtty></RptHdr>'
+            '<RefData><FinInstrmGnlAttrbts><Id>ID1</Id><FullNm>A</FullNm><ClssfctnTp>ESVUFR</ClssfctnTp>'
+            '<CmmdtyDerivInd>false</CmmdtyDerivInd><NtnlCcy>EUR</NtnlCcy></FinInstrmGnlAttrbts><Issr>I1</Issr>'
+            '<TradgVnRltdAttrbts><Id>XETR</Id></TradgVnRltdAttrbts></RefData>'
+            '<RefData><FinInstrmGnlAttrbts><Id>ID2</Id><NtnlCcy>USD</NtnlCcy></FinInstrmGnlAttrbts></RefData>'
+            '</FinInstrmRptgRefDataRpt></Document></Pyld></BizData>'
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, 'FULINS_E_20210116_1of1.zip')
+            with zipfile.ZipFile(zip_path, 'w') as test_zip:
+                test_zip.writestr('FULINS_E_20210116_1of1.xml', xml_content)
+
+            row = {'file_name': 'FULINS_E_20210116_1of1.zip', 'zip_path': zip_path}
+            result = main.process_zip_file(row, tmp_dir, tmp_dir)
+            with open(result['output_path'], newline='', encoding='utf-8') as csv_file:
+                lines = csv_file.read().splitlines()
+
+            with main.open_xml_from_zip(zip_path) as xml_stream:
+                records = list(main.iter_fin_instrm(xml_stream))
+
+        self.assertEqual(lines[1:], ['ID1,A,ESVUFR,false,EUR,I1,RefData', 'ID2,,,,USD,,RefData'])
+        self.assertEqual(records[1], {'RefData': {'FinInstrmGnlAttrbts': {'Id': 'ID2', 'NtnlCcy': 'USD'}}})
+        self.assertEqual(list(main.iter_instrument_rows(records)), [
+            ('ID1', 'A', 'ESVUFR', 'false', 'EUR', 'I1', 'RefData'),
+            ('ID2', None, None, None, 'USD', None, 'RefData'),
+        ])
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_write_xml_output_checkpointed_resumes(self, mock_logger):
+        records = ''.join('<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID%d</Id></FinInstrmGnlAttrbts>'
+                          '</NewRcrd></FinInstrm>' % number for number in range(5))
+        xml_content = ('<BizData><Pyld><Document><FinInstrmRptgRefDataDltaRpt>%s'
+                       '</FinInstrmRptgRefDataDltaRpt></Document></Pyld></BizData>' % records).encode()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_path = main.write_xml_output(io.BytesIO(xml_content), os.path.join(tmp_dir, 'expected.csv'))
+            with open(expected_path, 'rb') as expected:
+                expected_csv = expected.read()
+            xml_path = os.path.join(tmp_dir, 'input.xml')
+            with open(xml_path, 'wb') as xml_file:
+                xml_file.write(xml_content)
+            output_path = os.path.join(tmp_dir, 'output.csv')
+
+            # The run dies at its second checkpoint, after rows past the first one were written
+            checkpoints = []
+            def crash(*checkpoint):
+                checkpoints.append(checkpoint)
+                if len(checkpoints) == 2:
+                    raise KeyboardInterrupt()
+            with self.assertRaises(KeyboardInterrupt):
+                main.write_xml_output_checkpointed(io.BytesIO(xml_content), output_path, checkpoint=crash,
+                                                   checkpoint_records=2)
+
+            records_done, output_bytes, xml_offset = checkpoints[0]
+            self.assertEqual(records_done, 2)
+            self.assertEqual(xml_offset, xml_content.index(b'<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID2'))
+            self.assertGreater(os.path.getsize(output_path), output_bytes)
+            partial_path = os.path.join(tmp_dir, 'partial.csv')
+            shutil.copyfile(output_path, partial_path)
+
+            # From the xml offset of a stream, of a mapped file, and by skipping records when there is no offset
+            for source, offset in [(io.BytesIO(xml_content), xml_offset), (xml_path, xml_offset),
+                                   (io.BytesIO(xml_content), None)]:
+                shutil.copyfile(partial_path, output_path)
+                main.write_xml_output_checkpointed(source, output_path, records=records_done, output_bytes=output_bytes,
+                                                   xml_offset=offset, checkpoint_records=2)
+                with open(output_path, 'rb') as output:
+                    self.assertEqual(output.read(), expected_csv)
+            mock_logger.info.assert_any_call("Resuming %s after %d records.", 'output.csv', 2)
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_write_xml_output_checkpointed_resumes_after_empty_record(self, mock_logger):
+        records = ['<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID%d</Id></FinInstrmGnlAttrbts></NewRcrd></FinInstrm>'
+                   % number for number in range(6)]
+        # An empty record counts as a record for the parser and for the offsets alike
+        records[1] = '<FinInstrm/>'
+        xml_content = ('<Document><FinInstrmRptgRefDataDltaRpt>%s</FinInstrmRptgRefDataDltaRpt></Document>'
+                       % ''.join(records)).encode()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_path = main.write_xml_output(io.BytesIO(xml_content), os.path.join(tmp_dir, 'expected.csv'))
+            with open(expected_path, 'rb') as expected:
+                expected_csv = expected.read()
+            output_path = os.path.join(tmp_dir, 'output.csv')
+
+            checkpoints = []
+            def crash(*checkpoint):
+                checkpoints.append(checkpoint)
+                if len(checkpoints) == 2:
+                    raise KeyboardInterrupt()
+            with self.assertRaises(KeyboardInterrupt):
+                main.write_xml_output_checkpointed(io.BytesIO(xml_content), output_path, checkpoint=crash,
+                                                   checkpoint_records=2)
+
+            records_done, output_bytes, xml_offset = checkpoints[0]
+            self.assertEqual(xml_offset, xml_content.index(records[2].encode()))
+            main.write_xml_output_checkpointed(io.BytesIO(xml_content), output_path, records=records_done,
+                                               output_bytes=output_bytes, xml_offset=xml_offset, checkpoint_records=2)
+            with open(output_path, 'rb') as output:
+                self.assertEqual(output.read(), expected_csv)
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.download_zip_file')
+    @patch('module.main.logger', autospec=True)
+    def test_process_all_files_resumes_from_journal(self, mock_logger, mock_download):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, 'DLTINS_1.zip')
+            with zipfile.ZipFile(zip_path, 'w') as test_zip:
+                test_zip.writestr('DLTINS_1.xml', '<BizData><FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID1</Id>'
+                                  '</FinInstrmGnlAttrbts></NewRcrd></FinInstrm></BizData>')
+            mock_download.return_value = zip_path
+            rows = [{'file_type': 'DLTINS', 'download_link': 'link1', 'file_name': 'DLTINS_1.zip', 'id': 'i1',
+                     'checksum': None}]
+            journal_path = os.path.join(tmp_dir, 'journal.sqlite')
+            output_dir = os.path.join(tmp_dir, 'output')
+
+            first = main.process_all_files(rows, output_dir=output_dir, cache_dir=tmp_dir, journal_path=journal_path)
+            with patch('module.main.process_zip_file') as mock_process:
+                second = main.process_all_files(rows, output_dir=output_dir, cache_dir=tmp_dir,
+                                                journal_path=journal_path)
+
+            # Files without a checksum are not cached, the journal alone skips them on a restart
+            mock_process.assert_not_called()
+            self.assertEqual(mock_download.call_count, 1)
+            self.assertEqual(second[0]['output_path'], first[0]['output_path'])
+
+
+    @patch('module.main.iter_index_pages')
+    @patch('module.main.logger', autospec=True)
+    def test_load_run_index_from_journal(self, mock_logger, mock_iter_index_pages):
+        mock_iter_index_pages.return_value = [{'response': {'result': {'doc': {
+            'str': [{'@name': 'file_name', '#text': 'DLTINS_1.zip'}, {'@name': 'file_type', '#text': 'DLTINS'}],
+            'date': [{'@name': 'publication_date', '#text': '2021-01-17T00:00:00Z'}]}}}}]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            journal_path = os.path.join(tmp_dir, 'journal.sqlite')
+            fetched = main.load_run_index('2021-01-17', '2021-01-19', journal_path=journal_path, key='run')
+            resumed = main.load_run_index('2021-01-17', '2021-01-19', journal_path=journal_path, key='run')
+
+        self.assertEqual(mock_iter_index_pages.call_count, 1)
+        self.assertEqual(resumed, fetched)
+        self.assertEqual(resumed[0]['publication_date'], datetime(2021, 1, 17, tzinfo=timezone.utc))
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.SHARD_MIN_BYTES', 0)
+    @patch('module.main.logger', autospec=True)
+    def test_process_zip_file_sharded(self, mock_logger):
+        records = ''.join(
+            '<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID%d</Id><FullNm>A</FullNm><NtnlCcy>EUR</NtnlCcy>'
+            '</FinInstrmGnlAttrbts><Issr>I%d</Issr></NewRcrd></FinInstrm>\n' % (number, number) for number in range(50)
+        )
+        xml_content = ('<?xml version="1.0" encoding="UTF-8"?><BizData xmlns="urn:iso:std:iso:20022:tech:xsd:head.003.001.01">'
+                       '<Pyld><Document xmlns="urn:iso:std:iso:20022:tech:xsd:auth.036.001.02"><FinInstrmRptgRefDataDltaRpt>'
+                       + records + '</FinInstrmRptgRefDataDltaRpt></Document></Pyld></BizData>')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_zip_path = os.path.join(tmp_dir, 'FULINS_test.zip')
+            with zipfile.ZipFile(test_zip_path, 'w') as test_zip:
+                test_zip.writestr('FULINS_test.xml', xml_content)
+
+            row = {'file_name': 'FULINS_test.zip', 'zip_path': test_zip_path}
+            result = main.process_zip_file(row, tmp_dir, tmp_dir, shard_workers=4)
+
+            with open(result['output_path'], newline='', encoding='utf-8') as csv_file:
+                lines = csv_file.read().splitlines()
+            self.assertEqual(lines[0], ','.join(main.CSV_HEADER))
+            self.assertEqual(lines[1:], ['ID%d,A,,,EUR,I%d,NewRcrd' % (number, number) for number in range(50)])
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['FULINS_test.csv', 'FULINS_test.zip'])
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.SHARD_MIN_BYTES', 0)
+    @patch('module.main.logger', autospec=True)
+    def test_process_zip_file_sharded_partitioned(self, mock_logger):
+        records = ''.join(
+            '<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID%02d</Id><ClssfctnTp>%s</ClssfctnTp><NtnlCcy>%s</NtnlCcy>'
+            '</FinInstrmGnlAttrbts></NewRcrd></FinInstrm>\n' % (number, 'FFICSX' if number % 2 else 'ESVUFR',
+                                                                ('EUR', 'USD')[number % 3 == 0])
+            for number in range(30)
+        )
+        xml_content = ('<BizData><Pyld><Document><FinInstrmRptgRefDataDltaRpt>' + records
+                       + '</FinInstrmRptgRefDataDltaRpt></Document></Pyld></BizData>')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_zip_path = os.path.join(tmp_dir, 'FULINS_test.zip')
+            with zipfile.ZipFile(test_zip_path, 'w') as test_zip:
+                test_zip.writestr('FULINS_test.xml', xml_content)
+
+            partition_by = ('ntnl_ccy', 'cfi')
+            columns = partition_columns(['FinInstrmGnlAttrbts.Id'], partition_by)
+            row = {'file_name': 'FULINS_test.zip', 'zip_path': test_zip_path, 'checksum': 'C1'}
+            result = main.process_zip_file(row, tmp_dir, tmp_dir, columns=columns, shard_workers=3,
+                                           partition_by=partition_by)
+
+            # The partitioned output of the file is cached as one folder
+            self.assertEqual(result['output_path'],
+                             os.path.join(tmp_dir, 'c1' + main.output_cache_suffix('csv', columns, partition_by)))
+            manifest = read_manifest(result['output_path'])
+            self.assertEqual(sorted(manifest['partitions']), ['ntnl_ccy=EUR/cfi=E', 'ntnl_ccy=EUR/cfi=F',
+                                                              'ntnl_ccy=USD/cfi=E', 'ntnl_ccy=USD/cfi=F'])
+            self.assertEqual(manifest['rows'], 30)
+            rows = []
+            for part in manifest['partitions']['ntnl_ccy=USD/cfi=F']['files']:
+                with open(os.path.join(result['output_path'], part), newline='', encoding='utf-8') as csv_file:
+                    rows += csv_file.read().splitlines()[1:]
+            self.assertEqual(sorted(rows), ['ID%02d,USD,FFICSX' % number for number in (3, 9, 15, 21, 27)])
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.get_session')
+    @patch('module.main.download_file')
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.process_zip_file')
+    def test_process_all_files(self, mock_process, mock_logger, mock_download_file, mock_get_session):
+        mock_download_file.side_effect = lambda session, url, save_path, checksum: os.path.basename(save_path)
+        mock_process.side_effect = lambda row, output_dir, cache_dir, output_format, columns, shard_workers, journal_path, partition_by: None if row['file_name'] == 'bad.zip' else {
+            'file_name': row['file_name'], 'output_path': row['file_name'] + '.csv', 'seconds': 1.0
+        }
+        sample_df = pd.DataFrame([
+            {'file_type': 'DLTINS', 'download_link': 'https://example.com/a.zip', 'file_name': 'a.zip'},
+            {'file_type': 'OTHER', 'download_link': 'https://example.com/b.zip', 'file_name': 'b.zip'},
+            {'file_type': 'FULINS', 'download_link': 'https://example.com/c.zip', 'file_name': 'c.zip'},
+            {'file_type': 'DLTINS', 'download_link': 'https://example.com/bad.zip', 'file_name': 'bad.zip'},
+        ])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = main.process_all_files(sample_df, workers=2, output_dir='out', download_concurrency=3, cache_dir=tmp_dir)
+
+        self.assertEqual([result['file_name'] for result in results], ['a.zip', 'c.zip'])
+        self.assertEqual(mock_download_file.call_count, 3)
+        self.assertEqual(mock_process.call_count, 3)
+        self.assertEqual(mock_process.call_args_list[0][0][0]['zip_path'], 'a.zip')
+        mock_logger.info.assert_any_call("%s processed in %.2fs.", 'a.zip', 1.0)
+        mock_logger.info.assert_any_call("Processed %d of %d files with %d workers.", 2, 3, 2)
+
+
+    @patch('module.main.get_session')
+    @patch('module.main.download_file')
+    @patch('module.main.process_zip_file')
+    def test_process_all_files_uses_cache(self, mock_process, mock_download_file, mock_get_session):
+        mock_process.side_effect = lambda row, output_dir, cache_dir, output_format, columns, shard_workers, journal_path, partition_by: {
+            'file_name': row['file_name'], 'output_path': row['zip_path'] + '.csv', 'seconds': 1.0
+        }
+        sample_df = pd.DataFrame([
+            {'file_type': 'DLTINS', 'download_link': 'https://example.com/a.zip', 'file_name': 'a.zip', 'checksum': 'AAA'},
+            {'file_type': 'DLTINS', 'download_link': 'https://example.com/b.zip', 'file_name': 'b.zip', 'checksum': 'bbb'},
+        ])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # a.zip was parsed by an earlier run, b.zip was only downloaded
+            for name in ['aaa' + main.output_cache_suffix('csv'), 'bbb.zip']:
+                with open(os.path.join(tmp_dir, name), 'w') as cached:
+                    cached.write('cached')
+
+            with patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor):
+                results = main.process_all_files(sample_df, output_dir='out', cache_dir=tmp_dir)
+
+            self.assertEqual([result['output_path'] for result in results], [
+                os.path.join(tmp_dir, 'aaa' + main.output_cache_suffix('csv')),
+                os.path.join(tmp_dir, 'bbb.zip') + '.csv',
+            ])
+            mock_download_file.assert_not_called()
+            mock_process.assert_called_once()
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    def test_process_all_files_collects_metrics(self):
+        xml_content = (
+            '<Document><FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID1</Id></FinInstrmGnlAttrbts></NewRcrd></FinInstrm>'
+            '<FinInstrm><CancRcrd><FinInstrmGnlAttrbts><Id>ID2</Id></FinInstrmGnlAttrbts></CancRcrd></FinInstrm></Document>'
+        )
+        metrics.reset_metrics()
+        metrics.enable_metrics()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                zip_path = os.path.join(tmp_dir, 'abc.zip')
+                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as test_zip:
+                    test_zip.writestr('DLTINS_test.xml', xml_content)
+                sample_df = pd.DataFrame([{'file_type': 'DLTINS', 'download_link': 'https://example.com/a.zip',
+                                           'file_name': 'a.zip', 'checksum': 'ABC'}])
+
+                main.process_all_files(sample_df, output_dir=tmp_dir, cache_dir=tmp_dir)
+                stages = metrics.summary()['stages']
+        finally:
+            metrics.disable_metrics()
+            metrics.reset_metrics()
+
+        self.assertEqual(stages['parse']['records'], 2)
+        self.assertGreater(stages['parse']['bytes_out'], 0)
+
+
+    def test_process_all_files_exports_worker_metrics_once(self):
+        xml_content = (
+            '<Document><FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID1</Id></FinInstrmGnlAttrbts></NewRcrd></FinInstrm>'
+            '<FinInstrm><CancRcrd><FinInstrmGnlAttrbts><Id>ID2</Id></FinInstrmGnlAttrbts></CancRcrd></FinInstrm></Document>'
+        )
+        metrics.reset_metrics()
+        metrics.enable_metrics()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                rows = []
+                for checksum in ['aaa', 'bbb']:
+                    with zipfile.ZipFile(os.path.join(tmp_dir, checksum + '.zip'), 'w') as test_zip:
+                        test_zip.writestr('DLTINS_%s.xml' % checksum, xml_content)
+                    rows.append({'file_type': 'DLTINS', 'download_link': 'https://example.com/%s.zip' % checksum,
+                                 'file_name': '%s.zip' % checksum, 'checksum': checksum})
+                # Totals the parent holds when the pool forks its workers
+                metrics.record('index', 0.1)
+
+                # A real pool, the workers are forked processes
+                main.process_all_files(rows, workers=2, output_dir=tmp_dir, cache_dir=tmp_dir)
+                summary_path = os.path.join(tmp_dir, 'metrics.json')
+                main.export_metrics(summary_path)
+                with open(summary_path, encoding='utf-8') as summary_file:
+                    stages = json.load(summary_file)['stages']
+        finally:
+            metrics.disable_metrics()
+            metrics.reset_metrics()
+
+        self.assertEqual(stages['index']['calls'], 1)
+        self.assertEqual((stages['parse']['calls'], stages['parse']['records']), (2, 4))
+
+
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.run_pipeline')
+    def test_process_all_files_forks_workers_before_stages(self, mock_run_pipeline, mock_logger):
+        # The workers have all been forked by the time the stage threads are started
+        mock_run_pipeline.side_effect = lambda rows, stages, queue_size: iter([
+            {'file_name': 'a.zip', 'seconds': 0.0, 'workers': len(multiprocessing.active_children())}
+        ])
+        rows = [{'file_type': 'DLTINS', 'download_link': 'https://example.com/%s.zip' % name, 'file_name': '%s.zip' % name}
+                for name in ['a', 'b', 'c']]
+
+        results = main.process_all_files(rows, workers=2)
+
+        self.assertEqual(results[0]['workers'], 2)
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.download_zip_file')
+    def test_process_all_files_appends_csv_upload(self, mock_download):
+        mock_download.side_effect = lambda link, file_name, checksum, cache_dir: file_name
+        sample_df = pd.DataFrame([
+            {'file_type': 'DLTINS', 'download_link': 'https://example.com/%s.zip' % name, 'file_name': '%s.zip' % name}
+            for name in ['a', 'b', 'c']
+        ])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            def fake_process(row, output_dir, cache_dir, output_format, columns, shard_workers, journal_path, partition_by):
+                output_path = os.path.join(tmp_dir, row['file_name'] + '.csv')
+                with open(output_path, 'w', newline='') as output:
+                    output.write('H\r\n%s\r\n' % row['file_name'])
+                return {'file_name': row['file_name'], 'output_path': output_path, 'seconds': 0.0}
+
+            upload = io.BytesIO()
+            with patch('module.main.process_zip_file', side_effect=fake_process):
+                results = main.process_all_files(sample_df, workers=2, cache_dir=tmp_dir, csv_upload=upload, queue_size=1)
+
+        self.assertEqual([result['file_name'] for result in results], ['a.zip', 'b.zip', 'c.zip'])
+        self.assertEqual(upload.getvalue(), b'H\r\na.zip\r\nb.zip\r\nc.zip\r\n')
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_failed_process_all_files(self, mock_logger):
+        sample_df = pd.DataFrame([
+            {'file_type': 'OTHER', 'download_link': 'https://example.com/b.zip', 'file_name': 'b.zip'}
+        ])
+
+        self.assertEqual(main.process_all_files(sample_df), [])
+        mock_logger.error.assert_called_once_with("Failed to find %s file_type in DataFrame.", "DLTINS/FULINS")
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_merge_csv_outputs(self, mock_logger):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            part_paths = []
+            for name, row in [('a.csv', 'ID1,A,T,false,EUR,I1'), ('b.csv', 'ID2,B,T,true,USD,I2')]:
+                part_path = os.path.join(tmp_dir, name)
+                with open(part_path, 'w', newline='', encoding='utf-8') as part:
+                    part.write(','.join(main.CSV_HEADER) + '\r\n' + row + '\r\n')
+                part_paths.append(part_path)
+
+            merged_path = main.merge_csv_outputs(part_paths, os.path.join(tmp_dir, 'output.csv'))
+
+            with open(merged_path, newline='', encoding='utf-8') as merged:
+                self.assertEqual(merged.read(), ','.join(main.CSV_HEADER) + '\r\nID1,A,T,false,EUR,I1\r\nID2,B,T,true,USD,I2\r\n')
+
+
+    @patch('module.main.get_session')
+    @patch('module.main.download_files')
+    @patch('module.main.logger', autospec=True)
+    def test_update_master(self, mock_logger, mock_download_files, mock_get_session):
+        def delta_zip(tmp_dir, name, records):
+            zip_path = os.path.join(tmp_dir, name + '.zip')
+            with zipfile.ZipFile(zip_path, 'w') as test_zip:
+                test_zip.writestr(name + '.xml', '<BizData><Pyld><Document><FinInstrmRptgRefDataDltaRpt>%s'
+                                  '</FinInstrmRptgRefDataDltaRpt></Document></Pyld></BizData>' % records)
+            return zip_path
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zips = {
+                'c1.zip': delta_zip(tmp_dir, 'DLTINS_1', '<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>ID1</Id>'
+                                          '<NtnlCcy>EUR</NtnlCcy></FinInstrmGnlAttrbts></NewRcrd></FinInstrm>'),
+                'c2.zip': delta_zip(tmp_dir, 'DLTINS_2', '<FinInstrm><ModfdRcrd><FinInstrmGnlAttrbts><Id>ID1</Id>'
+                                          '<NtnlCcy>USD</NtnlCcy></FinInstrmGnlAttrbts></ModfdRcrd></FinInstrm>'),
+            }
+            mock_download_files.side_effect = lambda items, cache_dir, concurrency, session: [zips[item['file_name']] for item in items]
+            sample_df = pd.DataFrame([
+                {'file_type': 'DLTINS', 'file_name': 'DLTINS_2.zip', 'download_link': 'link2',
+                 'publication_date': pd.Timestamp('2021-01-18', tz='UTC')},
+                {'file_type': 'FULINS', 'file_name': 'FULINS_1.zip', 'download_link': 'link3',
+                 'publication_date': pd.Timestamp('2021-01-17', tz='UTC')},
+                {'file_type': 'DLTINS', 'file_name': 'DLTINS_1.zip', 'download_link': 'link1',
+                 'publication_date': pd.Timestamp('2021-01-17', tz='UTC')},
+            ])
+            sample_df['checksum'] = ['c2', 'c3', 'c1']
+            master_path = os.path.join(tmp_dir, 'master.sqlite')
+
+            # Deltas are applied oldest first
+            self.assertEqual(main.update_master(sample_df, master_path, cache_dir=tmp_dir), ['DLTINS_1.zip', 'DLTINS_2.zip'])
+            # A re-run skips the files already applied
+            self.assertEqual(main.update_master(sample_df, master_path, cache_dir=tmp_dir), [])
+            self.assertEqual(mock_download_files.call_count, 1)
+
+            conn = main.open_master(master_path)
+            self.assertEqual(conn.execute("SELECT id, ntnl_ccy FROM instruments").fetchall(), [('ID1', 'USD')])
+            conn.close()
+
+
+    def test_resolve_sink(self):
+        self.assertEqual(main.resolve_sink(), {'bucket': main.s3_bucket_name, 'key': 'output.csv'})
+        self.assertEqual(main.resolve_sink('s3://bucket/firds/', 'parquet'), {'bucket': 'bucket', 'key': 'firds/output.parquet'})
+        self.assertEqual(main.resolve_sink('s3://bucket/firds/run.csv'), {'bucket': 'bucket', 'key': 'firds/run.csv'})
+        self.assertEqual(main.resolve_sink(os.path.join('out', 'run.csv')), {'path': os.path.join('out', 'run.csv')})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertEqual(main.resolve_sink(tmp_dir), {'path': os.path.join(tmp_dir, 'output.csv')})
+            self.assertEqual(main.resolve_sink(tmp_dir, 'parquet', ('cfi',)), {'path': os.path.join(tmp_dir, 'output')})
+        # A partitioned output is a folder or prefix
+        self.assertEqual(main.resolve_sink('s3://bucket/firds/', 'parquet', ('cfi',)), {'bucket': 'bucket', 'key': 'firds/output'})
+        self.assertEqual(main.resolve_sink('by_cfi', 'csv', ('cfi',)), {'path': 'by_cfi'})
+
+
+    def _index_zips(self, tmp_dir, names):
+        rows = []
+        for name in names:
+            with zipfile.ZipFile(os.path.join(tmp_dir, name + '.zip'), 'w') as test_zip:
+                test_zip.writestr('DLTINS_%s.xml' % name, '<Document><FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id>%s'
+                                  '</Id></FinInstrmGnlAttrbts></NewRcrd></FinInstrm></Document>' % name.upper())
+            rows.append({'file_type': 'DLTINS', 'download_link': 'https://example.com/%s.zip' % name,
+                         'file_name': 'DLTINS_%s.zip' % name, 'checksum': name})
+        return rows
+
+
+    @unittest.skipIf(not sinks.load_pyarrow(), "pyarrow is not installed")
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.load_run_index')
+    def test_main_parquet_to_new_sink_folder(self, mock_load_run_index, mock_logger):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mock_load_run_index.return_value = self._index_zips(tmp_dir, ['aaa', 'bbb'])
+            sink_path = os.path.join(tmp_dir, 'sink', 'firds', 'output.parquet')
+
+            finished = main.main(output_format='parquet', sink=sink_path, output_dir=tmp_dir, cache_dir=tmp_dir)
+
+            self.assertTrue(finished)
+            self.assertEqual(sinks.pq.read_table(sink_path).column('FinInstrmGnlAttrbts.Id').to_pylist(), ['AAA', 'BBB'])
+
+
+    @patch('module.main.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('module.main.logger', autospec=True)
+    @patch('module.main.download_file', return_value=None)
+    @patch('module.main.get_session')
+    @patch('module.main.load_run_index')
+    def test_main_does_not_publish_partial_runs(self, mock_load_run_index, mock_get_session, mock_download_file,
+                                               mock_logger):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rows = self._index_zips(tmp_dir, ['aaa'])
+            # The zip of the second file cannot be downloaded
+            rows.append({'file_type': 'DLTINS', 'download_link': 'https://example.com/bbb.zip',
+                         'file_name': 'DLTINS_bbb.zip', 'checksum': 'bbb'})
+            mock_load_run_index.return_value = rows
+            sink_path = os.path.join(tmp_dir, 'sink', 'output.csv')
+            journal_path = os.path.join(tmp_dir, 'journal.sqlite')
+            lookup_path = os.path.join(tmp_dir, 'run.idx')
+
+            with patch('module.main.finish_run') as mock_finish_run:
+                finished = main.main(sink=sink_path, output_dir=tmp_dir, cache_dir=tmp_dir, journal_path=journal_path,
+                                     lookup_path=lookup_path)
+
+            self.assertFalse(finished)
+            self.assertFalse(os.path.exists(sink_path))
+            self.assertFalse(os.path.exists(lookup_path))
+            mock_finish_run.assert_not_called()
+            mock_logger.error.assert_any_call("Failed to process %d of %d files.", 1, 2)
+
+
+    @patch('module.main.evict_cache')
+    @patch('module.main.update_master')
+    @patch('module.main.load_run_index')
+    def test_main_trims_cache_to_limit(self, mock_load_run_index, mock_update_master, mock_evict_cache):
+        main.main(master_path='master.sqlite', cache_dir='cache', cache_max_bytes=1024)
+
+        mock_update_master.assert_called_once()
+        mock_evict_cache.assert_called_once_with('cache', 1024)
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_build_run_lookup(self, mock_logger):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_paths = []
+            for number, rows in enumerate((['ID1,A,,,EUR,I1,NewRcrd'], ['ID1,B,,,USD,I1,ModfdRcrd', 'ID2,C,,,EUR,I2,NewRcrd'])):
+                output_paths.append(os.path.join(tmp_dir, 'DLTINS_%d.csv' % number))
+                with open(output_paths[-1], 'w', encoding='utf-8') as output:
+                    output.write('\n'.join([','.join(main.CSV_HEADER)] + rows) + '\n')
+
+            lookup_path = os.path.join(tmp_dir, 'run.idx')
+            main.build_run_lookup(output_paths, lookup_path)
+
+            with LookupIndex(lookup_path) as index:
+                self.assertEqual(index.get('ID1')['FinInstrmGnlAttrbts.NtnlCcy'], 'USD')
+                self.assertEqual([row['FinInstrmGnlAttrbts.Id'] for row in index.by_issuer('I2')], ['ID2'])
+            mock_logger.info.assert_called_with("Indexed %d instruments in %s.", 2, lookup_path)
+
+
+    def test_workers_for_budget(self):
+        self.assertEqual(main.workers_for_budget(None, 4), 4)
+        self.assertEqual(main.workers_for_budget(main.PARSE_WORKER_BYTES * 2, 4), 2)
+        self.assertEqual(main.workers_for_budget(main.PARSE_WORKER_BYTES * 4, 4, shard_workers=2), 2)
+        # A budget too small for one worker still runs one
+        self.assertEqual(main.workers_for_budget(1024, 4), 1)
+
+
+    @patch('module.main._remote_size', return_value=3000)
+    @patch('module.main.iter_index_pages')
+    @patch('module.main.logger', autospec=True)
+    def test_plan_run(self, mock_logger, mock_iter_index_pages, mock_remote_size):
+        mock_iter_index_pages.return_value = [{'response': {'result': {'@numFound': '2', 'doc': [
+            {'str': [{'@name': 'checksum', '#text': 'c1'}, {'@name': 'download_link', '#text': 'link1'},
+                     {'@name': 'file_name', '#text': 'DLTINS_1.zip'}, {'@name': 'file_type', '#text': 'DLTINS'}],
+             'date': [{'@name': 'publication_date', '#text': '2021-01-17T00:00:00Z'}]},
+            {'str': [{'@name': 'checksum', '#text': 'c2'}, {'@name': 'download_link', '#text': 'link2'},
+                     {'@name': 'file_name', '#text': 'DLTINS_2.zip'}, {'@name': 'file_type', '#text': 'DLTINS'}],
+             'date': [{'@name': 'publication_date', '#text': '2021-01-18T00:00:00Z'}]},
+        ]}}}]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(main.cache_path(tmp_dir, 'c1', '.zip'), 'wb') as cached:
+                cached.write(b'x' * 1000)
+            plan = main.plan_run(cache_dir=tmp_dir)
+
+        self.assertEqual([(entry['file_name'], entry['cached'], entry['zip_bytes']) for entry in plan],
+                         [('DLTINS_1.zip', True, 1000), ('DLTINS_2.zip', False, 3000)])
+        mock_remote_size.assert_called_once_with('link2')
+        self.assertEqual(plan[1]['estimated_xml_bytes'], 3000 * main.XML_COMPRESSION_RATIO)
+        self.assertEqual(plan[1]['estimated_records'], 3000 * main.XML_COMPRESSION_RATIO // main.XML_BYTES_PER_RECORD)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,75 @@
+import unittest
+import os
+import tempfile
+import zipfile
+import module.mapped as mapped
+import module.main as main
+from unittest.mock import patch
+
+
+XML = b'<Document><FinInstrm><NewRcrd><Issr>I1</Issr></NewRcrd></FinInstrm></Document>'
+
+
+class TestMapped(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'DLTINS_test.xml')
+        with open(self.path, 'wb') as xml_file:
+            xml_file.write(XML)
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_iter_chunks(self):
+        with mapped.MappedFile(self.path) as mapped_file:
+            self.assertEqual(len(mapped_file), len(XML))
+            chunks = [bytes(chunk) for chunk in mapped_file.iter_chunks(chunk_size=10)]
+            ranges = [bytes(chunk) for chunk in mapped_file.iter_chunks([(0, 10), (20, 25)], chunk_size=4)]
+
+        self.assertEqual(b''.join(chunks), XML)
+        self.assertEqual(len(chunks[0]), 10)
+        self.assertEqual(ranges, [XML[0:4], XML[4:8], XML[8:10], XML[20:24], XML[24:25]])
+
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+
+        with mapped.MappedFile(self.path) as mapped_file:
+            self.assertEqual(list(mapped_file.iter_chunks()), [])
+
+
+    def test_iter_fin_instrm_from_mapping(self):
+        with mapped.MappedFile(self.path) as mapped_file:
+            records = list(main.iter_fin_instrm(mapped_file))
+
+        self.assertEqual(records, [{'NewRcrd': {'Issr': 'I1'}}])
+
+
+    def test_map_zip_member(self):
+        zip_path = os.path.join(self.tmp_dir.name, 'DLTINS_test.zip')
+        with zipfile.ZipFile(zip_path, 'w') as test_zip:
+            test_zip.writestr('readme.txt', 'x' * 100)
+            test_zip.writestr(zipfile.ZipInfo('DLTINS_test.xml'), XML, zipfile.ZIP_STORED)
+            test_zip.writestr('DLTINS_deflated.xml', XML, zipfile.ZIP_DEFLATED)
+
+        with mapped.map_zip_member(zip_path, 'DLTINS_test.xml') as mapped_file:
+            self.assertEqual(bytes(mapped_file.buffer), XML)
+        self.assertIsNone(mapped.map_zip_member(zip_path, 'DLTINS_deflated.xml'))
+
+
+    @patch('module.main.logger', autospec=True)
+    def test_open_xml_from_zip_maps_stored_member(self, mock_logger):
+        zip_path = os.path.join(self.tmp_dir.name, 'DLTINS_test.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as test_zip:
+            test_zip.writestr('DLTINS_test.xml', XML)
+
+        with main.open_xml_from_zip(zip_path) as xml_source:
+            self.assertIsInstance(xml_source, mapped.MappedFile)
+            self.assertEqual(list(main.iter_fin_instrm(xml_source)), [{'NewRcrd': {'Issr': 'I1'}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import module.master as master
+import os
+import tempfile
+from unittest.mock import patch
+
+
+def record(record_type, id_, currency='EUR', issuer='ISSUER1'):
+    return {record_type: {
+        'FinInstrmGnlAttrbts': {
+            'Id': id_,
+            'FullNm': 'Instrument %s' % id_,
+            'ClssfctnTp': 'FFICSX',
+            'CmmdtyDerivInd': 'false',
+            'NtnlCcy': currency,
+        },
+        'Issr': issuer,
+    }}
+
+
+class TestMaster(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.conn = master.open_master(os.path.join(self.tmp_dir.name, 'master.sqlite'))
+
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+
+    def _instruments(self):
+        return self.conn.execute("SELECT id, ntnl_ccy, record_type, source FROM instruments ORDER BY id").fetchall()
+
+
+    @patch('module.master.logger', autospec=True)
+    def test_apply_delta(self, mock_logger):
+        master.apply_delta(self.conn, [record('NewRcrd', 'ID1'), record('NewRcrd', 'ID2'), record('NewRcrd', 'ID3')],
+                           'checksum1', 'DLTINS_1.zip')
+        counts = master.apply_delta(self.conn, [
+            record('ModfdRcrd', 'ID1', currency='USD'),
+            record('TermntdRcrd', 'ID2'),
+            record('CancRcrd', 'ID3'),
+            record('NewRcrd', 'ID4'),
+            # An empty FinInstrm
+            None,
+        ], 'checksum2', 'DLTINS_2.zip')
+
+        self.assertEqual(counts, {'upserts': 2, 'deletes': 2})
+        self.assertEqual(self._instruments(), [
+            ('ID1', 'USD', 'ModfdRcrd', 'DLTINS_2.zip'),
+            ('ID4', 'EUR', 'NewRcrd', 'DLTINS_2.zip'),
+        ])
+        self.assertTrue(master.is_applied(self.conn, 'checksum1'))
+        self.assertFalse(master.is_applied(self.conn, 'checksum3'))
+        mock_logger.info.assert_called_with("Applied %s to the instrument master: %d upserts, %d deletes.", 'DLTINS_2.zip', 2, 2)
+
+
+    def test_apply_delta_in_batches(self):
+        # Changes to the same id keep their order across and within batches
+        instruments = [record('NewRcrd', 'ID%d' % number) for number in range(5)]
+        instruments += [record('TermntdRcrd', 'ID0'), record('ModfdRcrd', 'ID1', currency='GBP'), record('NewRcrd', 'ID0', currency='CHF')]
+
+        master.apply_delta(self.conn, instruments, batch_size=2)
+
+        self.assertEqual([row[:2] for row in self._instruments()], [
+            ('ID0', 'CHF'), ('ID1', 'GBP'), ('ID2', 'EUR'), ('ID3', 'EUR'), ('ID4', 'EUR'),
+        ])
+
+
+    def test_apply_delta_is_atomic(self):
+        def instruments():
+            yield record('NewRcrd', 'ID1')
+            raise ValueError("truncated file")
+
+        with self.assertRaises(ValueError):
+            master.apply_delta(self.conn, instruments(), 'checksum1', 'DLTINS_1.zip', batch_size=1)
+
+        self.assertEqual(self._instruments(), [])
+        self.assertFalse(master.is_applied(self.conn, 'checksum1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import json
+import os
+import socket
+import tempfile
+import module.metrics as metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset_metrics()
+        metrics.enable_metrics()
+
+
+    def tearDown(self):
+        metrics.disable_metrics()
+        metrics.reset_metrics()
+
+
+    def test_track_disabled_records_nothing(self):
+        metrics.disable_metrics()
+
+        with metrics.track('parse') as span:
+            span.add(records=10, path_out='missing.csv')
+
+        self.assertEqual(metrics.summary()['stages'], {})
+        self.assertNotIn(metrics.METRICS_ENV, os.environ)
+
+
+    def test_track_records_stage_totals(self):
+        with tempfile.NamedTemporaryFile() as output:
+            output.write(b'x' * 100)
+            output.flush()
+            for _ in range(2):
+                with metrics.track('parse', bytes_in=50) as span:
+                    span.add(records=10, path_out=output.name)
+
+        with self.assertRaises(ValueError):
+            with metrics.track('parse'):
+                raise ValueError()
+
+        stage = metrics.summary()['stages']['parse']
+        self.assertEqual(stage['calls'], 3)
+        self.assertEqual(stage['failures'], 1)
+        self.assertEqual(stage['bytes_in'], 100)
+        self.assertEqual(stage['bytes_out'], 200)
+        self.assertEqual(stage['records'], 20)
+        self.assertGreater(stage['records_per_second'], 0)
+        self.assertGreaterEqual(stage['peak_rss_delta'], 0)
+
+
+    def test_drain_and_merge(self):
+        metrics.record('parse', 1.0, records=5, rss_delta=10)
+        worker_totals = metrics.drain()
+        self.assertEqual(metrics.summary()['stages'], {})
+
+        metrics.record('parse', 2.0, records=1, rss_delta=20)
+        metrics.merge(worker_totals)
+        metrics.merge(None)
+
+        stage = metrics.summary()['stages']['parse']
+        self.assertEqual((stage['calls'], stage['seconds'], stage['records'], stage['peak_rss_delta']), (2, 3.0, 6, 20))
+
+
+    def test_write_summary(self):
+        metrics.record('download', 0.5, bytes_in=1024)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'run.json')
+            metrics.write_summary(path)
+            with open(path) as summary_file:
+                run_summary = json.load(summary_file)
+
+        self.assertEqual(run_summary['stages']['download']['bytes_in'], 1024)
+        self.assertIn('peak_rss', run_summary)
+
+
+    def test_prometheus_text(self):
+        metrics.record('parse', 1.5, records=7)
+
+        text = metrics.prometheus_text()
+
+        self.assertIn('# TYPE firds_stage_records_total counter\n', text)
+        self.assertIn('firds_stage_records_total{stage="parse"} 7\n', text)
+        self.assertIn('firds_stage_seconds_total{stage="parse"} 1.5\n', text)
+        self.assertIn('# TYPE firds_stage_peak_rss_delta_bytes gauge\n', text)
+
+
+    def test_send_statsd(self):
+        metrics.record('upload', 0.25, bytes_out=10)
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+            receiver.bind(('127.0.0.1', 0))
+            receiver.settimeout(5)
+            metrics.send_statsd('127.0.0.1:%d' % receiver.getsockname()[1])
+            lines = [receiver.recv(1024).decode() for _ in metrics.statsd_lines()]
+
+        self.assertIn('firds.upload.seconds:250|ms', lines)
+        self.assertIn('firds.upload.bytes_out:10|c', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+import module.partitions as partitions
+import module.sinks as sinks
+import csv
+import os
+import tempfile
+from unittest.mock import patch
+
+
+HEADER = [
+    'FinInstrmGnlAttrbts.Id',
+    'FinInstrmGnlAttrbts.ClssfctnTp',
+    'FinInstrmGnlAttrbts.NtnlCcy',
+    'RecordType'
+]
+
+ROWS = [
+    ('ID3', 'FFICSX', 'EUR', 'NewRcrd'),
+    ('ID2', 'SESTXC', 'USD', 'NewRcrd'),
+    ('ID1', 'FFICSX', 'EUR', 'ModfdRcrd'),
+    ('ID4', 'OCASPS', None, 'TermntdRcrd'),
+]
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def _read_csv(self, path):
+        with open(path, newline='', encoding='utf-8') as csv_file:
+            return list(csv.reader(csv_file))
+
+
+    def test_partition_columns(self):
+        self.assertEqual(partitions.partition_columns(['FinInstrmGnlAttrbts.Id'], ('ntnl_ccy', 'cfi')),
+                         ['FinInstrmGnlAttrbts.Id', 'FinInstrmGnlAttrbts.NtnlCcy', 'FinInstrmGnlAttrbts.ClssfctnTp'])
+        self.assertEqual(partitions.partition_columns(HEADER, ('ntnl_ccy',)), HEADER)
+
+
+    def test_partition_key(self):
+        row = ('ID1', 'FFICSX', 'EUR', 'NewRcrd')
+        self.assertEqual(partitions.partition_key([(2, None), (1, 1)])(row), ('EUR', 'F'))
+        self.assertEqual(partitions.partition_key([(2, None), (0, None)])(row), ('EUR', 'ID1'))
+        self.assertEqual(partitions.partition_key([(2, None)])(row), ('EUR',))
+        self.assertEqual(partitions.partition_key([(1, 1)])(('ID4', None)), (None,))
+
+
+    def test_partitioned_sink_layout_and_stats(self):
+        path = os.path.join(self.tmp_dir.name, 'output')
+        with partitions.PartitionedSink(path, HEADER, ('ntnl_ccy', 'cfi'), 'csv') as sink:
+            sink.write_many(ROWS)
+
+        self.assertEqual(sink.rows, 4)
+        self.assertEqual(self._read_csv(os.path.join(path, 'ntnl_ccy=EUR', 'cfi=F', 'part-00000.csv')),
+                         [HEADER, list(ROWS[0]), list(ROWS[2])])
+        self.assertTrue(os.path.exists(os.path.join(path, 'ntnl_ccy=__HIVE_DEFAULT_PARTITION__', 'cfi=O',
+                                                    'part-00000.csv')))
+
+        manifest = partitions.read_manifest(path)
+        self.assertEqual(manifest['rows'], 4)
+        stats = manifest['partitions']['ntnl_ccy=EUR/cfi=F']
+        self.assertEqual(stats['values'], {'ntnl_ccy': 'EUR', 'cfi': 'F'})
+        self.assertEqual((stats['rows'], stats['min_id'], stats['max_id']), (2, 'ID1', 'ID3'))
+        self.assertEqual(stats['record_types'], {'NewRcrd': 1, 'ModfdRcrd': 1})
+        self.assertEqual(stats['bytes'], os.path.getsize(os.path.join(path, stats['files'][0])))
+
+
+    def test_open_part_files_are_bounded(self):
+        path = os.path.join(self.tmp_dir.name, 'output')
+        opened = []
+
+        class CountingSink(sinks.CsvSink):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                opened.append(self)
+
+        sink = partitions.PartitionedSink(path, HEADER, ('ntnl_ccy',), 'csv', max_open=1, buffer_rows=1)
+        with patch('module.partitions.open_sink',
+                   side_effect=lambda output_format, part_path, header: CountingSink(part_path, header)):
+            sink.write_many(ROWS + [('ID5', 'FFICSX', 'USD', 'NewRcrd')])
+            self.assertEqual(sum(not part._file.closed for part in opened), 1)
+            sink.close()
+
+        # The USD partition was written, closed and written again in a new part file
+        usd = partitions.read_manifest(path)['partitions']['ntnl_ccy=USD']
+        self.assertEqual(usd['files'], ['ntnl_ccy=USD/part-00000.csv', 'ntnl_ccy=USD/part-00001.csv'])
+        self.assertEqual(usd['rows'], 2)
+        self.assertTrue(all(part._file.closed for part in opened))
+
+
+    @unittest.skipIf(not sinks.load_pyarrow(), "pyarrow is not installed")
+    def test_merge_partitioned_outputs(self):
+        first, second = (os.path.join(self.tmp_dir.name, name) for name in ('first', 'second'))
+        with partitions.PartitionedSink(first, HEADER, ('cfi',)) as sink:
+            sink.write_many(ROWS[:2])
+        with partitions.PartitionedSink(second, HEADER, ('cfi',)) as sink:
+            sink.write_many(ROWS[2:])
+
+        merged = os.path.join(self.tmp_dir.name, 'merged')
+        partitions.merge_partitioned_outputs([first, second], merged)
+
+        manifest = partitions.read_manifest(merged)
+        self.assertEqual(manifest['rows'], 4)
+        stats = manifest['partitions']['cfi=F']
+        self.assertEqual(stats['files'], ['cfi=F/part-00000.parquet', 'cfi=F/part-00001.parquet'])
+        self.assertEqual((stats['rows'], stats['min_id'], stats['max_id']), (2, 'ID1', 'ID3'))
+        table = sinks.pq.read_table(os.path.join(merged, 'cfi=F'))
+        self.assertEqual(sorted(table.column('FinInstrmGnlAttrbts.Id').to_pylist()), ['ID1', 'ID3'])
+
+        self.assertEqual(partitions.select_partitions(merged, {'cfi': 'S'}), ['cfi=S'])
+        self.assertEqual(partitions.select_partitions(merged, instrument_id='ID4'), ['cfi=O'])
+
+
+if __name__ == '__main__':
+    unittest.main()
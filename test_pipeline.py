@@ -0,0 +1,78 @@
+import unittest
+import threading
+import time
+import module.pipeline as pipeline
+from unittest.mock import patch
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_results_keep_input_order(self):
+        def slow_square(number):
+            time.sleep(0.01 * (5 - number % 5))
+            return number * number
+
+        stages = [pipeline.Stage('square', slow_square, concurrency=4), pipeline.Stage('negate', lambda number: -number)]
+
+        self.assertEqual(list(pipeline.run_pipeline(range(20), stages)), [-number * number for number in range(20)])
+        self.assertEqual(stages[0].items, 20)
+
+
+    def test_none_results_are_dropped(self):
+        stages = [pipeline.Stage('odd', lambda number: number if number % 2 else None, size=lambda number: number)]
+
+        self.assertEqual(list(pipeline.run_pipeline(range(6), stages)), [1, 3, 5])
+        self.assertEqual(stages[0].bytes, 9)
+
+
+    def test_stage_error_reaches_consumer(self):
+        def fail_on_three(number):
+            if number == 3:
+                raise ValueError("bad item")
+            return number
+
+        results = []
+        with self.assertRaises(ValueError):
+            for result in pipeline.run_pipeline(range(10), [pipeline.Stage('check', fail_on_three)]):
+                results.append(result)
+        self.assertEqual(results, [0, 1, 2])
+
+
+    def test_backpressure_bounds_items_in_flight(self):
+        started = []
+        release = threading.Event()
+
+        def record(number):
+            started.append(number)
+            return number
+
+        def blocked(number):
+            release.wait()
+            return number
+
+        stages = [pipeline.Stage('fast', record, concurrency=2), pipeline.Stage('slow', blocked)]
+        results = pipeline.run_pipeline(range(100), stages, queue_size=1)
+
+        consumer = threading.Thread(target=lambda: self.assertEqual(list(results), list(range(100))))
+        consumer.start()
+        time.sleep(0.3)
+        # The slow stage holds one item, its queue one, the fast stage two in flight and one waiting to be queued
+        self.assertLessEqual(len(started), 6)
+        release.set()
+        consumer.join()
+        self.assertEqual(len(started), 100)
+
+
+    @patch('module.pipeline.logger', autospec=True)
+    def test_early_exit_stops_stages(self, mock_logger):
+        results = pipeline.run_pipeline(iter(range(1000)), [pipeline.Stage('identity', lambda number: number)])
+
+        self.assertEqual(next(results), 0)
+        results.close()
+
+        self.assertFalse([thread for thread in threading.enumerate() if thread.name.startswith('stage-')])
+        mock_logger.info.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
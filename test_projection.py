@@ -0,0 +1,89 @@
+import unittest
+import io
+import module.projection as projection
+import module.main as main
+import xml.etree.ElementTree as ET
+
+
+RECORD = {'NewRcrd': {
+    'FinInstrmGnlAttrbts': {'Id': 'ID1', 'FullNm': 'A', 'NtnlCcy': {'@Ccy': 'x', '#text': 'EUR'}},
+    'Issr': 'I1',
+    'DerivInstrmAttrbts': {
+        'XpryDt': '2022-01-01',
+        'UndrlygInstrm': {'Bskt': {'ISIN': ['ISIN1', 'ISIN2']}},
+    },
+    'TradgVnRltdAttrbts': [{'Id': 'XEUR'}, {'Id': 'XPAR'}],
+}}
+
+XML = (
+    '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:auth.036.001.02"><FinInstrmRptgRefDataDltaRpt>'
+    '<FinInstrm><ModfdRcrd><FinInstrmGnlAttrbts><Id>ID1</Id><FullNm>A</FullNm></FinInstrmGnlAttrbts>'
+    '<Issr>I1</Issr><TradgVnRltdAttrbts><Id>XEUR</Id></TradgVnRltdAttrbts>'
+    '<DerivInstrmAttrbts><XpryDt>2022-01-01</XpryDt></DerivInstrmAttrbts></ModfdRcrd></FinInstrm>'
+    '</FinInstrmRptgRefDataDltaRpt></Document>'
+)
+
+
+class TestProjection(unittest.TestCase):
+
+    def test_compile_extractor_dotted_paths(self):
+        columns = ['FinInstrmGnlAttrbts.Id', 'DerivInstrmAttrbts.XpryDt', 'Issr', 'RecordType', 'Missing.Path']
+        extract = projection.compile_extractor(columns, ['NewRcrd'])
+        self.assertEqual(list(extract([RECORD])), [('ID1', '2022-01-01', 'I1', 'NewRcrd', None)])
+
+
+    def test_compile_extractor_attribute_and_repeated_leaves(self):
+        columns = ['FinInstrmGnlAttrbts.NtnlCcy', 'DerivInstrmAttrbts.UndrlygInstrm.Bskt.ISIN', 'TradgVnRltdAttrbts.Id']
+        extract = projection.compile_extractor(columns, ['NewRcrd'])
+        self.assertEqual(list(extract([RECORD])), [('EUR', 'ISIN1;ISIN2', 'XEUR;XPAR')])
+
+
+    def test_compile_extractor_skips_other_record_types(self):
+        extract = projection.compile_extractor(['Issr'], ['TermntdRcrd'])
+        self.assertEqual(list(extract([RECORD, {'TermntdRcrd': {'Issr': 'I2'}}])), [('I2',)])
+
+
+    def test_compile_extractor_skips_empty_records(self):
+        extract = projection.compile_extractor(['Issr', 'RecordType'], ['NewRcrd'])
+        self.assertEqual(list(extract([RECORD, {}, None, {'NewRcrd': None}])), [('I1', 'NewRcrd'), (None, 'NewRcrd')])
+
+
+    def test_element_extractor_matches_dict_extractor(self):
+        xml = (
+            '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:auth.036.001.02"><FinInstrmRptgRefDataDltaRpt>'
+            '<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><Id> ID1 </Id><NtnlCcy Ccy="x">EUR</NtnlCcy>'
+            '<ClssfctnTp>FFICSX</ClssfctnTp><FullNm/></FinInstrmGnlAttrbts><Issr>I1</Issr>'
+            '<DerivInstrmAttrbts><UndrlygInstrm><Bskt><ISIN>ISIN1</ISIN><ISIN>ISIN2</ISIN></Bskt></UndrlygInstrm>'
+            '</DerivInstrmAttrbts><TradgVnRltdAttrbts><Id>XEUR</Id></TradgVnRltdAttrbts>'
+            '<TradgVnRltdAttrbts><Id>XPAR</Id></TradgVnRltdAttrbts></NewRcrd></FinInstrm>'
+            '<FinInstrm><UnknownRcrd><Issr>I2</Issr></UnknownRcrd></FinInstrm><FinInstrm/>'
+            '<FinInstrm><TermntdRcrd><Issr>I3</Issr></TermntdRcrd></FinInstrm>'
+            '</FinInstrmRptgRefDataDltaRpt></Document>'
+        )
+        columns = ['FinInstrmGnlAttrbts.Id', 'FinInstrmGnlAttrbts.FullNm', 'FinInstrmGnlAttrbts.NtnlCcy',
+                   'FinInstrmGnlAttrbts.NtnlCcy.@Ccy', 'FinInstrmGnlAttrbts.ClssfctnTp', 'Issr',
+                   'DerivInstrmAttrbts.UndrlygInstrm.Bskt.ISIN', 'TradgVnRltdAttrbts.Id', 'RecordType', 'Missing.Path']
+        record_types = ['NewRcrd', 'TermntdRcrd']
+
+        by_element = list(projection.compile_element_extractor(columns, record_types)(
+            main.iter_fin_instrm_elements(io.BytesIO(xml.encode()))))
+        by_dict = list(projection.compile_extractor(columns, record_types)(
+            main.iter_fin_instrm(io.BytesIO(xml.encode()))))
+
+        self.assertEqual(by_element, by_dict)
+        self.assertEqual(by_element[0], ('ID1', None, 'EUR', 'x', 'FFICSX', 'I1', 'ISIN1;ISIN2', 'XEUR;XPAR', 'NewRcrd', None))
+        self.assertEqual(by_element[1][5], 'I3')
+
+
+    def test_element_extractor_interns_repeated_values(self):
+        extract = projection.compile_element_extractor(['FinInstrmGnlAttrbts.NtnlCcy'], ['NewRcrd'])
+        records = [ET.fromstring('<FinInstrm><NewRcrd><FinInstrmGnlAttrbts><NtnlCcy>%s</NtnlCcy>'
+                                 '</FinInstrmGnlAttrbts></NewRcrd></FinInstrm>' % ''.join(['E', 'U', 'R']))
+                   for _ in range(2)]
+
+        first, second = extract(records)
+        self.assertIs(first[0], second[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import module.s3_upload as s3_upload
+import csv
+import os
+import tempfile
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from unittest.mock import patch
+
+
+BUCKET = 'test-csv-bucket'
+PART_SIZE = 5 * 1024 * 1024
+
+
+@mock_aws
+class TestS3Upload(unittest.TestCase):
+
+    def setUp(self):
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket=BUCKET)
+
+
+    def _body(self, key):
+        return self.client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+    def test_multipart_upload(self):
+        data = b''.join(b'%09d\n' % number for number in range(1_200_000))
+
+        with s3_upload.MultipartUploader(BUCKET, 'big.csv', client=self.client, part_size=PART_SIZE, concurrency=2) as upload:
+            for start in range(0, len(data), 65536):
+                upload.write(data[start:start + 65536])
+
+        self.assertEqual(self._body('big.csv'), data)
+        parts = self.client.head_object(Bucket=BUCKET, Key='big.csv')['ETag']
+        self.assertTrue(parts.endswith('-3"'))
+
+
+    def test_open_text_upload(self):
+        with s3_upload.open_text_upload(BUCKET, 'rows.csv', client=self.client) as output:
+            csv.writer(output).writerows([['ID1', 'EUR'], ['ID2', 'USD']])
+
+        self.assertEqual(self._body('rows.csv'), b'ID1,EUR\r\nID2,USD\r\n')
+
+
+    def test_empty_upload(self):
+        with s3_upload.open_text_upload(BUCKET, 'empty.csv', client=self.client):
+            pass
+
+        self.assertEqual(self._body('empty.csv'), b'')
+
+
+    @patch('module.s3_upload.time.sleep')
+    def test_part_is_retried(self, mock_sleep):
+        upload_part = self.client.upload_part
+        failures = []
+
+        def flaky_upload_part(**kwargs):
+            if kwargs['PartNumber'] == 2 and not failures:
+                failures.append(kwargs['PartNumber'])
+                raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow down'}}, 'UploadPart')
+            return upload_part(**kwargs)
+
+        with patch.object(self.client, 'upload_part', side_effect=flaky_upload_part) as mock_upload_part:
+            with s3_upload.MultipartUploader(BUCKET, 'retry.csv', client=self.client, part_size=PART_SIZE) as upload:
+                upload.write(b'x' * (PART_SIZE * 2 + 10))
+
+        self.assertEqual(failures, [2])
+        self.assertEqual(mock_upload_part.call_count, 4)
+        self.assertEqual(len(self._body('retry.csv')), PART_SIZE * 2 + 10)
+
+
+    @patch('module.s3_upload.logger', autospec=True)
+    def test_upload_aborted_on_error(self, mock_logger):
+        with self.assertRaises(ValueError):
+            with s3_upload.open_text_upload(BUCKET, 'failed.csv', client=self.client) as output:
+                output.write('partial')
+                raise ValueError("parse failed")
+
+        self.assertNotIn('Uploads', self.client.list_multipart_uploads(Bucket=BUCKET))
+        self.assertNotIn('Contents', self.client.list_objects_v2(Bucket=BUCKET))
+        mock_logger.error.assert_called_once_with("Aborting multipart upload to s3://%s/%s.", BUCKET, 'failed.csv')
+
+
+    def test_upload_folder(self):
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'ntnl_ccy=EUR', 'cfi=F'))
+            with open(os.path.join(folder, 'ntnl_ccy=EUR', 'cfi=F', 'part-00000.csv'), 'wb') as part:
+                part.write(b'ID1,EUR\r\n')
+            with open(os.path.join(folder, '_partitions.json'), 'wb') as manifest:
+                manifest.write(b'{}')
+
+            keys = s3_upload.upload_folder(folder, BUCKET, 'firds/output/', client=self.client)
+
+        self.assertEqual(keys, ['firds/output/_partitions.json', 'firds/output/ntnl_ccy=EUR/cfi=F/part-00000.csv'])
+        self.assertEqual(self._body('firds/output/ntnl_ccy=EUR/cfi=F/part-00000.csv'), b'ID1,EUR\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
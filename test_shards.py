@@ -0,0 +1,142 @@
+import unittest
+import os
+import tempfile
+import module.shards as shards
+from module.mapped import MappedFile
+from unittest.mock import patch
+
+
+HEADER = b'<?xml version="1.0"?><Document xmlns:a="urn:x"><a:Rpt><a:RptHdr><a:Dt>2021</a:Dt></a:RptHdr>\n'
+FOOTER = b'</a:Rpt></Document>\n'
+
+
+def record(number):
+    return b'<a:FinInstrm><a:NewRcrd><a:FinInstrmGnlAttrbts><a:Id>ID%d</a:Id></a:FinInstrmGnlAttrbts></a:NewRcrd></a:FinInstrm>\n' % number
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'FULINS_test.xml')
+        self.records = [record(number) for number in range(100)]
+        with open(self.path, 'wb') as xml_file:
+            xml_file.write(HEADER + b''.join(self.records) + FOOTER)
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    @patch('module.shards.SCAN_SIZE', 256)
+    def test_shard_ranges_align_to_records(self):
+        with MappedFile(self.path) as mapped:
+            layout = shards.shard_ranges(mapped, 7)
+
+        self.assertEqual(layout['header'], (0, len(HEADER)))
+        # The newline after the last record belongs to the footer
+        self.assertEqual(layout['footer'][1] - layout['footer'][0], len(FOOTER) + 1)
+        self.assertEqual(len(layout['shards']), 7)
+
+        with open(self.path, 'rb') as xml_file:
+            data = xml_file.read()
+        shard_bytes = [data[start:end] for start, end in layout['shards']]
+        self.assertEqual(b''.join(shard_bytes), b''.join(self.records)[:-1])
+        for chunk in shard_bytes:
+            self.assertTrue(chunk.startswith(b'<a:FinInstrm>'))
+            self.assertTrue(chunk.rstrip().endswith(b'</a:FinInstrm>'))
+
+
+    def test_shard_ranges_fulins_records(self):
+        # FULINS records are RefData elements, whose tag the report element around them contains
+        header = b'<Document xmlns:a="urn:x"><a:FinInstrmRptgRefDataRpt><a:RptHdr/>\n'
+        records = [b'<a:RefData><a:FinInstrmGnlAttrbts><a:Id>ID%d</a:Id></a:FinInstrmGnlAttrbts></a:RefData>\n' % number
+                   for number in range(10)]
+        with open(self.path, 'wb') as xml_file:
+            xml_file.write(header + b''.join(records) + b'</a:FinInstrmRptgRefDataRpt></Document>\n')
+
+        with MappedFile(self.path) as mapped:
+            layout = shards.shard_ranges(mapped, 3)
+
+        self.assertEqual(layout['header'], (0, len(header)))
+        self.assertEqual(len(layout['shards']), 3)
+        self.assertEqual(layout['shards'][-1][1], len(header) + len(b''.join(records)) - 1)
+
+
+    def test_shard_ranges_count_empty_records(self):
+        # Self-closing records start and end shards like any other record, the last one too
+        records = [record(number) if number % 3 else b'<a:FinInstrm/>\n' for number in range(1, 31)]
+        with open(self.path, 'wb') as xml_file:
+            xml_file.write(HEADER + b''.join(records) + FOOTER)
+
+        with MappedFile(self.path) as mapped:
+            layout = shards.shard_ranges(mapped, 7)
+            shard_bytes = [bytes(mapped.buffer[start:end]) for start, end in layout['shards']]
+
+        self.assertEqual(b''.join(shard_bytes), b''.join(records)[:-1])
+        self.assertTrue(any(chunk.startswith(b'<a:FinInstrm/>') for chunk in shard_bytes))
+        for chunk in shard_bytes:
+            self.assertTrue(chunk.startswith(b'<a:FinInstrm'))
+
+
+    def test_record_offsets_count_empty_records(self):
+        chunks = [HEADER + record(0), b'<a:FinInstrm/>', record(2)]
+        offsets = shards.RecordOffsets(chunks)
+        list(offsets)
+
+        self.assertEqual(offsets.record_offset(1), len(HEADER + record(0)))
+        self.assertEqual(offsets.record_offset(2), len(HEADER + record(0)) + len(b'<a:FinInstrm/>'))
+
+
+    def test_shard_ranges_more_shards_than_records(self):
+        with open(self.path, 'wb') as xml_file:
+            xml_file.write(HEADER + record(1) + record(2) + FOOTER)
+
+        with MappedFile(self.path) as mapped:
+            layout = shards.shard_ranges(mapped, 16)
+
+        self.assertEqual(len(layout['shards']), 2)
+
+
+    @patch('module.shards.logger', autospec=True)
+    def test_shard_ranges_no_records(self, mock_logger):
+        with open(self.path, 'wb') as xml_file:
+            xml_file.write(HEADER + FOOTER)
+
+        with MappedFile(self.path) as mapped:
+            self.assertIsNone(shards.shard_ranges(mapped, 4))
+        mock_logger.error.assert_called_once_with("No FinInstrm record found in %s.", self.path)
+
+
+    def test_shard_document_is_standalone(self):
+        with MappedFile(self.path) as mapped:
+            layout = shards.shard_ranges(mapped, 3)
+            content = b''.join(bytes(chunk) for chunk in mapped.iter_chunks(shards.shard_document(layout, 1)))
+
+        with open(self.path, 'rb') as xml_file:
+            data = xml_file.read()
+        start, end = layout['shards'][1]
+        self.assertEqual(content, HEADER + data[start:end] + data[layout['footer'][0]:])
+
+
+    def test_record_offsets_across_chunks(self):
+        with open(self.path, 'rb') as xml_file:
+            data = xml_file.read()
+        expected = [match.start() for match in shards.RECORD_START.finditer(data)]
+
+        # Chunks as small as a few bytes split every start tag somewhere
+        for chunk_size in (3, 7, 64, 1024):
+            offsets = shards.RecordOffsets(data[position:position + chunk_size]
+                                           for position in range(0, len(data), chunk_size))
+            self.assertEqual(b''.join(offsets), data)
+            self.assertEqual(list(offsets.starts), expected)
+
+        self.assertEqual(offsets.record_offset(2), expected[2])
+        self.assertEqual(offsets.record_offset(3), expected[3])
+        # Earlier records are forgotten once a later one was looked up
+        self.assertIsNone(offsets.record_offset(2))
+        self.assertIsNone(offsets.record_offset(len(expected)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import module.sinks as sinks
+import os
+import tempfile
+
+
+HEADER = [
+    'FinInstrmGnlAttrbts.Id',
+    'FinInstrmGnlAttrbts.FullNm',
+    'FinInstrmGnlAttrbts.ClssfctnTp',
+    'FinInstrmGnlAttrbts.CmmdtyDerivInd',
+    'FinInstrmGnlAttrbts.NtnlCcy',
+    'Issr'
+]
+
+ROWS = [
+    ['ID1', 'Instrument A', 'FFICSX', 'false', 'EUR', 'ISSUER1'],
+    ['ID2', 'Instrument B', 'SESTXC', 'true', 'USD', 'ISSUER2'],
+    ['ID3', 'Instrument C', 'FFICSX', None, 'EUR', 'ISSUER1'],
+]
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_csv_sink(self):
+        path = os.path.join(self.tmp_dir.name, 'out' + sinks.sink_extension('csv'))
+        with sinks.open_sink('csv', path, HEADER) as sink:
+            sink.write(ROWS[0])
+            sink.write_many(ROWS[1:])
+
+        with open(path, newline='', encoding='utf-8') as csv_file:
+            self.assertEqual(csv_file.read().splitlines(), [
+                ','.join(HEADER),
+                'ID1,Instrument A,FFICSX,false,EUR,ISSUER1',
+                'ID2,Instrument B,SESTXC,true,USD,ISSUER2',
+                'ID3,Instrument C,FFICSX,,EUR,ISSUER1',
+            ])
+
+
+    @unittest.skipIf(not sinks.load_pyarrow(), "pyarrow is not installed")
+    def test_parquet_sink(self):
+        path = os.path.join(self.tmp_dir.name, 'out' + sinks.sink_extension('parquet'))
+        with sinks.ParquetSink(path, HEADER, batch_size=2) as sink:
+            sink.write_many(ROWS)
+
+        parquet_file = sinks.pq.ParquetFile(path)
+        self.assertEqual(parquet_file.num_row_groups, 2)
+
+        table = parquet_file.read()
+        self.assertTrue(sinks.pa.types.is_dictionary(table.schema.field('FinInstrmGnlAttrbts.NtnlCcy').type))
+        self.assertTrue(sinks.pa.types.is_dictionary(table.schema.field('FinInstrmGnlAttrbts.ClssfctnTp').type))
+        self.assertEqual(table.column('FinInstrmGnlAttrbts.CmmdtyDerivInd').to_pylist(), [False, True, None])
+        self.assertEqual(table.column('FinInstrmGnlAttrbts.NtnlCcy').to_pylist(), ['EUR', 'USD', 'EUR'])
+        self.assertEqual(parquet_file.metadata.row_group(0).column(0).compression, 'ZSTD')
+
+        # Column-pruned reads only touch the requested column
+        pruned = sinks.pq.read_table(path, columns=['FinInstrmGnlAttrbts.Id'])
+        self.assertEqual(pruned.column_names, ['FinInstrmGnlAttrbts.Id'])
+
+
+    @unittest.skipIf(not sinks.load_pyarrow(), "pyarrow is not installed")
+    def test_merge_parquet_files(self):
+        paths = []
+        for number, rows in enumerate([ROWS[:2], ROWS[2:]]):
+            path = os.path.join(self.tmp_dir.name, 'part-%d.parquet' % number)
+            with sinks.open_sink('parquet', path, HEADER) as sink:
+                sink.write_many(rows)
+            paths.append(path)
+
+        merged_path = sinks.merge_parquet_files(paths, os.path.join(self.tmp_dir.name, 'output.parquet'))
+
+        table = sinks.pq.read_table(merged_path)
+        self.assertEqual(table.column('FinInstrmGnlAttrbts.Id').to_pylist(), ['ID1', 'ID2', 'ID3'])
+
+
+if __name__ == '__main__':
+    unittest.main()